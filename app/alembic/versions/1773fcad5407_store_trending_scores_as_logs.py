@@ -0,0 +1,30 @@
+"""store trending scores as logs
+
+Revision ID: 1773fcad5407
+Revises: 891601ba4677
+Create Date: 2026-10-18 09:31:07.664021
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1773fcad5407'
+down_revision: Union[str, None] = '891601ba4677'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# trending_score holds ln(decayed activity * growth) and is NULL without
+# activity; the existing scaled scores map across directly
+def upgrade() -> None:
+    op.alter_column('movie_leaderboard', 'trending_score', existing_type=sa.Float(), nullable=True, server_default=None)
+    op.execute("UPDATE movie_leaderboard SET trending_score = CASE WHEN trending_score > 0 THEN ln(trending_score) END")
+
+
+def downgrade() -> None:
+    op.execute("UPDATE movie_leaderboard SET trending_score = COALESCE(exp(trending_score), 0)")
+    op.alter_column('movie_leaderboard', 'trending_score', existing_type=sa.Float(), nullable=False, server_default='0')
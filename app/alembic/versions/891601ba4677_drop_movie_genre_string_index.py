@@ -0,0 +1,27 @@
+"""drop movie genre string index
+
+Revision ID: 891601ba4677
+Revises: d6f7cb1c85a1
+Create Date: 2026-10-18 09:12:40.218554
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '891601ba4677'
+down_revision: Union[str, None] = 'd6f7cb1c85a1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Genre filters go through movie_genres now, so nothing reads this index
+def upgrade() -> None:
+    op.drop_index('ix_movies_genre_created_at_movie_id', table_name='movies')
+
+
+def downgrade() -> None:
+    op.create_index('ix_movies_genre_created_at_movie_id', 'movies', ['genre', 'created_at', 'movie_id'])
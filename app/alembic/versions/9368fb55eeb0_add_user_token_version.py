@@ -0,0 +1,27 @@
+"""add user token version
+
+Revision ID: 9368fb55eeb0
+Revises: bb22f2c3fce4
+Create Date: 2026-10-18 04:59:26.026925
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9368fb55eeb0'
+down_revision: Union[str, None] = 'bb22f2c3fce4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('token_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('token_version')
@@ -0,0 +1,90 @@
+"""add normalized genres
+
+Revision ID: 9991759c83f3
+Revises: feda231c313e
+Create Date: 2026-10-18 05:07:07.084455
+
+"""
+from typing import Sequence, Union
+
+import re
+import unicodedata
+from collections import Counter
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9991759c83f3'
+down_revision: Union[str, None] = 'feda231c313e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+BATCH_SIZE = 1000
+
+
+# Frozen copies of slugs.slugify and genres.split_genres as they were when
+# this revision was written
+def _slugify(name):
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "-", ascii_name.lower()).strip("-")[:200] or "movie"
+
+
+def _split_genres(text):
+    genres = {}
+    for part in re.split(r"[,/|;]", text or ""):
+        name = " ".join(part.split())
+        if re.search(r"[A-Za-z0-9]", name):
+            genres.setdefault(_slugify(name)[:100], name[:100])
+    return genres
+
+
+def upgrade() -> None:
+    genres = op.create_table(
+        'genres',
+        sa.Column('genre_id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('name', sa.String(100), nullable=False),
+        sa.Column('slug', sa.String(100), nullable=False, unique=True),
+    )
+    movie_genres = op.create_table(
+        'movie_genres',
+        sa.Column('movie_id', sa.Integer(), sa.ForeignKey('movies.movie_id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('genre_id', sa.Integer(), sa.ForeignKey('genres.genre_id', ondelete='CASCADE'), primary_key=True),
+    )
+    op.create_index('ix_movie_genres_genre_id_movie_id', 'movie_genres', ['genre_id', 'movie_id'])
+    genre_counts = op.create_table(
+        'genre_counts',
+        sa.Column('genre_id', sa.Integer(), sa.ForeignKey('genres.genre_id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('movie_count', sa.Integer(), nullable=False, server_default='0'),
+    )
+
+    # Split every existing genre string; the tables are new, so plain inserts
+    # do. The splitting happens in Python, so an offline --sql script only
+    # creates the tables and needs an online upgrade to backfill them.
+    if op.get_context().as_sql:
+        return
+    connection = op.get_bind()
+    movies = connection.execute(sa.text('SELECT movie_id, genre FROM movies')).all()
+    names, tags = {}, []
+    for movie_id, genre in movies:
+        for slug, name in _split_genres(genre).items():
+            names.setdefault(slug, name)
+            tags.append((movie_id, slug))
+    if not names:
+        return
+    connection.execute(genres.insert(), [{'slug': slug, 'name': name} for slug, name in sorted(names.items())])
+    ids = dict(connection.execute(sa.text('SELECT slug, genre_id FROM genres')).all())
+    rows = [{'movie_id': movie_id, 'genre_id': ids[slug]} for movie_id, slug in tags]
+    for start in range(0, len(rows), BATCH_SIZE):
+        connection.execute(movie_genres.insert(), rows[start:start + BATCH_SIZE])
+    counts = Counter(row['genre_id'] for row in rows)
+    connection.execute(genre_counts.insert(), [{'genre_id': genre_id, 'movie_count': count} for genre_id, count in sorted(counts.items())])
+
+
+def downgrade() -> None:
+    op.drop_table('genre_counts')
+    op.drop_index('ix_movie_genres_genre_id_movie_id', table_name='movie_genres')
+    op.drop_table('movie_genres')
+    op.drop_table('genres')
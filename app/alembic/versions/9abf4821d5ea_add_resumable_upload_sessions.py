@@ -0,0 +1,38 @@
+"""add resumable upload sessions
+
+Revision ID: 9abf4821d5ea
+Revises: aead9f0a4cfd
+Create Date: 2026-10-18 04:46:50.661804
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9abf4821d5ea'
+down_revision: Union[str, None] = 'aead9f0a4cfd'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'upload_sessions',
+        sa.Column('upload_id', sa.String(length=36), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=True),
+        sa.ForeignKeyConstraint(['movie_id'], ['movies.movie_id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.user_id']),
+        sa.PrimaryKeyConstraint('upload_id'),
+    )
+    op.create_index('ix_upload_sessions_movie_id', 'upload_sessions', ['movie_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_upload_sessions_movie_id', table_name='upload_sessions')
+    op.drop_table('upload_sessions')
@@ -0,0 +1,37 @@
+"""index genre pages by created_at
+
+Revision ID: 9b75081c572c
+Revises: 1773fcad5407
+Create Date: 2026-10-18 10:41:27.503816
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b75081c572c'
+down_revision: Union[str, None] = '1773fcad5407'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# movie_genres carries a copy of movies.created_at, so a genre-filtered
+# /movies/ page can seek on (genre_id, created_at, movie_id)
+def upgrade() -> None:
+    op.add_column('movie_genres', sa.Column('created_at', sa.TIMESTAMP(), nullable=True))
+    op.execute(
+        'UPDATE movie_genres SET created_at = '
+        '(SELECT movies.created_at FROM movies WHERE movies.movie_id = movie_genres.movie_id)'
+    )
+    op.create_index(
+        'ix_movie_genres_genre_id_created_at_movie_id', 'movie_genres', ['genre_id', 'created_at', 'movie_id']
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_movie_genres_genre_id_created_at_movie_id', table_name='movie_genres')
+    with op.batch_alter_table('movie_genres') as batch_op:
+        batch_op.drop_column('created_at')
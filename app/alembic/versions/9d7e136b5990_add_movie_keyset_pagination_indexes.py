@@ -0,0 +1,33 @@
+"""add movie keyset pagination indexes
+
+Revision ID: 9d7e136b5990
+Revises: 
+Create Date: 2026-10-18 04:44:17.637629
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d7e136b5990'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('movies', sa.Column('release_year', sa.Integer(), nullable=True))
+    op.execute("UPDATE movies SET release_year = CAST(substr(release_date, 1, 4) AS INTEGER)")
+    op.create_index('ix_movies_created_at_movie_id', 'movies', ['created_at', 'movie_id'])
+    op.create_index('ix_movies_genre_created_at_movie_id', 'movies', ['genre', 'created_at', 'movie_id'])
+    op.create_index('ix_movies_release_year_created_at_movie_id', 'movies', ['release_year', 'created_at', 'movie_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_movies_release_year_created_at_movie_id', table_name='movies')
+    op.drop_index('ix_movies_genre_created_at_movie_id', table_name='movies')
+    op.drop_index('ix_movies_created_at_movie_id', table_name='movies')
+    op.drop_column('movies', 'release_year')
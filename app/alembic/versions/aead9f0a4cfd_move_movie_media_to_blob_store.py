@@ -0,0 +1,130 @@
+"""move movie media to blob store
+
+Revision ID: aead9f0a4cfd
+Revises: 9d7e136b5990
+Create Date: 2026-10-18 04:45:16.819773
+
+"""
+from typing import Sequence, Union
+
+import os
+import hashlib
+import tempfile
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'aead9f0a4cfd'
+down_revision: Union[str, None] = '9d7e136b5990'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+MEDIA = ('video', 'coverimage')
+
+
+# Frozen copy of the blob layout storage.py used when this revision was
+# written: blobs are keyed by their sha256 and kept under BLOB_STORE_PATH,
+# or in BLOB_STORE_BUCKET/BLOB_STORE_PREFIX when BLOB_STORE is s3
+def _content_key(checksum):
+    return f"sha256/{checksum[:2]}/{checksum[2:4]}/{checksum}"
+
+
+class _LocalBlobs:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def put(self, key, data):
+        target = self._path(key)
+        if os.path.exists(target):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, spool_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".part")
+        with os.fdopen(fd, "wb") as spool:
+            spool.write(data)
+        os.replace(spool_path, target)
+
+    def get(self, key):
+        with open(self._path(key), "rb") as blob:
+            return blob.read()
+
+
+class _S3Blobs:
+    def __init__(self, bucket, prefix):
+        import boto3
+
+        self.client = boto3.client("s3")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _object_key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data)
+
+    def get(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))["Body"].read()
+
+
+def _blobs():
+    if os.environ.get("BLOB_STORE", "local") == "s3":
+        return _S3Blobs(os.environ["BLOB_STORE_BUCKET"], os.environ.get("BLOB_STORE_PREFIX", ""))
+    return _LocalBlobs(os.environ.get("BLOB_STORE_PATH", "media"))
+
+
+def upgrade() -> None:
+    for kind in MEDIA:
+        op.add_column('movies', sa.Column(f'{kind}_key', sa.String(length=255), nullable=True))
+        op.add_column('movies', sa.Column(f'{kind}_size', sa.BigInteger(), nullable=True))
+        op.add_column('movies', sa.Column(f'{kind}_checksum', sa.String(length=64), nullable=True))
+        op.create_index(f'ix_movies_{kind}_key', 'movies', [f'{kind}_key'])
+
+    # Copy one blob at a time so the migration never holds more than a single file in memory
+    conn = op.get_bind()
+    blobs = _blobs()
+    for kind in MEDIA:
+        movie_ids = conn.execute(sa.text(f"SELECT movie_id FROM movies WHERE {kind}_data IS NOT NULL")).scalars().all()
+        for movie_id in movie_ids:
+            data = conn.execute(
+                sa.text(f"SELECT {kind}_data FROM movies WHERE movie_id = :movie_id"), {"movie_id": movie_id}
+            ).scalar_one()
+            data = bytes(data)
+            checksum = hashlib.sha256(data).hexdigest()
+            key = _content_key(checksum)
+            blobs.put(key, data)
+            conn.execute(
+                sa.text(f"UPDATE movies SET {kind}_key = :key, {kind}_size = :size, {kind}_checksum = :checksum WHERE movie_id = :movie_id"),
+                {"key": key, "size": len(data), "checksum": checksum, "movie_id": movie_id},
+            )
+
+    with op.batch_alter_table('movies') as batch_op:
+        batch_op.drop_column('video_data')
+        batch_op.drop_column('coverimage_data')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('movies') as batch_op:
+        batch_op.add_column(sa.Column('video_data', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('coverimage_data', sa.LargeBinary(), nullable=True))
+
+    conn = op.get_bind()
+    blobs = _blobs()
+    for kind in MEDIA:
+        rows = conn.execute(sa.text(f"SELECT movie_id, {kind}_key FROM movies WHERE {kind}_key IS NOT NULL")).all()
+        for movie_id, key in rows:
+            conn.execute(
+                sa.text(f"UPDATE movies SET {kind}_data = :data WHERE movie_id = :movie_id"),
+                {"data": blobs.get(key), "movie_id": movie_id},
+            )
+
+    for kind in MEDIA:
+        op.drop_index(f'ix_movies_{kind}_key', table_name='movies')
+        with op.batch_alter_table('movies') as batch_op:
+            batch_op.drop_column(f'{kind}_checksum')
+            batch_op.drop_column(f'{kind}_size')
+            batch_op.drop_column(f'{kind}_key')
@@ -0,0 +1,56 @@
+"""make ratings unique per user and movie
+
+Revision ID: bb22f2c3fce4
+Revises: fbe7c417da09
+Create Date: 2026-10-18 04:51:07.950106
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bb22f2c3fce4'
+down_revision: Union[str, None] = 'fbe7c417da09'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+STARS = range(1, 6)
+
+# SQLite rebuilds the table in batch mode and does not carry over unnamed
+# CHECK constraints, so hand the rating range check back explicitly
+RATING_CHECK = (sa.CheckConstraint('rating >= 1 AND rating <= 5'),)
+
+
+def upgrade() -> None:
+    # Races in the old check-then-insert path may have left duplicates; keep
+    # each user's latest rating of a movie
+    op.execute(
+        "DELETE FROM ratings WHERE rating_id NOT IN ("
+        "SELECT MAX(rating_id) FROM ratings GROUP BY user_id, movie_id)"
+    )
+    star_assignments = ", ".join(
+        f"stars_{star} = (SELECT COUNT(*) FROM ratings WHERE ratings.movie_id = movie_rating_stats.movie_id AND ratings.rating = {star})"
+        for star in STARS
+    )
+    op.execute(
+        "UPDATE movie_rating_stats SET "
+        "rating_count = (SELECT COUNT(*) FROM ratings WHERE ratings.movie_id = movie_rating_stats.movie_id), "
+        "rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM ratings WHERE ratings.movie_id = movie_rating_stats.movie_id), "
+        f"{star_assignments}"
+    )
+
+    op.drop_index('ix_ratings_user_id', table_name='ratings')
+    with op.batch_alter_table('ratings', table_args=RATING_CHECK) as batch_op:
+        batch_op.add_column(sa.Column('previous_rating', sa.Integer(), nullable=True))
+        batch_op.create_unique_constraint('uq_ratings_user_id_movie_id', ['user_id', 'movie_id'])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('ratings', table_args=RATING_CHECK) as batch_op:
+        batch_op.drop_constraint('uq_ratings_user_id_movie_id', type_='unique')
+        batch_op.drop_column('previous_rating')
+    op.create_index('ix_ratings_user_id', 'ratings', ['user_id'])
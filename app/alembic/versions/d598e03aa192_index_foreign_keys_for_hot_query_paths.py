@@ -0,0 +1,44 @@
+"""index foreign keys for hot query paths
+
+Revision ID: d598e03aa192
+Revises: f0e388faf46b
+Create Date: 2026-10-18 04:49:27.323839
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd598e03aa192'
+down_revision: Union[str, None] = 'f0e388faf46b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (index name, table, columns), each matched to a query in crud.py
+INDEXES = [
+    ('ix_ratings_movie_id_user_id', 'ratings', ['movie_id', 'user_id']),
+    ('ix_ratings_user_id', 'ratings', ['user_id']),
+    ('ix_parent_comments_movie_id_created_at', 'parent_comments', ['movie_id', 'created_at']),
+    ('ix_parent_comments_user_id', 'parent_comments', ['user_id']),
+    ('ix_comment_replies_parent_comment_id_created_at', 'comment_replies', ['parent_comment_id', 'created_at']),
+    ('ix_comment_replies_user_id', 'comment_replies', ['user_id']),
+    ('ix_movies_user_id', 'movies', ['user_id']),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction; building this
+    # way keeps the tables writable while a live database is migrated
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
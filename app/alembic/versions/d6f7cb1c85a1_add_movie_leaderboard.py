@@ -0,0 +1,51 @@
+"""add movie leaderboard
+
+Revision ID: d6f7cb1c85a1
+Revises: 9991759c83f3
+Create Date: 2026-10-18 05:09:55.100144
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd6f7cb1c85a1'
+down_revision: Union[str, None] = '9991759c83f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Matches leaderboard.PRIOR_VOTES's default when this revision was written
+PRIOR_VOTES = 10
+
+
+def upgrade() -> None:
+    op.create_table(
+        'movie_leaderboard',
+        sa.Column('movie_id', sa.Integer(), sa.ForeignKey('movies.movie_id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('top_score', sa.Float()),
+        sa.Column('trending_score', sa.Float(), nullable=False, server_default='0'),
+    )
+    op.create_index('ix_movie_leaderboard_top_score', 'movie_leaderboard', ['top_score'])
+    op.create_index('ix_movie_leaderboard_trending_score', 'movie_leaderboard', ['trending_score'])
+
+    # Seed top-rated from the rating totals. Trending is rebuilt from recent
+    # activity by the app's leaderboard refresher on its first run.
+    op.execute(f'''
+        INSERT INTO movie_leaderboard (movie_id, top_score)
+        SELECT s.movie_id,
+               ({PRIOR_VOTES} * m.mean + s.rating_sum) / ({PRIOR_VOTES} + s.rating_count)
+        FROM movie_rating_stats s,
+             (SELECT COALESCE(1.0 * SUM(rating_sum) / NULLIF(SUM(rating_count), 0), 3.0) AS mean
+              FROM movie_rating_stats) m
+        WHERE s.rating_count > 0
+    ''')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_movie_leaderboard_trending_score', table_name='movie_leaderboard')
+    op.drop_index('ix_movie_leaderboard_top_score', table_name='movie_leaderboard')
+    op.drop_table('movie_leaderboard')
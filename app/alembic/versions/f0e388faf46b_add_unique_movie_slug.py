@@ -0,0 +1,62 @@
+"""add unique movie slug
+
+Revision ID: f0e388faf46b
+Revises: 9abf4821d5ea
+Create Date: 2026-10-18 04:48:51.235162
+
+"""
+from typing import Sequence, Union
+
+import re
+import unicodedata
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'f0e388faf46b'
+down_revision: Union[str, None] = '9abf4821d5ea'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Frozen copies of slugs.slugify and slugs.next_free_slug, so later changes to
+# the application cannot change what this revision writes
+def _slugify(title):
+    ascii_title = unicodedata.normalize("NFKD", title).encode("ascii", "ignore").decode()
+    slug = re.sub(r"[^a-z0-9]+", "-", ascii_title.lower()).strip("-")
+    return slug[:200] or "movie"
+
+
+def _next_free_slug(base, taken):
+    if base not in taken:
+        return base
+    suffix = 2
+    while f"{base}--{suffix}" in taken:
+        suffix += 1
+    return f"{base}--{suffix}"
+
+
+def upgrade() -> None:
+    op.add_column('movies', sa.Column('slug', sa.String(length=255), nullable=True))
+
+    # Oldest movie keeps the bare slug; later duplicates get --2, --3, ...,
+    # which no title slugifies to
+    conn = op.get_bind()
+    taken = set()
+    rows = conn.execute(sa.text("SELECT movie_id, title FROM movies ORDER BY movie_id")).all()
+    for movie_id, title in rows:
+        base = _slugify(title)
+        slug = _next_free_slug(base, taken)
+        taken.add(slug)
+        conn.execute(sa.text("UPDATE movies SET slug = :slug WHERE movie_id = :movie_id"), {"slug": slug, "movie_id": movie_id})
+
+    with op.batch_alter_table('movies') as batch_op:
+        batch_op.alter_column('slug', existing_type=sa.String(length=255), nullable=False)
+    op.create_index('ix_movies_slug', 'movies', ['slug'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_movies_slug', table_name='movies')
+    with op.batch_alter_table('movies') as batch_op:
+        batch_op.drop_column('slug')
@@ -0,0 +1,47 @@
+"""add movie rating stats
+
+Revision ID: fbe7c417da09
+Revises: d598e03aa192
+Create Date: 2026-10-18 04:50:16.255289
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'fbe7c417da09'
+down_revision: Union[str, None] = 'd598e03aa192'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+STARS = range(1, 6)
+
+
+def upgrade() -> None:
+    op.create_table(
+        'movie_rating_stats',
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('rating_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('rating_sum', sa.Integer(), server_default='0', nullable=False),
+        *[sa.Column(f'stars_{star}', sa.Integer(), server_default='0', nullable=False) for star in STARS],
+        sa.ForeignKeyConstraint(['movie_id'], ['movies.movie_id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('movie_id'),
+    )
+
+    # One pass over ratings to seed the totals for every existing movie
+    star_columns = ", ".join(f"stars_{star}" for star in STARS)
+    star_sums = ", ".join(f"COALESCE(SUM(CASE WHEN ratings.rating = {star} THEN 1 ELSE 0 END), 0)" for star in STARS)
+    op.execute(
+        f"INSERT INTO movie_rating_stats (movie_id, rating_count, rating_sum, {star_columns}) "
+        f"SELECT movies.movie_id, COUNT(ratings.rating_id), COALESCE(SUM(ratings.rating), 0), {star_sums} "
+        "FROM movies LEFT JOIN ratings ON ratings.movie_id = movies.movie_id "
+        "GROUP BY movies.movie_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('movie_rating_stats')
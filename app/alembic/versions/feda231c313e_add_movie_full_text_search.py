@@ -0,0 +1,51 @@
+"""add movie full text search
+
+Revision ID: feda231c313e
+Revises: 9368fb55eeb0
+Create Date: 2026-10-18 05:05:14.903905
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'feda231c313e'
+down_revision: Union[str, None] = '9368fb55eeb0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+SEARCH_VECTOR = """
+    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(genre, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(description, '')), 'C')
+"""
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        # Adding a stored generated column rewrites movies once; after that
+        # Postgres keeps the vector current on every insert and update
+        op.execute(f'ALTER TABLE movies ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({SEARCH_VECTOR}) STORED')
+        with op.get_context().autocommit_block():
+            op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_movies_search_vector ON movies USING gin (search_vector)')
+            op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_movies_title_trgm ON movies USING gin (title gin_trgm_ops)')
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS movies_fts USING fts5(title, genre, description, tokenize='porter unicode61')")
+        op.execute('INSERT INTO movies_fts (rowid, title, genre, description) SELECT movie_id, title, genre, description FROM movies')
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_movies_title_trgm')
+            op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_movies_search_vector')
+        op.execute('ALTER TABLE movies DROP COLUMN IF EXISTS search_vector')
+    elif dialect == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS movies_fts')
@@ -0,0 +1,192 @@
+from datetime import datetime
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import model, schema, search, genres, leaderboard
+from crud import movies_page_statement, movies_page
+from slugs import slugify
+from pagination import clamp_limit, encode_cursor, decode_cursor
+from cache import cache, user_key
+
+# Async reads and writes for routes that run on the event loop. The user,
+# movie and reply functions issue the same SQL as their twins in crud.py;
+# search, leaderboards, genres and comment threads are only served from here.
+
+# User Crud start
+async def create_user(db: AsyncSession, user: schema.UserCreate, hashed_password: str):
+    db_user = model.User(
+        full_name = user.full_name,
+        username = user.username,
+        hashed_password = hashed_password,
+        email = user.email
+        )
+    db.add(db_user)
+    await db.commit()
+    return db_user
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    return (await db.execute(select(model.User).where(model.User.email == email))).scalars().first()
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    return (await db.execute(select(model.User).where(model.User.username == username))).scalars().first()
+
+async def update_user_password(db: AsyncSession, user: model.User, hashed_password: str):
+    user.hashed_password = hashed_password
+    user.token_version += 1
+    await db.commit()
+    cache.invalidate(user_key(user.user_id))
+    return user
+
+# User CRUD End
+
+# Movie Crud start
+
+async def view_all_movies(db: AsyncSession, cursor: str = None, limit: int = 10, genre: str = None, release_year: int = None, offset: int = None):
+    statement, limit = movies_page_statement(cursor, limit, genre, release_year, offset)
+    movies = (await db.execute(statement)).scalars().all()
+    return movies_page(movies, limit, offset)
+
+async def get_movie_by_id(db: AsyncSession, movie_id: int):
+    return await db.get(model.Movies, movie_id)
+
+async def get_movie_by_slug(db: AsyncSession, slug: str):
+    return (await db.execute(select(model.Movies).where(model.Movies.slug == slug))).scalars().first()
+
+async def get_movie_by_title(db: AsyncSession, title: str):
+    return await get_movie_by_slug(db, slugify(title))
+
+async def search_movies(db: AsyncSession, q: str, genres=None, cursor: str = None, limit: int = 10):
+    built = search.search_statement(db.bind.dialect.name, q, genres=genres, cursor=cursor, limit=limit)
+    if built is None:
+        return {"results": [], "next_cursor": None}
+    statement, limit, offset = built
+    return search.search_page((await db.execute(statement)).all(), limit, offset)
+
+# Movie Crud End
+
+# Leaderboards
+
+async def top_rated(db: AsyncSession, limit: int = 10):
+    rows = (await db.execute(leaderboard.top_rated_statement(limit))).all()
+    return [
+        {"movie": movie, "score": round(score, 4), "rating_count": count, "average_rating": round(total / count, 4)}
+        for movie, score, count, total in rows
+    ]
+
+async def trending(db: AsyncSession, limit: int = 10):
+    rows = (await db.execute(leaderboard.trending_statement(limit))).all()
+    return [{"movie": movie, "score": round(leaderboard.decayed(score), 4)} for movie, score in rows]
+
+# Genre browsing
+
+async def genre_facets(db: AsyncSession):
+    rows = (await db.execute(
+        select(model.Genre.name, model.Genre.slug, model.GenreCount.movie_count)
+        .join(model.GenreCount, model.GenreCount.genre_id == model.Genre.genre_id)
+        .where(model.GenreCount.movie_count > 0)
+        .order_by(model.GenreCount.movie_count.desc(), model.Genre.slug)
+    )).all()
+    return [{"name": row.name, "slug": row.slug, "movie_count": row.movie_count} for row in rows]
+
+async def browse_genres(db: AsyncSession, names, match: str = "all", cursor: str = None, limit: int = 10):
+    slugs = {slugify(name) for name in names}
+    known = (await db.execute(
+        select(model.Genre.genre_id, func.coalesce(model.GenreCount.movie_count, 0).label("movie_count"))
+        .outerjoin(model.GenreCount, model.GenreCount.genre_id == model.Genre.genre_id)
+        .where(model.Genre.slug.in_(slugs))
+        .order_by("movie_count")
+    )).all()
+    page = {"movies": [], "next_cursor": None, "facets": await genre_facets(db)}
+    if not known or (match == "all" and len(known) < len(slugs)):
+        return page
+    statement, limit = genres.browse_statement([row.genre_id for row in known], match=match, cursor=cursor, limit=limit)
+    movies = (await db.execute(statement)).scalars().all()
+    if len(movies) > limit:
+        movies = movies[:limit]
+        page["next_cursor"] = encode_cursor(movies[-1].movie_id)
+    page["movies"] = movies
+    return page
+
+# Comment reads
+
+async def get_reply(db: AsyncSession, parent_comment_id: int):
+    replies = (await db.execute(
+        select(model.CommentReply.content)
+        .where(model.CommentReply.parent_comment_id == parent_comment_id)
+        .order_by(model.CommentReply.created_at, model.CommentReply.reply_id)
+    )).scalars().all()
+    return [{"reply": reply} for reply in replies]
+
+MAX_REPLIES_PER_COMMENT = 20
+
+async def get_comment_threads(db: AsyncSession, movie_id: int, cursor: str = None, limit: int = 10, replies: int = 3):
+    """One page of a movie's comments in posting order, each with its reply
+    count and first `replies` replies, in two queries whatever the page size."""
+    limit = clamp_limit(limit)
+    replies = max(0, min(replies, MAX_REPLIES_PER_COMMENT))
+    comment, reply = model.ParentComment, model.CommentReply
+
+    reply_count = (
+        select(func.count()).where(reply.parent_comment_id == comment.parent_comment_id)
+        .correlate(comment).scalar_subquery()
+    )
+    page = (
+        select(comment.parent_comment_id, comment.content, comment.created_at, model.User.username, reply_count.label("reply_count"))
+        .join(model.User, model.User.user_id == comment.user_id)
+        .where(comment.movie_id == movie_id)
+        .order_by(comment.created_at, comment.parent_comment_id)
+    )
+    if cursor:
+        created_at, comment_id = decode_cursor(cursor, datetime, int)
+        page = page.where(tuple_(comment.created_at, comment.parent_comment_id) > (created_at, comment_id))
+    rows = (await db.execute(page.limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].parent_comment_id)
+
+    threads = [
+        {
+            "comment_id": row.parent_comment_id,
+            "username": row.username,
+            "content": row.content,
+            "created_at": row.created_at,
+            "reply_count": row.reply_count,
+            "replies": [],
+        }
+        for row in rows
+    ]
+    by_id = {thread["comment_id"]: thread for thread in threads}
+
+    if replies and any(thread["reply_count"] for thread in threads):
+        # Number each comment's replies and keep the first few of every one
+        position = func.row_number().over(
+            partition_by=reply.parent_comment_id, order_by=(reply.created_at, reply.reply_id)
+        ).label("position")
+        numbered = (
+            select(reply.reply_id, reply.parent_comment_id, reply.content, reply.created_at, model.User.username, position)
+            .join(model.User, model.User.user_id == reply.user_id)
+            .where(reply.parent_comment_id.in_([thread["comment_id"] for thread in threads if thread["reply_count"]]))
+            .subquery()
+        )
+        first_replies = (
+            select(numbered)
+            .where(numbered.c.position <= replies)
+            .order_by(numbered.c.parent_comment_id, numbered.c.position)
+        )
+        for row in (await db.execute(first_replies)).all():
+            by_id[row.parent_comment_id]["replies"].append({
+                "reply_id": row.reply_id,
+                "username": row.username,
+                "content": row.content,
+                "created_at": row.created_at,
+            })
+
+    return {
+        "comments": threads,
+        "next_cursor": next_cursor,
+        # Comments with more replies than shown; fetch the rest from /replies/{id}
+        "truncated_comment_ids": [thread["comment_id"] for thread in threads if thread["reply_count"] > len(thread["replies"])],
+    }
@@ -3,13 +3,13 @@ import os
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 import sqlalchemy
-import crud
+import crud, async_crud, hashing, schema
 from database import SessionLocal, get_db
 
 
@@ -19,45 +19,78 @@ load_dotenv()
 SECRET_KEY = os.environ.get('SECRET_KEY') 
 ALGORITHM = os.environ.get('ALGORITHM')
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES'))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', 14))
+# Users allowed on the /admin endpoints
+ADMIN_USERNAMES = {name.strip() for name in os.environ.get('ADMIN_USERNAMES', '').split(',') if name.strip()}
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def authenticate_user(db: Session, username: str, password: str):
-    user = crud.get_user_by_username(db, username)
-    if not user or not verify_password(password, user.hashed_password):
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await async_crud.get_user_by_username(db, username)
+    if not user or not await hashing.verify_password(password, user.hashed_password):
         return False
     return user
 
+def token_claims(user):
+    return {"sub": user.username, "uid": user.user_id, "ver": user.token_version}
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "type": "access"})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
+def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None):
+    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+    return jwt.encode({**data, "exp": expire, "type": "refresh"}, SECRET_KEY, algorithm=ALGORITHM)
+
+def issue_tokens(user):
+    claims = token_claims(user)
+    return {
+        "access_token": create_access_token(claims),
+        "refresh_token": create_refresh_token(claims),
+        "token_type": "bearer",
+    }
+
+def credentials_exception():
+    return HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_token(token: str, token_type: str = "access"):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
-    user = crud.get_user_by_username(db, username=username)
-    if user is None:
-        raise credentials_exception
-    return user
+        raise credentials_exception()
+    if payload.get("type") != token_type or payload.get("uid") is None or payload.get("sub") is None:
+        raise credentials_exception()
+    return payload
+
+def get_token_user(token: str = Depends(oauth2_scheme)):
+    """The caller's id and username straight from the access token, without
+    touching the database. The token is not checked against the user's
+    current token_version, so a password change only locks it out once it
+    expires; use get_current_user where that matters."""
+    payload = decode_token(token)
+    return schema.User(user_id=payload["uid"], username=payload["sub"])
+
+def load_token_user(db: Session, payload: dict):
+    user = crud.cached_current_user(db, payload["uid"])
+    if user is None or user["token_version"] != payload.get("ver"):
+        raise credentials_exception()
+    return schema.CurrentUser(**user)
+
+def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+    return load_token_user(db, decode_token(token))
 
+def get_admin_user(current_user: schema.CurrentUser = Depends(get_current_user)):
+    if current_user.username not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
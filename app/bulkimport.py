@@ -0,0 +1,494 @@
+import io
+import os
+import re
+import csv
+import gzip
+import json
+import time
+import argparse
+from datetime import timezone
+from pathlib import Path
+
+import sqlalchemy
+from dotenv import load_dotenv
+from pydantic import ValidationError
+from sqlalchemy import Column, Integer, MetaData, String, Table, Text, func, select, text, true
+from sqlalchemy.orm import Session
+
+import crud, database, genres, leaderboard, model, schema, search
+from database import upsert
+from hashing import hash_pool, pwd_context
+from model import KeysetTimestamp
+from slugs import slugify, next_free_slug
+from my_logging.logger import get_logger
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Bulk catalog import, for seeding a database or moving a catalog between
+# instances without going through the API one movie at a time:
+#
+#     python app/bulkimport.py --users users.csv --movies movies.ndjson \
+#         --ratings ratings.csv.gz --comments comments.csv
+#
+# Each file is streamed into a temporary staging table in batches (COPY on
+# Postgres, executemany elsewhere), then merged into the real table with one
+# INSERT ... SELECT that resolves usernames and titles and skips rows that
+# already exist. The per-write bookkeeping (genres, the search index, rating
+# totals, genre counts, leaderboards) is skipped during the load and rebuilt
+# once at the end, and secondary indexes are dropped and recreated around it.
+# Everything happens in one transaction, so a failed import leaves no trace.
+
+BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", 10000))
+# Invalid rows are counted; only the first few are logged
+MAX_LOGGED_ERRORS = 20
+
+staging = MetaData()
+
+USERS = Table(
+    "import_users", staging,
+    Column("full_name", String(255)),
+    Column("username", String(255)),
+    Column("email", String(255)),
+    Column("hashed_password", String(255)),
+    prefixes=["TEMPORARY"],
+)
+
+MOVIES = Table(
+    "import_movies", staging,
+    Column("title", String(255)),
+    Column("slug", String(255)),
+    Column("genre", String(255)),
+    Column("description", Text),
+    Column("release_date", String),
+    Column("release_year", Integer),
+    Column("username", String(255)),
+    Column("user_id", Integer),
+    Column("created_at", KeysetTimestamp),
+    prefixes=["TEMPORARY"],
+)
+
+RATINGS = Table(
+    "import_ratings", staging,
+    Column("username", String(255)),
+    Column("user_id", Integer),
+    Column("movie_slug", String(255)),
+    Column("movie_id", Integer),
+    Column("rating", Integer),
+    Column("created_at", KeysetTimestamp),
+    prefixes=["TEMPORARY"],
+)
+
+COMMENTS = Table(
+    "import_comments", staging,
+    Column("username", String(255)),
+    Column("user_id", Integer),
+    Column("movie_slug", String(255)),
+    Column("movie_id", Integer),
+    Column("content", Text),
+    Column("created_at", KeysetTimestamp),
+    prefixes=["TEMPORARY"],
+)
+
+# Tables that take bulk rows; their non-unique indexes are rebuilt after the load
+LOADED_TABLES = [model.User, model.Movies, model.Rating, model.ParentComment, model.MovieGenre]
+SEARCH_INDEXES = {
+    re.match(r"CREATE INDEX (\w+)", statement).group(1): statement
+    for statement in search.POSTGRES_DDL if statement.startswith("CREATE INDEX")
+}
+
+
+# Reading
+
+def read_records(path):
+    """Yield (line number, record) from a .csv, .ndjson or .jsonl file, gzipped
+    or not. CSV records are dicts with empty cells left out; NDJSON records
+    are the raw lines, decoded when they are parsed."""
+    path = Path(path)
+    suffixes = [suffix.lower() for suffix in path.suffixes]
+    compressed = suffixes[-1:] == [".gz"]
+    kind = (suffixes[:-1] if compressed else suffixes)[-1:]
+    opener = gzip.open if compressed else open
+    with opener(path, "rt", encoding="utf-8", newline="") as f:
+        if kind == [".csv"]:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, {key: value for key, value in row.items() if key is not None and value != ""}
+        elif kind in ([".ndjson"], [".jsonl"]):
+            for number, line in enumerate(f, start=1):
+                if line.strip():
+                    yield number, line
+        else:
+            raise ValueError(f"{path}: expected a .csv, .ndjson or .jsonl file")
+
+
+def parse_record(record, item_schema):
+    try:
+        raw = json.loads(record) if isinstance(record, str) else record
+        return item_schema.model_validate(raw), None
+    except (ValueError, ValidationError) as exc:
+        errors = exc.errors() if isinstance(exc, ValidationError) else None
+        if errors:
+            location = ".".join(str(part) for part in errors[0]["loc"])
+            return None, f"{location}: {errors[0]['msg']}" if location else errors[0]["msg"]
+        return None, str(exc)
+
+
+def _utc(value):
+    # Stored timestamps are naive UTC
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# Staging rows, built a batch at a time
+
+def user_rows(items):
+    # bcrypt dominates a user import; it releases the GIL, so plain passwords
+    # are hashed across the hashing pool's threads
+    plain = [item.password for item in items if item.hashed_password is None]
+    hashed = iter(hash_pool.executor.map(pwd_context.hash, plain))
+    return [
+        {
+            "full_name": item.full_name,
+            "username": item.username,
+            "email": item.email,
+            "hashed_password": item.hashed_password if item.hashed_password is not None else next(hashed),
+        }
+        for item in items
+    ]
+
+
+def movie_rows(taken: set):
+    # Slugs are assigned here, against every slug already in the catalog
+    # plus the ones handed out earlier in this import
+    def rows(items):
+        built = []
+        for item in items:
+            slug = next_free_slug(slugify(item.title), taken)
+            taken.add(slug)
+            built.append({
+                "title": item.title,
+                "slug": slug,
+                "genre": item.genre,
+                "description": item.description,
+                "release_date": item.release_date.isoformat(),
+                "release_year": item.release_date.year,
+                "username": item.username,
+                "user_id": item.user_id,
+                "created_at": _utc(item.created_at),
+            })
+        return built
+    return rows
+
+
+def _references(item):
+    return {
+        "username": item.username,
+        "user_id": item.user_id,
+        "movie_slug": slugify(item.movie_title) if item.movie_id is None else None,
+        "movie_id": item.movie_id,
+        "created_at": _utc(item.created_at),
+    }
+
+
+def rating_rows(items):
+    return [{**_references(item), "rating": item.rating} for item in items]
+
+
+def comment_rows(items):
+    return [{**_references(item), "content": item.content} for item in items]
+
+
+def copy_rows(db: Session, table: Table, rows: list):
+    """Append rows to a staging table: COPY on Postgres, executemany elsewhere."""
+    if not rows:
+        return
+    if db.get_bind().dialect.name == "postgresql":
+        columns = [column.name for column in table.columns]
+        buffer = io.StringIO()
+        # Strings are quoted, so an empty string stays distinct from NULL
+        csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows([row[name] for name in columns] for row in rows)
+        buffer.seek(0)
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        finally:
+            cursor.close()
+    else:
+        db.execute(table.insert(), rows)
+
+
+def stage(db: Session, table: Table, path, item_schema, to_rows, batch_size: int = BATCH_SIZE):
+    read = invalid = 0
+    batch = []
+    for number, record in read_records(path):
+        read += 1
+        item, error = parse_record(record, item_schema)
+        if error:
+            invalid += 1
+            if invalid <= MAX_LOGGED_ERRORS:
+                logger.warning("Skipping %s line %d: %s", path, number, error)
+            continue
+        batch.append(item)
+        if len(batch) >= batch_size:
+            copy_rows(db, table, to_rows(batch))
+            batch.clear()
+    copy_rows(db, table, to_rows(batch))
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text(f"ANALYZE {table.name}"))
+    return read, invalid
+
+
+# Merging staged rows into the catalog
+
+def resolve(db: Session, table: Table, key: str, name: str, target_key, target_name):
+    """Fill in table.key from table.name wherever only the name was given;
+    names that match nothing stay NULL and their rows are skipped."""
+    db.execute(
+        sqlalchemy.update(table)
+        .where(table.c[key].is_(None), table.c[name].is_not(None))
+        .values({key: select(target_key).where(target_name == table.c[name]).scalar_subquery()})
+    )
+
+
+def merge_users(db: Session):
+    source = select(USERS.c.full_name, USERS.c.username, USERS.c.email, USERS.c.hashed_password).where(true())
+    insert = upsert(db, model.User).from_select(["full_name", "username", "email", "hashed_password"], source)
+    # A username or email that is already taken keeps its existing account
+    return db.execute(insert.on_conflict_do_nothing()).rowcount
+
+
+def merge_movies(db: Session):
+    resolve(db, MOVIES, "user_id", "username", model.User.user_id, model.User.username)
+    owner = model.User
+    source = (
+        select(
+            MOVIES.c.title, MOVIES.c.slug, MOVIES.c.genre, MOVIES.c.description, MOVIES.c.release_date,
+            MOVIES.c.release_year, owner.user_id, func.coalesce(MOVIES.c.created_at, func.now()),
+        )
+        .select_from(MOVIES)
+        .outerjoin(owner, owner.user_id == MOVIES.c.user_id)
+        # Movies without an owner are fine; an owner that does not exist is not
+        .where(sqlalchemy.or_(
+            owner.user_id.is_not(None),
+            sqlalchemy.and_(MOVIES.c.username.is_(None), MOVIES.c.user_id.is_(None)),
+        ))
+    )
+    insert = upsert(db, model.Movies).from_select(
+        ["title", "slug", "genre", "description", "release_date", "release_year", "user_id", "created_at"], source
+    )
+    return db.execute(insert.on_conflict_do_nothing(index_elements=[model.Movies.slug])).rowcount
+
+
+def merge_ratings(db: Session):
+    resolve(db, RATINGS, "user_id", "username", model.User.user_id, model.User.username)
+    resolve(db, RATINGS, "movie_id", "movie_slug", model.Movies.movie_id, model.Movies.slug)
+    source = (
+        select(RATINGS.c.user_id, RATINGS.c.movie_id, RATINGS.c.rating, func.coalesce(RATINGS.c.created_at, func.now()))
+        .select_from(RATINGS)
+        .join(model.User, model.User.user_id == RATINGS.c.user_id)
+        .join(model.Movies, model.Movies.movie_id == RATINGS.c.movie_id)
+        # SQLite needs a WHERE clause to tell an upsert's SELECT from its ON CONFLICT
+        .where(true())
+    )
+    insert = upsert(db, model.Rating).from_select(["user_id", "movie_id", "rating", "created_at"], source)
+    # Existing ratings win, as do earlier rows for the same user and movie
+    return db.execute(insert.on_conflict_do_nothing(index_elements=[model.Rating.user_id, model.Rating.movie_id])).rowcount
+
+
+def merge_comments(db: Session):
+    resolve(db, COMMENTS, "user_id", "username", model.User.user_id, model.User.username)
+    resolve(db, COMMENTS, "movie_id", "movie_slug", model.Movies.movie_id, model.Movies.slug)
+    source = (
+        select(COMMENTS.c.user_id, COMMENTS.c.movie_id, COMMENTS.c.content, func.coalesce(COMMENTS.c.created_at, func.now()))
+        .select_from(COMMENTS)
+        .join(model.User, model.User.user_id == COMMENTS.c.user_id)
+        .join(model.Movies, model.Movies.movie_id == COMMENTS.c.movie_id)
+    )
+    insert = sqlalchemy.insert(model.ParentComment).from_select(["user_id", "movie_id", "content", "created_at"], source)
+    return db.execute(insert).rowcount
+
+
+# Deferred maintenance
+
+def tag_movies_after(db: Session, movie_id: int, batch_size: int = BATCH_SIZE):
+    """movie_genres rows for every movie with a higher movie_id, a batch of
+    movies at a time."""
+    tagged = 0
+    while True:
+        rows = db.execute(
+            select(model.Movies.movie_id, model.Movies.genre, model.Movies.created_at)
+            .where(model.Movies.movie_id > movie_id)
+            .order_by(model.Movies.movie_id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return tagged
+        split = {row.movie_id: genres.split_genres(row.genre) for row in rows}
+        created = {row.movie_id: row.created_at for row in rows}
+        ids = crud.ensure_genres(db, {slug: name for names in split.values() for slug, name in names.items()})
+        tags = [
+            {"movie_id": tagged_id, "genre_id": ids[slug], "created_at": created[tagged_id]}
+            for tagged_id, names in split.items() for slug in names
+        ]
+        if tags:
+            db.execute(upsert(db, model.MovieGenre).on_conflict_do_nothing(), tags)
+            tagged += len(tags)
+        movie_id = rows[-1].movie_id
+
+
+def drop_indexes(db: Session):
+    """Drop the secondary indexes of the tables being loaded; returns what
+    was dropped so it can be put back."""
+    connection = db.connection()
+    inspector = sqlalchemy.inspect(connection)
+    postgres = connection.dialect.name == "postgresql"
+    dropped = []
+    for entity in LOADED_TABLES:
+        table = entity.__table__
+        present = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if not index.unique and index.name in present:
+                index.drop(connection)
+                dropped.append(index)
+        if postgres and table is model.Movies.__table__:
+            for name in sorted(present & SEARCH_INDEXES.keys()):
+                db.execute(text(f"DROP INDEX {name}"))
+                dropped.append(name)
+    return dropped
+
+
+def create_indexes(db: Session, indexes: list):
+    connection = db.connection()
+    for index in indexes:
+        if isinstance(index, str):
+            db.execute(text(SEARCH_INDEXES[index]))
+        else:
+            index.create(connection)
+    return len(indexes)
+
+
+def rebuild_aggregates(db: Session):
+    """Recompute rating totals, genre counts and both leaderboards from the
+    catalog, as the write paths would have kept them."""
+    crud.rebuild_rating_stats(db)
+    crud.rebuild_genre_counts(db)
+    leaderboard._prior["mean"] = leaderboard.catalog_mean(db)
+    leaderboard.rescore_top_rated(db)
+    leaderboard.rebuild_trending(db)
+
+
+# The import
+
+FILES = [
+    # (phase, staging table, row schema, merge)
+    ("users", USERS, schema.ImportUser, merge_users),
+    ("movies", MOVIES, schema.ImportMovie, merge_movies),
+    ("ratings", RATINGS, schema.ImportRating, merge_ratings),
+    ("comments", COMMENTS, schema.ImportComment, merge_comments),
+]
+
+
+def import_catalog(db: Session, paths: dict, batch_size: int = BATCH_SIZE, defer_indexes: bool = True):
+    """Load the files in paths (keyed by "users", "movies", "ratings",
+    "comments") and commit. Returns one report entry per phase."""
+    report = []
+
+    def timed(phase, work):
+        started = time.perf_counter()
+        entry = {"phase": phase, **work()}
+        entry["seconds"] = round(time.perf_counter() - started, 3)
+        rows = entry.get("read", entry.get("rows"))
+        entry["rows_per_s"] = round(rows / entry["seconds"]) if rows and entry["seconds"] else None
+        report.append(entry)
+        logger.info("Import %s done in %.1fs", phase, entry["seconds"], extra=entry)
+
+    staging.create_all(db.connection(), checkfirst=False)
+    dropped = drop_indexes(db) if defer_indexes else []
+    last_movie_id = db.execute(select(func.coalesce(func.max(model.Movies.movie_id), 0))).scalar()
+    to_rows = {
+        "users": user_rows,
+        "movies": movie_rows(set(db.execute(select(model.Movies.slug)).scalars())) if paths.get("movies") else None,
+        "ratings": rating_rows,
+        "comments": comment_rows,
+    }
+
+    for phase, table, item_schema, merge in FILES:
+        if not paths.get(phase):
+            continue
+
+        def load():
+            read, invalid = stage(db, table, paths[phase], item_schema, to_rows[phase], batch_size)
+            imported = merge(db)
+            return {"read": read, "invalid": invalid, "imported": imported, "skipped": read - invalid - imported}
+        timed(phase, load)
+
+    if paths.get("movies"):
+        def index():
+            tagged = tag_movies_after(db, last_movie_id, batch_size)
+            search.index_movies_after(db, last_movie_id)
+            return {"rows": tagged}
+        timed("genres and search index", index)
+    if dropped:
+        timed("indexes", lambda: {"rebuilt": create_indexes(db, dropped)})
+
+    def aggregates():
+        rebuild_aggregates(db)
+        return {}
+    timed("aggregates", aggregates)
+
+    staging.drop_all(db.connection(), checkfirst=False)
+    if db.get_bind().dialect.name == "postgresql":
+        for entity in LOADED_TABLES + [model.MovieRatingStats, model.MovieLeaderboard]:
+            db.execute(text(f"ANALYZE {entity.__tablename__}"))
+    db.commit()
+    return report
+
+
+def format_report(report):
+    lines = []
+    for entry in report:
+        line = f"{entry['phase']:<24} {entry['seconds']:>9.2f}s"
+        if "read" in entry:
+            line += f"  {entry['read']:>10} read  {entry['imported']:>10} imported  {entry['skipped']:>8} skipped  {entry['invalid']:>8} invalid"
+        if entry["rows_per_s"]:
+            line += f"  {entry['rows_per_s']:>10} rows/s"
+        lines.append(line)
+    total = sum(entry["seconds"] for entry in report)
+    rows = sum(entry.get("read", 0) for entry in report)
+    lines.append(f"{'total':<24} {total:>9.2f}s  {rows:>10} read" + (f"  {round(rows / total):>10} rows/s overall" if total else ""))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import users, movies, ratings and comments from CSV or NDJSON files.")
+    parser.add_argument("--users", help="full_name, username, email and hashed_password (or password)")
+    parser.add_argument("--movies", help="title, genre, description, release_date, optional username or user_id and created_at")
+    parser.add_argument("--ratings", help="movie_title or movie_id, username or user_id, rating, optional created_at")
+    parser.add_argument("--comments", help="movie_title or movie_id, username or user_id, content, optional created_at")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per COPY or executemany")
+    parser.add_argument("--keep-indexes", action="store_true",
+                        help="keep indexes in place during the load; slower, but the tables stay usable by a running app")
+    parser.add_argument("--rebuild-only", action="store_true",
+                        help="load nothing; just rebuild rating totals, genre counts and leaderboards")
+    args = parser.parse_args(argv)
+
+    database.Base.metadata.create_all(bind=database.engine)
+    with database.SessionLocal() as db:
+        if args.rebuild_only:
+            started = time.perf_counter()
+            rebuild_aggregates(db)
+            db.commit()
+            print(f"Rebuilt aggregates in {time.perf_counter() - started:.2f}s")
+            return
+        paths = {phase: getattr(args, phase) for phase, *_ in FILES if getattr(args, phase)}
+        if not paths:
+            parser.error("nothing to import; pass at least one of --users, --movies, --ratings, --comments")
+        report = import_catalog(db, paths, batch_size=args.batch_size, defer_indexes=not args.keep_indexes)
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
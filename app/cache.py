@@ -0,0 +1,195 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class LRUCache:
+    """Size-bounded, per-process cache whose entries also expire after ttl seconds."""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 2):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedCache:
+    """Cache tier shared by every worker, spoken to over the Redis protocol.
+    Any client with get/mget/set(ex=)/incr/delete works, which keeps it
+    testable with an in-memory stand-in.
+
+    Each key has a generation counter that invalidate() bumps. Entries are
+    stored with the generation their load started under, and an entry from
+    an older generation reads as a miss, so a load that raced a write can
+    never serve its stale value."""
+
+    def __init__(self, client, ttl: int = 300, prefix: str = "movielisting:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        """Return (value, generation); value is None on a miss."""
+        raw, generation = self.client.mget(self.prefix + key, self.prefix + "gen:" + key)
+        generation = int(generation or 0)
+        if raw is None:
+            return None, generation
+        entry = json.loads(raw)
+        return (entry["value"] if entry["gen"] == generation else None), generation
+
+    def set(self, key, value, generation: int, ttl: float = None):
+        ttl = self.ttl if ttl is None else max(1, min(math.ceil(ttl), self.ttl))
+        self.client.set(self.prefix + key, json.dumps({"gen": generation, "value": value}), ex=ttl)
+
+    def invalidate(self, *keys):
+        # Generation counters are tiny and never expire, so an old
+        # generation can never come round again
+        for key in keys:
+            self.client.incr(self.prefix + "gen:" + key)
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+
+class ReadThroughCache:
+    def __init__(self, local: LRUCache, shared: SharedCache = None):
+        self.local = local
+        self.shared = shared
+        self._inflight = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader, ttl: float = None):
+        """Return the cached value for key, calling loader() on a miss. Values
+        must be JSON serialisable; None is never cached. ttl, if given, can
+        only shorten how long a loaded value is kept."""
+        value = self.local.get(key)
+        if value is not None:
+            return value
+
+        # Single flight: the first miss loads, concurrent misses on the same
+        # key wait for its result instead of all querying the database
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            generation = self._generations.get(key, 0)
+        if not leader:
+            return call.wait()
+
+        try:
+            value, shared_generation = self.shared.get(key) if self.shared else (None, None)
+            if value is None:
+                value = loader()
+                if value is not None and self.shared:
+                    self.shared.set(key, value, shared_generation, ttl)
+            # An invalidate() that landed while we loaded makes the value
+            # stale; hand it to this caller but do not keep it
+            with self._lock:
+                if value is not None and self._generations.get(key, 0) == generation:
+                    self.local.set(key, value, ttl)
+            call.resolve(value)
+            return value
+        except BaseException as exc:
+            call.fail(exc)
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is call:
+                    del self._inflight[key]
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._generations[key] = self._generations.get(key, 0) + 1
+                # Later misses start a fresh load rather than wait on one
+                # that may have read the old row
+                self._inflight.pop(key, None)
+                self.local.delete(key)
+        if self.shared:
+            self.shared.invalidate(*keys)
+
+
+class _Call:
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+
+    def resolve(self, value):
+        self._value = value
+        self._done.set()
+
+    def fail(self, error):
+        self._error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+# Cache keys for the reads in main.py; crud's write paths invalidate them
+
+def movie_keys(movie_id: int, slug: str):
+    return [f"movie:id:{movie_id}", f"movie:slug:{slug}", f"ratings:{movie_id}", f"comments:{movie_id}"]
+
+
+def user_key(user_id: int):
+    return f"user:{user_id}"
+
+
+def _build_cache():
+    # Invalidations only reach the local tier of the worker that wrote, so
+    # local entries live just long enough to absorb a burst on a hot key
+    local = LRUCache(
+        max_entries=int(os.environ.get("CACHE_MAX_ENTRIES", 10000)),
+        ttl=float(os.environ.get("CACHE_TTL_SECONDS", 2)),
+    )
+    shared = None
+    redis_url = os.environ.get("REDIS_URL")
+    if redis_url:
+        import redis
+
+        shared = SharedCache(redis.Redis.from_url(redis_url), ttl=int(os.environ.get("SHARED_CACHE_TTL_SECONDS", 300)))
+    return ReadThroughCache(local, shared)
+
+
+cache = _build_cache()
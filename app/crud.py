@@ -1,10 +1,20 @@
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
-import model, schema, auth
-from auth import pwd_context
+import model, schema, search, genres, leaderboard
+from contextlib import contextmanager, ExitStack
 from datetime import datetime
+from decimal import Decimal
+import uuid
+import threading
 import sqlalchemy
-from sqlalchemy import func
+from sqlalchemy import func, tuple_
+from pagination import clamp_limit, encode_cursor, decode_cursor
+from storage import get_blob_store
+from slugs import slugify, next_free_slug
+from cache import cache, movie_keys, user_key
+from database import upsert
+from replicas import REPLICA_MAX_LAG_SECONDS
+from fastapi.encoders import jsonable_encoder
 
 # User Crud start
 def create_user(db: Session, user: schema.UserCreate, hashed_password: str):
@@ -16,7 +26,6 @@ def create_user(db: Session, user: schema.UserCreate, hashed_password: str):
         )
     db.add(db_user)
     db.commit()
-    db.refresh(db_user)
     return db_user
 
 def get_user_by_email(db: Session, email: str):
@@ -25,23 +34,15 @@ def get_user_by_email(db: Session, email: str):
 def get_user_by_username(db: Session, username:str):
     return db.query(model.User).filter(model.User.username == username).first()
 
-def update_user_password(db: Session, email: str, new_password: str):
-    user = db.query(model.User).filter(model.User.email == email).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Check if the new password is the same as the old one
-    if pwd_context.verify(new_password, user.hashed_password):
-        raise HTTPException(status_code=400, detail="New password must be different from the old password")
+def get_user_by_id(db: Session, user_id: int):
+    return db.get(model.User, user_id)
 
-    # Hash the new password
-    new_hashed_password = pwd_context.hash(new_password)
-    
-    # Update the password in the database
-    user.hashed_password = new_hashed_password
+def update_user_password(db: Session, user: model.User, hashed_password: str):
+    # Changing the password signs out every token issued before it
+    user.hashed_password = hashed_password
+    user.token_version += 1
     db.commit()
-    db.refresh(user)
-    
+    cache.invalidate(user_key(user.user_id))
     return user
 
 # User CRUD End
@@ -67,113 +68,433 @@ def update_user_password(db: Session, email: str, new_password: str):
 #     db.refresh(db_movie)
 #     return db_movie
 
-def Upload_new_movie(db: Session, movie: schema.MovieUpload, user_id: str = None):
+# Slugs are unique; a second "Heat" becomes heat--2
+
+def unique_slug(db: Session, title: str, movie_id: int = None):
+    base = slugify(title)
+    query = db.query(model.Movies.slug).filter(
+        sqlalchemy.or_(model.Movies.slug == base, model.Movies.slug.like(f"{base}--%"))
+    )
+    if movie_id is not None:
+        query = query.filter(model.Movies.movie_id != movie_id)
+    return next_free_slug(base, {slug for slug, in query})
+
+def Upload_new_movie(db: Session, movie: schema.MovieUpload, user_id: str = None, media: dict = None):
     db_movie = model.Movies(
         title = movie.title,
+        slug = unique_slug(db, movie.title),
         genre = movie.genre,
         description = movie.description,
         release_date = movie.release_date,
+        release_year = movie.release_date.year if movie.release_date else None,
         user_id = user_id       
         
     
         
         )
-    db.add(db_movie)
-    db.commit()
-    db.refresh(db_movie)
+    # media maps each kind to a spooled BlobWriter, committed along with the row
+    with stored_media(db, media) as stored:
+        for kind, info in stored.items():
+            _set_media_columns(db_movie, kind, info)
+        db.add(db_movie)
+        db.flush()
+        db.add(model.MovieRatingStats(movie_id = db_movie.movie_id))
+        set_movie_genres(db, db_movie, db_movie.genre, new=True)
+        search.index_movie(db, db_movie, new=True)
+        db.commit()
     return db_movie
 
 # View all Movie (Public)
 
-def view_all_movies(db: Session, offset: int = 0, limit: int = 10):
-    return db.query(model.Movies).all()
+def view_all_movies(db: Session, cursor: str = None, limit: int = 10, genre: str = None, release_year: int = None, offset: int = None):
+    statement, limit = movies_page_statement(cursor, limit, genre, release_year, offset)
+    return movies_page(db.execute(statement).scalars().all(), limit, offset)
+
+# Shared by the sync and async versions of view_all_movies
+
+def movies_page_statement(cursor: str = None, limit: int = 10, genre: str = None, release_year: int = None, offset: int = None):
+    limit = clamp_limit(limit)
+    statement = sqlalchemy.select(model.Movies)
+    keys = model.Movies
+    if genre is not None:
+        # Walk the genre's (genre_id, created_at, movie_id) index on
+        # movie_genres and probe movies by primary key
+        keys = model.MovieGenre
+        genre_id = sqlalchemy.select(model.Genre.genre_id).where(model.Genre.slug == slugify(genre)[:100]).scalar_subquery()
+        statement = statement.join(keys, keys.movie_id == model.Movies.movie_id).where(keys.genre_id == genre_id)
+    if release_year is not None:
+        statement = statement.where(model.Movies.release_year == release_year)
+    statement = statement.order_by(keys.created_at, keys.movie_id)
+
+    # Deprecated offset paging, kept for old clients but pushed down into SQL
+    if offset is not None:
+        return statement.offset(offset).limit(limit), limit
+
+    if cursor:
+        created_at, movie_id = decode_cursor(cursor, datetime, int)
+        statement = statement.where(tuple_(keys.created_at, keys.movie_id) > (created_at, movie_id))
+
+    # Fetch one extra row to know whether another page exists
+    return statement.limit(limit + 1), limit
+
+def movies_page(movies: list, limit: int, offset: int = None):
+    next_cursor = None
+    if offset is None and len(movies) > limit:
+        movies = movies[:limit]
+        next_cursor = encode_cursor(movies[-1].created_at, movies[-1].movie_id)
+    return {"movies": movies, "next_cursor": next_cursor}
 
 def get_movie_by_title(db: Session, title: str):
-    return db.query(model.Movies).filter(model.Movies.title == title).first()
+    return get_movie_by_slug(db, slugify(title))
 
-def update_movie(db: Session, title: str, updateMovie: schema.MovieUpdate):
-    movie = db.query(model.Movies).filter(model.Movies.title == title).first()
-    if not movie:
-        raise HTTPException(status_code=404, detail="Movie not found")
-    
-    movie.title = updateMovie.title
-    movie.genre = updateMovie.genre
-    movie.description = updateMovie.description
+def get_movie_by_slug(db: Session, slug: str):
+    return db.query(model.Movies).filter(model.Movies.slug == slug).first()
+
+def update_movie(db: Session, movie: model.Movies, updateMovie: schema.MovieUpdate):
+    old_slug = movie.slug
+    if updateMovie.title is not None and updateMovie.title != movie.title:
+        movie.title = updateMovie.title
+        movie.slug = unique_slug(db, updateMovie.title, movie_id=movie.movie_id)
+    if updateMovie.genre is not None:
+        movie.genre = updateMovie.genre
+        set_movie_genres(db, movie, movie.genre)
+    if updateMovie.description is not None:
+        movie.description = updateMovie.description
     # Set updated_at to current time if not provided
     movie.updated_at = updateMovie.updated_at if updateMovie.updated_at else datetime.utcnow()
-    
+    search.index_movie(db, movie)
 
     db.commit()
-    db.refresh(movie)
+    cache.invalidate(*movie_keys(movie.movie_id, old_slug), f"movie:slug:{movie.slug}")
     
     return movie
 
 #Authorized delete a movie
 
-def delete_movie(db: Session, title: str, user_id: str):
-    movie = db.query(model.Movies).filter(model.Movies.title == title, model.Movies.user_id == user_id).first()
-    if not movie:
-        raise HTTPException(status_code=404, detail="Movie not found")
-    
+def delete_movie(db: Session, movie: model.Movies):
+    media_keys = [key for key in (movie.video_key, movie.coverimage_key) if key]
+    db.query(model.MovieRatingStats).filter(model.MovieRatingStats.movie_id == movie.movie_id).delete()
+    db.query(model.MovieLeaderboard).filter(model.MovieLeaderboard.movie_id == movie.movie_id).delete()
+    movie_id, slug = movie.movie_id, movie.slug
+    search.remove_movie(db, movie_id)
+    set_movie_genres(db, movie, "")
     db.delete(movie)
     db.commit()
+    cache.invalidate(*movie_keys(movie_id, slug))
+    release_media(db, media_keys)
     
     return {"detail": "Movie deleted successfully"}
 
+# Point a movie at a spooled blob and release whatever it pointed at before
+
+def set_movie_media(db: Session, movie: model.Movies, kind: str, writer):
+    previous_key = getattr(movie, f"{kind}_key")
+    with stored_media(db, {kind: writer}) as stored:
+        _set_media_columns(movie, kind, stored[kind])
+        db.commit()
+    if previous_key and previous_key != stored[kind].key:
+        release_media(db, [previous_key])
+    return movie
+
+def _set_media_columns(movie: model.Movies, kind: str, info):
+    setattr(movie, f"{kind}_key", info.key)
+    setattr(movie, f"{kind}_size", info.size)
+    setattr(movie, f"{kind}_checksum", info.checksum)
+
+@contextmanager
+def stored_media(db: Session, writers: dict = None):
+    """Commit spooled uploads to the blob store and yield their BlobInfo by
+    kind. The body must commit the rows that point at them. If it fails,
+    nothing points at the new blobs yet, so they are released again along
+    with any spool files left over."""
+    writers = writers or {}
+    stored = {}
+    with media_lock(db, [writer.key for writer in writers.values()]):
+        try:
+            for kind, writer in writers.items():
+                stored[kind] = writer.commit()
+            yield stored
+        except BaseException:
+            db.rollback()
+            for writer in writers.values():
+                writer.abort()
+            release_media(db, [info.key for info in stored.values()])
+            raise
+
+# Media is content addressed, so a blob can back several movies; only drop
+# it once nothing points at it any more. The check and the delete run under
+# the same lock as stored_media, so an upload of identical content cannot
+# commit the blob between them and then point a movie at a deleted file.
+def release_media(db: Session, keys: list):
+    keys = set(keys)
+    if not keys:
+        return
+    store = get_blob_store()
+    with media_lock(db, keys):
+        for key in sorted(keys):
+            in_use = db.query(model.Movies.movie_id).filter(
+                sqlalchemy.or_(model.Movies.video_key == key, model.Movies.coverimage_key == key)
+            ).first()
+            if not in_use:
+                store.delete(key)
+        db.commit()
+
+# Per-key media locks: striped locks within this process, plus a Postgres
+# advisory lock, held to the end of the transaction, for other workers
+_MEDIA_LOCKS = [threading.RLock() for _ in range(64)]
+
+@contextmanager
+def media_lock(db: Session, keys):
+    keys = sorted(set(keys))
+    with ExitStack() as stack:
+        for stripe in sorted({hash(key) % len(_MEDIA_LOCKS) for key in keys}):
+            stack.enter_context(_MEDIA_LOCKS[stripe])
+        if keys and db.get_bind().dialect.name == "postgresql":
+            for key in keys:
+                db.execute(sqlalchemy.text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": key})
+        yield
+
+# Resumable upload sessions
+
+def create_upload_session(db: Session, movie_id: int, kind: str, user_id: int):
+    upload = model.UploadSession(
+        upload_id = str(uuid.uuid4()),
+        movie_id = movie_id,
+        kind = kind,
+        user_id = user_id
+        )
+    db.add(upload)
+    db.commit()
+    return upload
+
+def get_upload_session(db: Session, upload_id: str):
+    return db.query(model.UploadSession).filter(model.UploadSession.upload_id == upload_id).first()
+
+def delete_upload_session(db: Session, upload: model.UploadSession):
+    db.delete(upload)
+    db.commit()
+
+def get_movie_by_id(db: Session, movie_id: int):
+    return db.query(model.Movies).filter(model.Movies.movie_id == movie_id).first()
+
 # Movie Crud End
  
 # Rating a movie 
 
-def rate_movie(db: Session, movie_id, rating: int, user_id: str):
-    existing_rating = db.query(model.Rating).filter(model.Rating.movie_id == movie_id, model.Rating.user_id == user_id).first()
-    if existing_rating:
+def rate_movie(db: Session, movie_id, rating: int, user_id: str, update_existing: bool = False):
+    # One INSERT ... ON CONFLICT does the duplicate check and the write, so two
+    # concurrent requests from the same user cannot both insert
+    insert = upsert(db, model.Rating).values(movie_id = movie_id, user_id = user_id, rating = rating)
+    conflict = [model.Rating.user_id, model.Rating.movie_id]
+    if update_existing:
+        insert = insert.on_conflict_do_update(index_elements=conflict, set_={
+            "previous_rating": model.Rating.rating,
+            "rating": insert.excluded.rating,
+        })
+    else:
+        insert = insert.on_conflict_do_nothing(index_elements=conflict)
+    written = db.execute(insert.returning(model.Rating.rating, model.Rating.previous_rating)).first()
+    if written is None:
+        db.rollback()
         raise HTTPException(status_code=400, detail="User has already rated this movie")
-    # Create a new rating
-    new_rating = model.Rating(
-        movie_id = movie_id,
-        user_id = user_id,
-        rating = rating
-        )
-    db.add(new_rating)
+
+    # previous_rating comes back NULL only for a freshly inserted row
+    deltas = RatingDeltas()
+    deltas.add(rating, written.previous_rating)
+    apply_rating_deltas(db, {movie_id: deltas})
+    leaderboard.record_ratings(db, {movie_id: deltas})
     db.commit()
-    db.refresh(new_rating)
-    
-    return {"detail": "Rating added successfully"}
+    cache.invalidate(f"ratings:{movie_id}")
+
+    if written.previous_rating is None:
+        return {"detail": "Rating added successfully"}
+    return {"detail": "Rating updated successfully"}
+
+# Bulk rating: a batch is resolved with one lookup, written with one
+# multi-row upsert and folded into the totals with one more statement.
+
+def bulk_rate_movies(db: Session, items: list, user_id: int, update_existing: bool = False):
+    titles = {slugify(item.movie_title) for _, item in items if item.movie_id is None}
+    ids = {item.movie_id for _, item in items if item.movie_id is not None}
+    found = db.query(model.Movies.movie_id, model.Movies.slug).filter(
+        sqlalchemy.or_(model.Movies.slug.in_(titles), model.Movies.movie_id.in_(ids))
+    ).all()
+    id_by_slug = {slug: movie_id for movie_id, slug in found}
+    known_ids = {movie_id for movie_id, _ in found}
+
+    results = {}
+    rows = {}
+    for index, item in items:
+        movie_id = item.movie_id if item.movie_id is not None else id_by_slug.get(slugify(item.movie_title))
+        if movie_id not in known_ids:
+            results[index] = {"index": index, "status": "movie_not_found"}
+        elif movie_id in rows:
+            # Postgres refuses to touch one row twice in a single upsert
+            results[index] = {"index": index, "movie_id": movie_id, "status": "duplicate"}
+        else:
+            rows[movie_id] = (index, item.rating)
+
+    if rows:
+        insert = upsert(db, model.Rating).values([
+            {"movie_id": movie_id, "user_id": user_id, "rating": rating} for movie_id, (_, rating) in sorted(rows.items())
+        ])
+        conflict = [model.Rating.user_id, model.Rating.movie_id]
+        if update_existing:
+            insert = insert.on_conflict_do_update(index_elements=conflict, set_={
+                "previous_rating": model.Rating.rating,
+                "rating": insert.excluded.rating,
+            })
+        else:
+            insert = insert.on_conflict_do_nothing(index_elements=conflict)
+        written = db.execute(insert.returning(model.Rating.movie_id, model.Rating.rating, model.Rating.previous_rating)).all()
+
+        deltas = {}
+        for movie_id, rating, previous_rating in written:
+            deltas.setdefault(movie_id, RatingDeltas()).add(rating, previous_rating)
+            index = rows.pop(movie_id)[0]
+            results[index] = {"index": index, "movie_id": movie_id, "status": "created" if previous_rating is None else "updated"}
+        for movie_id, (index, _) in rows.items():
+            results[index] = {"index": index, "movie_id": movie_id, "status": "already_rated"}
+        apply_rating_deltas(db, deltas)
+        leaderboard.record_ratings(db, deltas)
+        db.commit()
+        cache.invalidate(*(f"ratings:{movie_id}" for movie_id in deltas))
+
+    return [results[index] for index, _ in items]
+
+# Changes to one movie's rating totals, collected before they are written
+
+class RatingDeltas:
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.stars = {star: 0 for star in range(1, 6)}
+
+    def add(self, rating: int, previous_rating: int = None):
+        if previous_rating is None:
+            self.count += 1
+        else:
+            self.total -= previous_rating
+            self.stars[previous_rating] -= 1
+        self.total += rating
+        self.stars[rating] += 1
+
+# Bump the per-movie totals in the caller's transaction with one multi-row
+# upsert. The increments are relative (count = count + n), so concurrent
+# raters do not lose updates, and a missing totals row is simply created.
+
+def apply_rating_deltas(db: Session, deltas: dict):
+    if not deltas:
+        return
+    stats = model.MovieRatingStats
+    insert = upsert(db, stats).values([
+        {
+            "movie_id": movie_id,
+            "rating_count": delta.count,
+            "rating_sum": delta.total,
+            **{f"stars_{star}": change for star, change in delta.stars.items()},
+        }
+        for movie_id, delta in sorted(deltas.items())
+    ])
+    counters = ["rating_count", "rating_sum"] + [f"stars_{star}" for star in range(1, 6)]
+    db.execute(insert.on_conflict_do_update(
+        index_elements=[stats.movie_id],
+        set_={name: getattr(stats, name) + getattr(insert.excluded, name) for name in counters},
+    ))
+
+# Recompute every movie's totals from the ratings table, for after a bulk
+# load that skipped the per-write deltas
+
+def rebuild_rating_stats(db: Session):
+    stats, rating = model.MovieRatingStats, model.Rating
+    source = sqlalchemy.select(
+        model.Movies.movie_id,
+        func.count(rating.rating_id),
+        func.coalesce(func.sum(rating.rating), 0),
+        *[func.count(rating.rating_id).filter(rating.rating == star) for star in range(1, 6)],
+    ).outerjoin(rating, rating.movie_id == model.Movies.movie_id).group_by(model.Movies.movie_id)
+    db.execute(sqlalchemy.delete(stats))
+    db.execute(sqlalchemy.insert(stats).from_select(
+        ["movie_id", "rating_count", "rating_sum"] + [f"stars_{star}" for star in range(1, 6)], source
+    ))
+
+# Genres: the movie_genres rows and genre_counts follow Movies.genre
+
+def ensure_genres(db: Session, names: dict):
+    if not names:
+        return {}
+    db.execute(upsert(db, model.Genre).values([
+        {"slug": slug, "name": name} for slug, name in sorted(names.items())
+    ]).on_conflict_do_nothing(index_elements=[model.Genre.slug]))
+    rows = db.execute(sqlalchemy.select(model.Genre.slug, model.Genre.genre_id).where(model.Genre.slug.in_(names))).all()
+    return dict(rows)
+
+def set_movie_genres(db: Session, movie: model.Movies, genre_text: str, new: bool = False):
+    # A movie inserted in this transaction has no links to look up yet
+    movie_id = movie.movie_id
+    wanted = set(ensure_genres(db, genres.split_genres(genre_text)).values())
+    current = set() if new else set(db.execute(
+        sqlalchemy.select(model.MovieGenre.genre_id).where(model.MovieGenre.movie_id == movie_id)
+    ).scalars())
+    added, removed = sorted(wanted - current), sorted(current - wanted)
+    if added:
+        db.execute(sqlalchemy.insert(model.MovieGenre).values([
+            {"movie_id": movie_id, "genre_id": genre_id, "created_at": movie.created_at} for genre_id in added
+        ]))
+    if removed:
+        db.execute(sqlalchemy.delete(model.MovieGenre).where(
+            model.MovieGenre.movie_id == movie_id, model.MovieGenre.genre_id.in_(removed)
+        ))
+    apply_genre_counts(db, {**{genre_id: 1 for genre_id in added}, **{genre_id: -1 for genre_id in removed}})
+
+def apply_genre_counts(db: Session, deltas: dict):
+    if not deltas:
+        return
+    counts = model.GenreCount
+    insert = upsert(db, counts).values([
+        {"genre_id": genre_id, "movie_count": delta} for genre_id, delta in sorted(deltas.items())
+    ])
+    db.execute(insert.on_conflict_do_update(
+        index_elements=[counts.genre_id],
+        set_={"movie_count": counts.movie_count + insert.excluded.movie_count},
+    ))
+
+def rebuild_genre_counts(db: Session):
+    source = sqlalchemy.select(model.Genre.genre_id, func.count(model.MovieGenre.movie_id)).outerjoin(
+        model.MovieGenre, model.MovieGenre.genre_id == model.Genre.genre_id
+    ).group_by(model.Genre.genre_id)
+    db.execute(sqlalchemy.delete(model.GenreCount))
+    db.execute(sqlalchemy.insert(model.GenreCount).from_select(["genre_id", "movie_count"], source))
 
 # Get Ratings for a movie
 
-def get_ratings_for_movie(db: Session, movie_id: str):
-    ratings = db.query(
-        func.avg(model.Rating.rating).label('rating'),
-        model.Movies.title
-        ).join(
-            model.Movies, model.Rating.movie_id == model.Movies.movie_id
-    ).filter(
-    model.Movies.movie_id == movie_id
-    ).group_by(
-        model.Movies.title
-    ).first()
-    return (ratings)
-    # return db.query(model.Rating).filter(model.Rating.movie_id == movie_id).all()
+def get_ratings_for_movie(db: Session, movie: model.Movies):
+    stats = db.get(model.MovieRatingStats, movie.movie_id)
+    if not stats or not stats.rating_count:
+        return None
+    return {
+        "title": movie.title,
+        "rating": Decimal(stats.rating_sum) / stats.rating_count,
+        "rating_count": stats.rating_count,
+        "histogram": {star: getattr(stats, f"stars_{star}") for star in range(1, 6)},
+    }
 
 # Rating a movie End
 
 # Comment on a movie CRUD 
 
-def create_comment(db: Session, comment: schema.PostComment, movie_id: str, user_id: str):
+def create_comment(db: Session, comment: schema.PostComment, movie: model.Movies, user: schema.User):
     new_comment = model.ParentComment(
 
-        movie_id = movie_id,
-        user_id = user_id,
+        movie_id = movie.movie_id,
+        user_id = user.user_id,
         content = comment.content
         )
     db.add(new_comment)
+    leaderboard.bump_trending(db, {movie.movie_id: leaderboard.COMMENT_WEIGHT})
     db.commit()
-    db.refresh(new_comment)
+    cache.invalidate(f"comments:{movie.movie_id}")
 
-    user = db.query(model.User).filter(model.User.user_id == user_id).first()
-    movie = db.query(model.Movies).filter(model.Movies.movie_id == movie_id).first()
-   
     return {
         "username": user.username,
         "movie_title": movie.title,
@@ -193,27 +514,30 @@ def get_comments_for_movie(db: Session, movie_id: str):
         model.Movies, model.ParentComment.movie_id == model.Movies.movie_id
     ).filter(
         model.ParentComment.movie_id == movie_id
-    ).distinct().all()
+    ).order_by(model.ParentComment.created_at, model.ParentComment.parent_comment_id).all()
     
     return [{"movie_title": comment.title, "username": comment.username, "comment": comment.content} for comment in comments]
     
 # Reply to comments (Nested Comment)
 
-def reply_to_comment(db: Session, comment_id: str, reply: schema.PostReply, user_id: str):
-    parent_comment = db.query(model.ParentComment).filter(model.ParentComment.parent_comment_id == comment_id).first()
+def reply_to_comment(db: Session, comment_id: int, reply: schema.PostReply, user: schema.User):
+    parent_comment = db.execute(
+        sqlalchemy.select(model.ParentComment.movie_id, model.ParentComment.content)
+        .where(model.ParentComment.parent_comment_id == comment_id)
+    ).first()
     if not parent_comment:
         raise HTTPException(status_code=404, detail="Comment not found")
     
     new_reply = model.CommentReply(
-        parent_comment_id = parent_comment.parent_comment_id,
-        user_id = user_id,
+        parent_comment_id = comment_id,
+        user_id = user.user_id,
         content = reply.content
     )
     db.add(new_reply)
+    leaderboard.bump_trending(db, {parent_comment.movie_id: leaderboard.REPLY_WEIGHT})
     db.commit()
-    db.refresh(new_reply)
+    cache.invalidate(f"comments:{parent_comment.movie_id}")
     
-    user = db.query(model.User).filter(model.User.user_id == user_id).first()
     return {
         "username": user.username,
         "Comment": parent_comment.content,
@@ -225,4 +549,36 @@ def get_reply(db: Session, parent_comment_id: int):
     return [{"reply": reply.content} for reply in replies]
 
 # Comment on a movie CRUD End
-     
\ No newline at end of file
+
+# Cached reads. Values are stored JSON-ready so the shared tier can hold them;
+# the write paths above invalidate the matching keys after they commit.
+# use_cache=False reads straight through, for a client that has just written.
+# A miss loaded from a replica may predate a write that was just invalidated,
+# so it is kept no longer than a usable replica can lag.
+
+def _cached(db: Session, key: str, loader, use_cache: bool = True):
+    if not use_cache:
+        return loader()
+    ttl = REPLICA_MAX_LAG_SECONDS if db.info.get("replica") else None
+    return cache.get_or_load(key, loader, ttl)
+
+def cached_current_user(db: Session, user_id: int):
+    return cache.get_or_load(user_key(user_id), lambda: _user_value(get_user_by_id(db, user_id)))
+
+def _user_value(user):
+    return jsonable_encoder(schema.CurrentUser.model_validate(user)) if user else None
+
+def cached_movie_by_slug(db: Session, slug: str, use_cache: bool = True):
+    return _cached(db, f"movie:slug:{slug}", lambda: _movie_value(get_movie_by_slug(db, slug)), use_cache)
+
+def cached_movie_by_id(db: Session, movie_id: int, use_cache: bool = True):
+    return _cached(db, f"movie:id:{movie_id}", lambda: _movie_value(get_movie_by_id(db, movie_id)), use_cache)
+
+def _movie_value(movie):
+    return jsonable_encoder(schema.MovieResponse.model_validate(movie)) if movie else None
+
+def cached_ratings_for_movie(db: Session, movie, use_cache: bool = True):
+    return _cached(db, f"ratings:{movie.movie_id}", lambda: jsonable_encoder(get_ratings_for_movie(db, movie)), use_cache)
+
+def cached_comments_for_movie(db: Session, movie_id: int, use_cache: bool = True):
+    return _cached(db, f"comments:{movie_id}", lambda: get_comments_for_movie(db, movie_id), use_cache)
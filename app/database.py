@@ -7,9 +7,16 @@ sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 from dotenv import load_dotenv
 import sqlalchemy
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from dbpool import PoolStats, engine_options
+from metrics import track_queries
+from slowlog import DB_PROFILE, profile_queries
 
 load_dotenv()
 
@@ -17,13 +24,55 @@ SQLALCHEMY_DATABASE_URL = os.environ.get('DB_URL')
 if not SQLALCHEMY_DATABASE_URL:
     raise ValueError("No DB_URL found in environment variables")
 
+sync_pool_stats = PoolStats()
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
+    SQLALCHEMY_DATABASE_URL,
+    **engine_options(SQLALCHEMY_DATABASE_URL, QueuePool, sync_pool_stats)
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+track_queries(engine)
+if DB_PROFILE:
+    profile_queries(engine)
+# Rows written in a request keep their loaded state after commit, so write
+# paths can return them without a refresh; INSERT/UPDATE ... RETURNING fills
+# in server defaults
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# Async engine for routes that have moved off the thread pool: asyncpg for
+# Postgres, aiosqlite for local SQLite. ASYNC_DB_URL overrides the derived URL.
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+def async_url(url: str):
+    scheme, separator, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
+
+ASYNC_DATABASE_URL = os.environ.get('ASYNC_DB_URL') or async_url(SQLALCHEMY_DATABASE_URL)
+
+async_pool_stats = PoolStats()
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    **engine_options(ASYNC_DATABASE_URL, AsyncAdaptedQueuePool, async_pool_stats)
+)
+track_queries(async_engine.sync_engine)
+if DB_PROFILE:
+    profile_queries(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Sync routes run on this many worker threads at most
+DB_THREADPOOL_SIZE = int(os.environ.get('DB_THREADPOOL_SIZE', 40))
 
 Base = sqlalchemy.orm.declarative_base()
 
+# INSERT ... ON CONFLICT for the dialect behind a session
+def upsert(db, table):
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
 # dependency
 def get_db():
     db = SessionLocal()
@@ -31,3 +80,27 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Health checks: one round trip through each pool, timed in milliseconds
+
+def ping():
+    started = time.perf_counter()
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    return round((time.perf_counter() - started) * 1000, 3)
+
+async def async_ping():
+    started = time.perf_counter()
+    async with async_engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+    return round((time.perf_counter() - started) * 1000, 3)
+
+def pool_report():
+    return {
+        "sync": sync_pool_stats.snapshot(engine.pool),
+        "async": async_pool_stats.snapshot(async_engine.sync_engine.pool),
+    }
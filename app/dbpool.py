@@ -0,0 +1,132 @@
+import os
+import time
+import uuid
+import threading
+from collections import deque
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _flag(name: str, default: bool):
+    value = os.environ.get(name)
+    return default if value is None else value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Each worker process holds a sync and an async pool, so split the server's
+# connection budget across WEB_CONCURRENCY * 2 pools unless told otherwise
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 1))
+DB_MAX_CONNECTIONS = int(os.environ.get("DB_MAX_CONNECTIONS", 100))
+_budget = max(DB_MAX_CONNECTIONS // (WEB_CONCURRENCY * 2), 1)
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", min(10, _budget)))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", max(_budget - DB_POOL_SIZE, 0)))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = _flag("DB_POOL_PRE_PING", True)
+# PgBouncer in transaction mode hands each transaction a different server
+# connection, so prepared statements cached on one are missing on the next
+DB_PGBOUNCER = _flag("DB_PGBOUNCER", False)
+
+
+class PoolStats:
+    """Checkout timings and failures for one engine's pool."""
+
+    def __init__(self, samples: int = 1000):
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=samples)
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self.connect_errors = 0
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self._waits.append(seconds)
+            self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def record_error(self, error: BaseException):
+        with self._lock:
+            if isinstance(error, exc.TimeoutError):
+                self.timeouts += 1
+            else:
+                self.connect_errors += 1
+
+    def snapshot(self, pool):
+        with self._lock:
+            waits = sorted(self._waits)
+            stats = {
+                "checkouts": self.checkouts,
+                "wait_ms_avg": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0,
+                "wait_ms_max": round(self.max_wait * 1000, 3),
+                "timeouts": self.timeouts,
+                "connect_errors": self.connect_errors,
+            }
+        for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            stats[f"wait_ms_{name}"] = round(waits[min(int(len(waits) * fraction), len(waits) - 1)] * 1000, 3) if waits else 0
+        stats.update(pool_usage(pool))
+        return stats
+
+
+def pool_usage(pool):
+    if not hasattr(pool, "checkedout"):
+        return {"pool": type(pool).__name__}
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    return {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "utilization": round(pool.checkedout() / capacity, 3) if capacity else 0,
+    }
+
+
+def timed_pool(pool_class, stats: PoolStats):
+    """Subclass pool_class so every checkout reports its wait to stats. The
+    subclass survives engine.dispose(), which rebuilds the pool from its class."""
+
+    class TimedPool(pool_class):
+        def connect(self):
+            started = time.perf_counter()
+            try:
+                connection = super().connect()
+            except BaseException as error:
+                stats.record_error(error)
+                raise
+            stats.record_wait(time.perf_counter() - started)
+            return connection
+
+    TimedPool.__name__ = f"Timed{pool_class.__name__}"
+    return TimedPool
+
+
+def engine_options(url: str, pool_class, stats: PoolStats):
+    """Keyword arguments for create_engine/create_async_engine. In-memory
+    SQLite keeps SQLAlchemy's single-connection pool."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return {}
+    options = {
+        "poolclass": timed_pool(pool_class, stats),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if DB_PGBOUNCER and parsed.get_driver_name() == "asyncpg":
+        options["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    return options
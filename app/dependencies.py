@@ -0,0 +1,49 @@
+from fastapi import Depends, HTTPException, Request
+from sqlalchemy.orm import Session
+
+import crud, model, schema
+from slugs import slugify
+from database import get_db
+from replicas import get_read_db, wrote_recently
+from my_logging.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Shared movie lookups: each request resolves its movie exactly once, through
+# the indexed slug or the primary key, and 404s the same way everywhere.
+
+def movie_by_title(movie_title: str, db: Session = Depends(get_db)) -> model.Movies:
+    movie = crud.get_movie_by_title(db, title=movie_title)
+    if not movie:
+        logger.warning("Movie %s not found", movie_title)
+        raise HTTPException(status_code=404, detail="Movie not found")
+    return movie
+
+def movie_by_id(movie_id: int, db: Session = Depends(get_db)) -> model.Movies:
+    movie = crud.get_movie_by_id(db, movie_id)
+    if not movie:
+        logger.warning("Movie %s not found", movie_id)
+        raise HTTPException(status_code=404, detail="Movie not found")
+    return movie
+
+# Read-only variants served from the cache; they hand back the public
+# MovieResponse rather than an ORM row. Misses load from a replica, and a
+# client that has just written reads the primary and skips the cache so it
+# sees its own change.
+
+def cache_enabled(request: Request) -> bool:
+    return not wrote_recently(request)
+
+def cached_movie_by_title(movie_title: str, db: Session = Depends(get_read_db), use_cache: bool = Depends(cache_enabled)) -> schema.MovieResponse:
+    movie = crud.cached_movie_by_slug(db, slugify(movie_title), use_cache)
+    if not movie:
+        logger.warning("Movie %s not found", movie_title)
+        raise HTTPException(status_code=404, detail="Movie not found")
+    return schema.MovieResponse(**movie)
+
+def cached_movie_by_id(movie_id: int, db: Session = Depends(get_read_db), use_cache: bool = Depends(cache_enabled)) -> schema.MovieResponse:
+    movie = crud.cached_movie_by_id(db, movie_id, use_cache)
+    if not movie:
+        logger.warning("Movie %s not found", movie_id)
+        raise HTTPException(status_code=404, detail="Movie not found")
+    return schema.MovieResponse(**movie)
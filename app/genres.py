@@ -0,0 +1,70 @@
+import re
+
+import sqlalchemy
+from sqlalchemy import exists, select, union_all
+from sqlalchemy.orm import aliased
+
+import model
+from pagination import clamp_limit, decode_cursor
+from slugs import slugify
+
+# Movies.genre stays as the text the uploader typed; the genres and
+# movie_genres tables hold it split into individual genres
+SEPARATORS = re.compile(r"[,/|;]")
+
+
+def split_genres(text: str):
+    """Map each genre slug in text to its display name, e.g.
+    "Action, Sci-Fi" -> {"action": "Action", "sci-fi": "Sci-Fi"}."""
+    genres = {}
+    for part in SEPARATORS.split(text or ""):
+        name = " ".join(part.split())
+        if re.search(r"[A-Za-z0-9]", name):
+            genres.setdefault(slugify(name)[:100], name[:100])
+    return genres
+
+
+def tagged_with(names):
+    """A WHERE clause for movies tagged with any of the genre names, matched
+    by slug the way split_genres stores them, so "action" finds a movie
+    listed as "Action, Crime"."""
+    slugs = {slugify(name)[:100] for name in names}
+    return model.Movies.movie_id.in_(
+        select(model.MovieGenre.movie_id)
+        .join(model.Genre, model.Genre.genre_id == model.MovieGenre.genre_id)
+        .where(model.Genre.slug.in_(slugs))
+    )
+
+
+def browse_statement(genre_ids, match: str = "all", cursor: str = None, limit: int = 10):
+    """Movies tagged with every (match="all") or any (match="any") of
+    genre_ids, one page in movie_id order. For "all", pass genre_ids rarest
+    first: the rarest genre drives the scan and the rest are index probes."""
+    limit = clamp_limit(limit)
+    after = decode_cursor(cursor, int)[0] if cursor else 0
+    tagged = model.MovieGenre
+
+    if match == "all":
+        driver, *others = genre_ids
+        page = select(tagged.movie_id).where(tagged.genre_id == driver, tagged.movie_id > after)
+        for genre_id in others:
+            other = aliased(model.MovieGenre)
+            page = page.where(exists().where(other.movie_id == tagged.movie_id, other.genre_id == genre_id))
+        page = page.order_by(tagged.movie_id).limit(limit + 1)
+    else:
+        # One short index range per genre, merged, rather than every movie in all of them
+        per_genre = [
+            select(tagged.movie_id).where(tagged.genre_id == genre_id, tagged.movie_id > after)
+            .order_by(tagged.movie_id).limit(limit + 1).subquery().select()
+            for genre_id in genre_ids
+        ]
+        merged = union_all(*per_genre).subquery()
+        page = select(merged.c.movie_id).distinct().order_by(merged.c.movie_id).limit(limit + 1)
+
+    page = page.subquery()
+    statement = (
+        select(model.Movies)
+        .join(page, page.c.movie_id == model.Movies.movie_id)
+        .order_by(model.Movies.movie_id)
+    )
+    return statement, limit
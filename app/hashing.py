@@ -0,0 +1,70 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+load_dotenv()
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class HashPool:
+    """Runs password hashing off the event loop on a fixed number of threads.
+    bcrypt releases the GIL while it works, so threads hash in parallel
+    without the pickling cost of a process pool. At most max_pending calls
+    may be running or queued; anything beyond that is turned away with a 503
+    instead of piling up behind the workers."""
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hashing")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="Server busy, try again shortly", headers={"Retry-After": "1"})
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+        try:
+            return await asyncio.wrap_future(self.executor.submit(fn, *args))
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "running": min(self.pending, self.workers),
+                "queued": max(self.pending - self.workers, 0),
+                "peak_pending": self.peak_pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+
+hash_pool = HashPool(
+    workers=int(os.environ.get("HASH_WORKERS", os.cpu_count() or 1)),
+    max_pending=int(os.environ.get("HASH_MAX_PENDING", 64)),
+)
+
+
+async def hash_password(password: str):
+    return await hash_pool.run(pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str):
+    return await hash_pool.run(pwd_context.verify, password, hashed_password)
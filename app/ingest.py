@@ -0,0 +1,77 @@
+import json
+from typing import AsyncIterator
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import crud, schema
+
+BATCH_SIZE = 1000
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]):
+    # Yields one decoded line at a time; a line split across chunks is
+    # stitched back together, so only the current line is ever buffered
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if pending.strip():
+        yield pending
+
+
+def iter_json_list(body: bytes):
+    items = json.loads(body)
+    if not isinstance(items, list):
+        raise ValueError("Expected a JSON list")
+
+    async def records():
+        for item in items:
+            yield item
+    return records()
+
+
+def _parse(line):
+    try:
+        raw = json.loads(line) if isinstance(line, bytes) else line
+        return schema.BulkRatingItem.model_validate(raw), None
+    except (ValueError, ValidationError) as exc:
+        # ValidationError is a ValueError too; keep just the first message
+        errors = exc.errors() if isinstance(exc, ValidationError) else None
+        return None, errors[0]["msg"] if errors else str(exc)
+
+
+async def ingest_ratings(db: Session, records: AsyncIterator, user_id: int, update_existing: bool = False):
+    results = []
+    batch = []
+
+    async def flush():
+        if batch:
+            written = await run_in_threadpool(crud.bulk_rate_movies, db, list(batch), user_id=user_id, update_existing=update_existing)
+            results.extend(written)
+            batch.clear()
+
+    index = 0
+    async for record in records:
+        item, error = _parse(record)
+        if error:
+            results.append({"index": index, "status": "invalid", "error": error})
+        else:
+            batch.append((index, item))
+            if len(batch) >= BATCH_SIZE:
+                await flush()
+        index += 1
+    await flush()
+
+    results.sort(key=lambda result: result["index"])
+    statuses = [result["status"] for result in results]
+    return {
+        "results": results,
+        "created": statuses.count("created"),
+        "updated": statuses.count("updated"),
+        "failed": len(statuses) - statuses.count("created") - statuses.count("updated"),
+    }
@@ -0,0 +1,234 @@
+import os
+import math
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import model
+from database import SessionLocal, upsert
+from pagination import clamp_limit
+from my_logging.logger import get_logger
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Top rated: Bayesian average, shrinking each movie's mean towards the
+# catalog mean as if it had PRIOR_VOTES extra votes at that mean
+PRIOR_VOTES = float(os.environ.get("LEADERBOARD_PRIOR_VOTES", 10))
+DEFAULT_MEAN = 3.0
+
+# Trending: every rating, comment and reply adds weight that halves every
+# HALF_LIFE. Rather than decaying every row as time passes, new weight is
+# scaled up by 2^((now - EPOCH) / HALF_LIFE), which ranks rows exactly as
+# the decayed scores would. That factor overflows a double after about 1000
+# half-lives, so scores are stored as its natural log instead and added
+# together with log-sum-exp; each update is still one indexed upsert and
+# nothing ever needs rebasing. NULL means no activity.
+HALF_LIFE = timedelta(hours=float(os.environ.get("TRENDING_HALF_LIFE_HOURS", 72)))
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+RATING_WEIGHT = 1.0
+COMMENT_WEIGHT = 0.5
+REPLY_WEIGHT = 0.25
+# Activity older than this many half-lives is ignored when rebuilding
+REBUILD_HALF_LIVES = 10
+
+REFRESH_SECONDS = float(os.environ.get("LEADERBOARD_REFRESH_SECONDS", 300))
+
+_prior = {"mean": None}
+
+
+def growth(at: datetime = None):
+    """ln of the scale factor for weight added at `at`."""
+    at = at or datetime.now(timezone.utc)
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+    return (at - EPOCH) / HALF_LIFE * math.log(2)
+
+
+def decayed(stored: float, now: datetime = None):
+    """A stored trending score as of now."""
+    return math.exp(stored - growth(now))
+
+
+def log_add(a: float, b: float):
+    """ln(e^a + e^b) without leaving log space."""
+    if a is None or b is None:
+        return b if a is None else a
+    return max(a, b) + math.log1p(math.exp(-abs(a - b)))
+
+
+def _sql_log_add(a, b):
+    larger = sqlalchemy.case((a > b, a), else_=b)
+    return sqlalchemy.case(
+        (a.is_(None), b),
+        else_=larger + func.ln(1 + func.exp(-func.abs(a - b))),
+    )
+
+
+# Writes, made in the caller's transaction
+
+def catalog_mean(db: Session):
+    total, count = db.execute(
+        select(func.coalesce(func.sum(model.MovieRatingStats.rating_sum), 0), func.coalesce(func.sum(model.MovieRatingStats.rating_count), 0))
+    ).one()
+    return total / count if count else DEFAULT_MEAN
+
+
+def prior_mean(db: Session):
+    if _prior["mean"] is None:
+        _prior["mean"] = catalog_mean(db)
+    return _prior["mean"]
+
+
+def rescore_top_rated(db: Session, movie_ids=None):
+    """Recompute Bayesian scores from the rating totals, for movie_ids or for
+    every rated movie."""
+    stats = model.MovieRatingStats
+    mean = prior_mean(db)
+    score = (PRIOR_VOTES * mean + stats.rating_sum) / (PRIOR_VOTES + stats.rating_count)
+    source = select(stats.movie_id, sqlalchemy.case((stats.rating_count > 0, score), else_=None))
+    if movie_ids is not None:
+        source = source.where(stats.movie_id.in_(sorted(movie_ids)))
+    else:
+        # SQLite needs a WHERE clause to tell an upsert's SELECT from its ON CONFLICT
+        source = source.where(sqlalchemy.true())
+    insert = upsert(db, model.MovieLeaderboard).from_select(["movie_id", "top_score"], source)
+    db.execute(insert.on_conflict_do_update(
+        index_elements=[model.MovieLeaderboard.movie_id],
+        set_={"top_score": insert.excluded.top_score},
+    ))
+
+
+def bump_trending(db: Session, weights: dict, at: datetime = None):
+    if not weights:
+        return
+    scale = growth(at)
+    board = model.MovieLeaderboard
+    insert = upsert(db, board).values([
+        {"movie_id": movie_id, "trending_score": math.log(weight) + scale} for movie_id, weight in sorted(weights.items())
+    ])
+    db.execute(insert.on_conflict_do_update(
+        index_elements=[board.movie_id],
+        set_={"trending_score": _sql_log_add(board.trending_score, insert.excluded.trending_score)},
+    ))
+
+
+def record_ratings(db: Session, deltas: dict):
+    """Fold a batch of crud.RatingDeltas into both rankings."""
+    if not deltas:
+        return
+    rescore_top_rated(db, deltas.keys())
+    bump_trending(db, {movie_id: delta.count * RATING_WEIGHT for movie_id, delta in deltas.items() if delta.count})
+
+
+def rebuild_trending(db: Session, now: datetime = None):
+    """Recompute trending scores from recent ratings, comments and replies,
+    e.g. after HALF_LIFE changes."""
+    now = now or datetime.now(timezone.utc)
+    since = (now - HALF_LIFE * REBUILD_HALF_LIVES).replace(tzinfo=None)
+    activity = [
+        (RATING_WEIGHT, select(model.Rating.movie_id, model.Rating.created_at).where(model.Rating.created_at >= since)),
+        (COMMENT_WEIGHT, select(model.ParentComment.movie_id, model.ParentComment.created_at).where(model.ParentComment.created_at >= since)),
+        (REPLY_WEIGHT, select(model.ParentComment.movie_id, model.CommentReply.created_at)
+            .join(model.ParentComment, model.ParentComment.parent_comment_id == model.CommentReply.parent_comment_id)
+            .where(model.CommentReply.created_at >= since)),
+    ]
+    scores = {}
+    for weight, statement in activity:
+        for movie_id, created_at in db.execute(statement):
+            scores[movie_id] = log_add(scores.get(movie_id), math.log(weight) + growth(created_at))
+    db.execute(sqlalchemy.update(model.MovieLeaderboard).values(trending_score=None))
+    set_trending(db, scores)
+
+
+def set_trending(db: Session, scores: dict):
+    if not scores:
+        return
+    board = model.MovieLeaderboard
+    insert = upsert(db, board).values([
+        {"movie_id": movie_id, "trending_score": score} for movie_id, score in sorted(scores.items())
+    ])
+    db.execute(insert.on_conflict_do_update(
+        index_elements=[board.movie_id],
+        set_={"trending_score": insert.excluded.trending_score},
+    ))
+
+
+def scored_mean(db: Session):
+    """The prior mean the stored top-rated scores were computed with,
+    recovered from one scored movie; None if nothing is scored."""
+    board, stats = model.MovieLeaderboard, model.MovieRatingStats
+    row = db.execute(
+        select(board.top_score, stats.rating_count, stats.rating_sum)
+        .join(stats, stats.movie_id == board.movie_id)
+        .where(board.top_score.is_not(None), stats.rating_count > 0)
+        .limit(1)
+    ).first()
+    if row is None:
+        return None
+    return (row.top_score * (PRIOR_VOTES + row.rating_count) - row.rating_sum) / PRIOR_VOTES
+
+
+def refresh(db: Session):
+    """Pick up drift in the catalog mean and rescore every movie if it moved."""
+    mean = catalog_mean(db)
+    if _prior["mean"] is None:
+        # A starting worker adopts the mean the stored scores already use, so
+        # a restart alone does not rewrite the whole board
+        _prior["mean"] = scored_mean(db)
+        if _prior["mean"] is None:
+            rated = db.execute(select(model.MovieRatingStats.movie_id).where(model.MovieRatingStats.rating_count > 0).limit(1)).first()
+            # Nothing rated means nothing to score; ratings but no scores need seeding
+            _prior["mean"] = None if rated else mean
+    if _prior["mean"] is None or not math.isclose(mean, _prior["mean"], abs_tol=0.005):
+        _prior["mean"] = mean
+        rescore_top_rated(db)
+    # Nothing trending yet, e.g. straight after the migration: seed it
+    if db.execute(select(model.MovieLeaderboard.movie_id).where(model.MovieLeaderboard.trending_score.is_not(None)).limit(1)).first() is None:
+        rebuild_trending(db)
+    db.commit()
+
+
+def refresh_now():
+    with SessionLocal() as db:
+        refresh(db)
+
+
+async def run_refresher():
+    while True:
+        try:
+            await run_in_threadpool(refresh_now)
+        except Exception as error:
+            logger.error("Leaderboard refresh failed: %r", error)
+        await asyncio.sleep(REFRESH_SECONDS)
+
+
+# Reads: k rows off the top of an index
+
+def top_rated_statement(limit: int = 10):
+    board = model.MovieLeaderboard
+    return (
+        select(model.Movies, board.top_score, model.MovieRatingStats.rating_count, model.MovieRatingStats.rating_sum)
+        .join(board, board.movie_id == model.Movies.movie_id)
+        .join(model.MovieRatingStats, model.MovieRatingStats.movie_id == model.Movies.movie_id)
+        .where(board.top_score.is_not(None))
+        .order_by(board.top_score.desc(), board.movie_id)
+        .limit(clamp_limit(limit))
+    )
+
+
+def trending_statement(limit: int = 10):
+    board = model.MovieLeaderboard
+    return (
+        select(model.Movies, board.trending_score)
+        .join(board, board.movie_id == model.Movies.movie_id)
+        .where(board.trending_score.is_not(None))
+        .order_by(board.trending_score.desc(), board.movie_id)
+        .limit(clamp_limit(limit))
+    )
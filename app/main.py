@@ -1,24 +1,45 @@
-from fastapi import Depends, FastAPI, File, UploadFile, HTTPException, Form
+import asyncio
+from contextlib import asynccontextmanager
+import anyio
+from fastapi import Depends, FastAPI, File, UploadFile, HTTPException, Form, Query, Request
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from typing import List
 from datetime import datetime
-import crud, schema, model, auth, database
-from auth import pwd_context, oauth2_scheme, authenticate_user, create_access_token, get_current_user
+import crud, async_crud, schema, model, auth, database, dbpool, replicas, uploads, streaming, ingest, hashing, ratelimit, leaderboard, metrics, slowlog
+from auth import oauth2_scheme, authenticate_user, issue_tokens, decode_token, load_token_user, get_current_user, get_token_user, get_admin_user
 import sqlalchemy
 from datetime import date
 from io import BytesIO
 import base64
-from database import SessionLocal, engine, Base, get_db
-from typing import Optional
-from passlib.context import CryptContext
-from my_logging.logger import get_logger
+from database import SessionLocal, engine, Base, get_db, get_async_db
+from replicas import get_read_db, get_async_read_db, StickyPrimaryMiddleware
+from dependencies import movie_by_title, movie_by_id, cached_movie_by_title, cached_movie_by_id, cache_enabled
+from typing import Literal, Optional
+from my_logging.logger import get_logger, log_stats, RequestLogMiddleware
 
 
 
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+# Routes declared with plain `def` use the sync Session and run on AnyIO's
+# worker threads; cap that pool so a burst cannot open unbounded connections.
+# Routes that have moved to AsyncSession stay on the event loop.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = database.DB_THREADPOOL_SIZE
+    refresher = asyncio.create_task(leaderboard.run_refresher())
+    yield
+    refresher.cancel()
+    await database.async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(StickyPrimaryMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(RequestLogMiddleware)
 logger = get_logger(__name__)
 
 @app.get("/")
@@ -26,214 +47,455 @@ async def root():
     logger.info("App accessed")
     return {"message": "Welcome to my Movie Listing API"}
 
+@app.get("/healthz")
+async def healthz():
+    report = {"status": "ok", "workers": dbpool.WEB_CONCURRENCY, "database": {}}
+    for name, check in (("sync", lambda: run_in_threadpool(database.ping)), ("async", database.async_ping)):
+        try:
+            report["database"][name] = {"ok": True, "ping_ms": await check()}
+        except Exception as error:
+            logger.error("Health check failed on the %s pool: %r", name, error)
+            report["database"][name] = {"ok": False, "error": type(error).__name__}
+            report["status"] = "unavailable"
+    report["pools"] = database.pool_report()
+    report["replicas"] = replicas.replica_set.report()
+    report["hash_pool"] = hashing.hash_pool.stats()
+    return JSONResponse(report, status_code=200 if report["status"] == "ok" else 503)
+
+# Pool, hashing and logging state read at scrape time, next to the request
+# metrics collected by MetricsMiddleware
+def runtime_metrics():
+    pools = database.pool_report()
+    hash_stats = hashing.hash_pool.stats()
+    logs = log_stats()
+    pool_gauges = [
+        ("db_pool_checked_out", "gauge", "Connections in use.", "checked_out"),
+        ("db_pool_size", "gauge", "Connections kept open by the pool.", "size"),
+        ("db_pool_checkouts_total", "counter", "Connections handed out.", "checkouts"),
+        ("db_pool_timeouts_total", "counter", "Checkouts that gave up waiting for a connection.", "timeouts"),
+        ("db_pool_connect_errors_total", "counter", "Failed attempts to open a connection.", "connect_errors"),
+    ]
+    for name, kind, help, key in pool_gauges:
+        yield name, kind, help, [({"pool": pool}, stats[key]) for pool, stats in pools.items() if key in stats]
+    yield "password_hash_running", "gauge", "Password hashes being computed.", [({}, hash_stats["running"])]
+    yield "password_hash_queued", "gauge", "Password hashes waiting for a worker.", [({}, hash_stats["queued"])]
+    yield "password_hash_rejected_total", "counter", "Hashes refused with 503 because the queue was full.", [({}, hash_stats["rejected"])]
+    yield "log_queue_depth", "gauge", "Log records waiting to be written.", [({}, logs["queued"])]
+    yield "log_records_dropped_total", "counter", "Log records dropped because the queue was full.", [({}, logs["dropped"])]
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(runtime_metrics()), media_type=metrics.CONTENT_TYPE)
+
+# Slow query report, filled in when DB_PROFILE is on
+
+@app.get("/admin/slow-queries", response_model=schema.SlowQueryReport)
+def get_slow_queries(
+    limit: int = Query(20, ge=1, le=100),
+    order: Literal["total_ms", "max_ms", "avg_ms", "calls"] = "total_ms",
+    admin: schema.CurrentUser = Depends(get_admin_user),
+    ):
+    return {
+        "enabled": slowlog.DB_PROFILE,
+        "threshold_ms": slowlog.SLOW_QUERY_MS,
+        "queries": slowlog.slow_queries.top(limit, order),
+    }
+
+@app.delete("/admin/slow-queries")
+def reset_slow_queries(admin: schema.CurrentUser = Depends(get_admin_user)):
+    slowlog.slow_queries.reset()
+    logger.info("%s cleared the slow query report", admin.username)
+    return {"detail": "Slow query report cleared"}
+
 # User EndPoint Start
 @app.post("/signup/", response_model=schema.UserResponse)
-async def signup(user: schema.UserCreate, db: Session = Depends(get_db)):
+async def signup(user: schema.UserCreate, db: AsyncSession = Depends(get_async_db)):
     logger.info("Creating User....")
-    check_email = crud.get_user_by_email(db, email=user.email)
+    check_email = await async_crud.get_user_by_email(db, email=user.email)
     if check_email:
-        logger.warning(f'email:{user.email} already exists')
+        logger.warning('email:%s already exists', user.email)
         raise HTTPException(status_code=400, detail="Email already registered")
-    check_username = crud.get_user_by_username(db, username=user.username)
+    check_username = await async_crud.get_user_by_username(db, username=user.username)
     if check_username:
         raise HTTPException(status_code=400, detail="Username already taken")
-    hashed_password = pwd_context.hash(user.password)
-    new_user = crud.create_user(db, user=user, hashed_password=hashed_password)
-    logger.info(f"Created a new user {user.username}")
+    hashed_password = await hashing.hash_password(user.password)
+    new_user = await async_crud.create_user(db, user=user, hashed_password=hashed_password)
+    logger.info("Created a new user %s", user.username)
     return new_user
 
-@app.post('/login/')
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def too_many_attempts(retry_after: int):
+    return HTTPException(
+        status_code=429,
+        detail="Too many login attempts, try again later",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+@app.post('/login/', response_model=schema.Token)
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     logger.info("Generating authentication token...")
-    user = authenticate_user(db, form_data.username, form_data.password)
+    # Both limits are checked before any bcrypt work is queued
+    client_host = request.client.host if request.client else "unknown"
+    retry_after = ratelimit.login_failures.retry_after(form_data.username) or ratelimit.login_attempts.hit(client_host)
+    if retry_after:
+        logger.warning("Login rate limit hit for %s from %s", form_data.username, client_host)
+        raise too_many_attempts(retry_after)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
+        ratelimit.login_failures.consume(form_data.username)
         raise HTTPException(
             status_code=401,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": user.username})
-    logger.info(f"Token generated for {user.username}")
-    return {"access_token": access_token, "token_type": "bearer"}
+    logger.info("Token generated for %s", user.username)
+    return issue_tokens(user)
+
+# Exchanging a refresh token needs no password check, so short-lived access
+# tokens do not send clients back through bcrypt
+@app.post('/token/refresh', response_model=schema.Token)
+def refresh_token(body: schema.RefreshRequest, db: Session = Depends(get_db)):
+    user = load_token_user(db, decode_token(body.refresh_token, token_type="refresh"))
+    return issue_tokens(user)
 
 
 @app.put("/reset_password/{email}")
-async def reset_password(email: str, new_password: schema.PasswordReset, db: Session = Depends(get_db), current_user: model.User = Depends(get_current_user)):
-    get_user = crud.get_user_by_email(db, email)
+async def reset_password(email: str, new_password: schema.PasswordReset, db: AsyncSession = Depends(get_async_db), current_user: schema.CurrentUser = Depends(get_current_user)):
+    get_user = await async_crud.get_user_by_email(db, email)
     if not get_user:
-        logger.warning(f'user with the email {email} is not found')
+        logger.warning('user with the email %s is not found', email)
         raise HTTPException(status_code=404, detail="User not found")
     if current_user.email != get_user.email:
-        logger.warning('User with the email {email} is not authorized')
+        logger.warning('User with the email %s is not authorized', email)
         raise HTTPException(status_code=401, detail="Unauthorized user")
-    hashed_password = pwd_context.hash(new_password.password)
-    updated_user = crud.update_user_password(db, email=email, new_password=new_password.password)
-    logger.info(f"Updated user {current_user.username} password successfully")
+    if await hashing.verify_password(new_password.password, get_user.hashed_password):
+        raise HTTPException(status_code=400, detail="New password must be different from the old password")
+    hashed_password = await hashing.hash_password(new_password.password)
+    await async_crud.update_user_password(db, get_user, hashed_password)
+    logger.info("Updated user %s password successfully", current_user.username)
     return {"message": "Password reset successfully"}
 
 # User EndPoint End
 
 # Movie EndPoint Start
 
-# @app.post("/List_a_Movie/", response_model=schema.MovieResponse)
-# async def list_a_movie(
-    
-#     title: str = Form(...),
-#     genre: str = Form(...),
-#     description: str = Form(...),
-#     videofile: UploadFile = File(...),
-#     coverfile: UploadFile = File(...),
-#     release_date: str = Form(...),
-#     db: Session = Depends(get_db),
-#     posted_by: schema.User = Depends(get_current_user)
-#     ):
-#     if videofile.content_type != "video/mp4":
-#         raise HTTPException(status_code=400, detail="Invalid file type. Only MP4 files are allowed.")
-#     if coverfile.content_type not in ["image/jpeg", "image/png"]:
-#         raise HTTPException(status_code=400, detail="Invalid file type. Only jpeg or png files are allowed.")
+@app.post("/List_a_Movie/files/", response_model=schema.MovieResponse)
+async def list_a_movie_with_files(
     
-#     videofile_data = await videofile.read()
-#     coverfile_data = await coverfile.read()
-
-#     movie_upload = schema.MovieUpload(
-#         title=title,
-#         genre=genre,
-#         description=description,
-#         video_data=videofile_data,
-#         coverimage_data=coverfile_data,
-#         release_date=release_date,
-#         user_id=posted_by.user_id,
-
-#     )
-
-#     new_movie = crud.upload_new_movie (db, movie= movie_upload, user_id = posted_by.user_id )
-#     logger.info(f'{posted_by.username} listed a new movie {new_movie.title}')
-#     return new_movie
+    title: str = Form(...),
+    genre: str = Form(...),
+    description: str = Form(...),
+    videofile: UploadFile = File(...),
+    coverfile: UploadFile = File(...),
+    release_date: str = Form(...),
+    db: Session = Depends(get_db),
+    posted_by: schema.User = Depends(get_current_user)
+    ):
+    movie_upload = schema.MovieUpload(
+        title=title,
+        genre=genre,
+        description=description,
+        release_date=release_date,
+    )
+    # Files are streamed to spool files in chunks, never read whole, and both
+    # are checked before either is committed to the blob store
+    media = await uploads.spool_streams({
+        "video": uploads.iter_upload_file(videofile),
+        "coverimage": uploads.iter_upload_file(coverfile),
+    })
+
+    new_movie = await run_in_threadpool(crud.Upload_new_movie, db, movie=movie_upload, user_id=posted_by.user_id, media=media)
+    logger.info('%s listed a new movie %s', posted_by.username, new_movie.title)
+    return new_movie
 
 @app.post("/List_a_Movie/", response_model=schema.MovieResponse)
-async def list_a_movie(movie: schema.MovieUpload, db: Session = Depends(get_db), posted_by: schema.User = Depends(get_current_user)):
+def list_a_movie(movie: schema.MovieUpload, db: Session = Depends(get_db), posted_by: schema.User = Depends(get_current_user)):
     new_movie = crud.Upload_new_movie (db, movie= movie, user_id = posted_by.user_id )
-    logger.info(f'{posted_by.username} listed a new movie')
+    logger.info('%s listed a new movie', posted_by.username)
     return new_movie
 
-@app.get("/movies/", response_model=List[schema.MovieResponse])
-async def get_all_movies(db: Session = Depends(get_db), offset: int = 0, limit: int = 10):
-    all_movies = crud.view_all_movies(db, offset=offset, limit=limit)
+@app.get("/movies/", response_model=schema.MoviePage)
+async def get_all_movies(
+    db: AsyncSession = Depends(get_async_read_db),
+    cursor: Optional[str] = None,
+    limit: int = 10,
+    genre: Optional[str] = None,
+    release_year: Optional[int] = None,
+    offset: Optional[int] = Query(None, deprecated=True),
+    ):
+    all_movies = await async_crud.view_all_movies(db, cursor=cursor, limit=limit, genre=genre, release_year=release_year, offset=offset)
     logger.info("All movies Generated by a user")
     return all_movies
 
-@app.get("/movie/{title}", response_model=schema.MovieResponse)
-async def get_movie_by_title(title: str, db: Session = Depends(get_db)):
-    movie = crud.get_movie_by_title(db, title=title)
-    if not movie:
-        logger.warning(f'Movie {title} not found')
-        raise HTTPException(status_code=404, detail="Movie not found")
-    logger.info(f'Movie {title} fetched')
+@app.get("/leaderboards/top-rated", response_model=List[schema.TopRatedEntry])
+async def top_rated_movies(limit: int = 10, db: AsyncSession = Depends(get_async_read_db)):
+    return await async_crud.top_rated(db, limit=limit)
+
+@app.get("/leaderboards/trending", response_model=List[schema.TrendingEntry])
+async def trending_movies(limit: int = 10, db: AsyncSession = Depends(get_async_read_db)):
+    return await async_crud.trending(db, limit=limit)
+
+@app.get("/genres/", response_model=List[schema.GenreFacet])
+async def list_genres(db: AsyncSession = Depends(get_async_read_db)):
+    return await async_crud.genre_facets(db)
+
+@app.get("/genres/movies", response_model=schema.GenrePage)
+async def browse_genres(
+    genre: List[str] = Query(..., min_length=1),
+    match: Literal["all", "any"] = "all",
+    cursor: Optional[str] = None,
+    limit: int = 10,
+    db: AsyncSession = Depends(get_async_read_db),
+    ):
+    page = await async_crud.browse_genres(db, genre, match=match, cursor=cursor, limit=limit)
+    logger.info("Browsed genres %s (%s)", genre, match)
+    return page
+
+@app.get("/movies/search", response_model=schema.MovieSearchPage)
+async def search_movies(
+    q: str = Query(..., min_length=1, max_length=200),
+    genre: Optional[List[str]] = Query(None),
+    cursor: Optional[str] = None,
+    limit: int = 10,
+    db: AsyncSession = Depends(get_async_read_db),
+    ):
+    results = await async_crud.search_movies(db, q, genres=genre, cursor=cursor, limit=limit)
+    logger.info("Search for '%s' returned %s movies", q, len(results['results']))
+    return results
+
+@app.get("/movie/{movie_title}", response_model=schema.MovieResponse)
+def get_movie_by_title(movie: schema.MovieResponse = Depends(cached_movie_by_title)):
+    logger.info('Movie %s fetched', movie.title)
     return movie
 
+@app.get("/movies/{movie_id:int}", response_model=schema.MovieResponse)
+def get_movie_by_id(movie: schema.MovieResponse = Depends(cached_movie_by_id)):
+    logger.info('Movie %s fetched', movie.movie_id)
+    return movie
 
 
 
 
 
-# Movie Update Endpoint
 
-@app.put("/update_movie/{movie_title}", response_model=schema.MovieResponse)
-async def update_movie_by_title(movie_title: str, updated_movie: schema.MovieUpdate, db: Session = Depends(get_db), updated_by: schema.User = Depends(get_current_user)):
-    get_movie = crud.get_movie_by_title(db, title=movie_title)
-    if not get_movie:
-        logger.warning(f"Movie {movie_title} not found")
+# Video streaming Endpoint (public)
+
+@app.api_route("/movie/{movie_id:int}/video", methods=["GET", "HEAD"])
+async def stream_movie_video(request: Request, movie: model.Movies = Depends(movie_by_id)):
+    if not movie.video_key:
+        logger.warning("No video found for movie %s", movie.movie_id)
+        raise HTTPException(status_code=404, detail="Video not found")
+    return streaming.blob_response(request, movie.video_key, movie.video_size, movie.video_checksum, movie.updated_at, "video/mp4")
+
+# Resumable media upload Endpoints
+
+def get_owned_upload(upload_id: str, db: Session, current_user: schema.User):
+    upload = crud.get_upload_session(db, upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if upload.user_id != current_user.user_id:
+        raise HTTPException(status_code=401, detail="Unauthorized user")
+    return upload
+
+@app.post("/uploads/", response_model=schema.UploadSessionResponse)
+def start_upload(upload: schema.UploadSessionCreate, db: Session = Depends(get_db), current_user: schema.User = Depends(get_current_user)):
+    movie = crud.get_movie_by_id(db, upload.movie_id)
+    if not movie:
         raise HTTPException(status_code=404, detail="Movie not found")
-    if updated_by.user_id != get_movie.user_id:
+    if movie.user_id != current_user.user_id:
         raise HTTPException(status_code=401, detail="Unauthorized user")
-    updated_movie = crud.update_movie(db, title=movie_title, updateMovie=updated_movie)
-    logger.info(f"{updated_by.user_id} Updated movie '{movie_title}' successfully")
+    new_upload = crud.create_upload_session(db, movie_id=movie.movie_id, kind=upload.kind, user_id=current_user.user_id)
+    logger.info("%s started %s upload %s", current_user.username, upload.kind, new_upload.upload_id)
+    return new_upload
+
+@app.get("/uploads/{upload_id}", response_model=schema.UploadSessionResponse)
+def get_upload(upload_id: str, db: Session = Depends(get_db), current_user: schema.User = Depends(get_current_user)):
+    upload = get_owned_upload(upload_id, db, current_user)
+    return schema.UploadSessionResponse(upload_id=upload.upload_id, movie_id=upload.movie_id, kind=upload.kind, parts=uploads.list_parts(upload_id))
+
+@app.put("/uploads/{upload_id}/parts/{part_number}", response_model=schema.UploadPart)
+async def upload_part(upload_id: str, part_number: int, request: Request, db: Session = Depends(get_db), current_user: schema.User = Depends(get_current_user)):
+    upload = await run_in_threadpool(get_owned_upload, upload_id, db, current_user)
+    if part_number < 1:
+        raise HTTPException(status_code=400, detail="Part numbers start at 1")
+    part = await uploads.write_part(upload_id, upload.kind, part_number, request.stream())
+    return part
+
+@app.post("/uploads/{upload_id}/complete", response_model=schema.MovieResponse)
+async def complete_upload(upload_id: str, db: Session = Depends(get_db), current_user: schema.User = Depends(get_current_user)):
+    upload = await run_in_threadpool(get_owned_upload, upload_id, db, current_user)
+    writer = await uploads.complete_upload(upload_id, upload.kind)
+    movie = await run_in_threadpool(crud.set_movie_media, db, upload.movie, upload.kind, writer)
+    await run_in_threadpool(crud.delete_upload_session, db, upload)
+    uploads.discard_upload(upload_id)
+    logger.info("%s completed %s upload for movie %s", current_user.username, upload.kind, movie.movie_id)
+    return movie
+
+# Movie Update Endpoint
+
+def update_owned_movie(movie: model.Movies, updated_movie: schema.MovieUpdate, db: Session, updated_by: schema.User):
+    if updated_by.user_id != movie.user_id:
+        raise HTTPException(status_code=401, detail="Unauthorized user")
+    old_title = movie.title
+    updated_movie = crud.update_movie(db, movie=movie, updateMovie=updated_movie)
+    logger.info("%s Updated movie '%s' successfully", updated_by.user_id, old_title)
     return updated_movie
 
+@app.put("/update_movie/{movie_title}", response_model=schema.MovieResponse)
+def update_movie_by_title(updated_movie: schema.MovieUpdate, movie: model.Movies = Depends(movie_by_title), db: Session = Depends(get_db), updated_by: schema.User = Depends(get_current_user)):
+    return update_owned_movie(movie, updated_movie, db, updated_by)
+
+@app.put("/movies/{movie_id:int}", response_model=schema.MovieResponse)
+def update_movie_by_id(updated_movie: schema.MovieUpdate, movie: model.Movies = Depends(movie_by_id), db: Session = Depends(get_db), updated_by: schema.User = Depends(get_current_user)):
+    return update_owned_movie(movie, updated_movie, db, updated_by)
+
 # Movie Delete Endpoint
 
-@app.delete("/delete_movie/{movie_title}")
-async def delete_movie_by_title(movie_title: str, db: Session = Depends(get_db), deleted_by: schema.User = Depends(get_current_user)):
-    get_movie = crud.get_movie_by_title(db, title=movie_title)
-    if not get_movie:
-        raise HTTPException(status_code=404, detail="Movie not found")
-    if deleted_by.user_id != get_movie.user_id:
+def delete_owned_movie(movie: model.Movies, db: Session, deleted_by: schema.User):
+    if deleted_by.user_id != movie.user_id:
         raise HTTPException(status_code=401, detail="Unauthorized To delete this movie")
-    deleted_movie = crud.delete_movie(db, title=movie_title, user_id=deleted_by.user_id)
-    logger.info(f"{deleted_by.user_id} deleted movie '{movie_title}' successfully")
-    return {"detail": f"Movie '{movie_title}' deleted successfully"}
+    title = movie.title
+    crud.delete_movie(db, movie=movie)
+    logger.info("%s deleted movie '%s' successfully", deleted_by.user_id, title)
+    return {"detail": f"Movie '{title}' deleted successfully"}
+
+@app.delete("/delete_movie/{movie_title}")
+def delete_movie_by_title(movie: model.Movies = Depends(movie_by_title), db: Session = Depends(get_db), deleted_by: schema.User = Depends(get_current_user)):
+    return delete_owned_movie(movie, db, deleted_by)
+
+@app.delete("/movies/{movie_id:int}")
+def delete_movie_by_id(movie: model.Movies = Depends(movie_by_id), db: Session = Depends(get_db), deleted_by: schema.User = Depends(get_current_user)):
+    return delete_owned_movie(movie, db, deleted_by)
 
 
 # Rate a movie (authenticated access)
 @app.post('/rating/')
 
-async def rate_movie(rating: schema.RatingCreate, db: Session = Depends(get_db), current_user: model.User = Depends(get_current_user)):
-    movie_rated = db.query(model.Movies).filter(model.Movies.title == rating.movie_title).first()
+def rate_movie(rating: schema.RatingCreate, update_existing: bool = False, db: Session = Depends(get_db), current_user: schema.User = Depends(get_token_user)):
+    movie_rated = crud.get_movie_by_title(db, title=rating.movie_title)
     if not movie_rated:
         raise HTTPException(status_code=404, detail="Movie not found")
-    new_rating = crud.rate_movie(db, movie_id= movie_rated.movie_id, rating=rating.rating, user_id=current_user.user_id)
-    logger.info(f"{current_user.username} rated movie '{rating.movie_title}' with {rating.rating}")
+    new_rating = crud.rate_movie(db, movie_id= movie_rated.movie_id, rating=rating.rating, user_id=current_user.user_id, update_existing=update_existing)
+    logger.info("%s rated movie '%s' with %s", current_user.username, rating.movie_title, rating.rating)
+    return new_rating
+
+@app.post('/movies/{movie_id:int}/ratings')
+def rate_movie_by_id(rating: schema.MovieRating, update_existing: bool = False, movie: model.Movies = Depends(movie_by_id), db: Session = Depends(get_db), current_user: schema.User = Depends(get_token_user)):
+    new_rating = crud.rate_movie(db, movie_id=movie.movie_id, rating=rating.rating, user_id=current_user.user_id, update_existing=update_existing)
+    logger.info("%s rated movie %s with %s", current_user.username, movie.movie_id, rating.rating)
     return new_rating
 
+# Rate many movies at once. Send a JSON list, or stream NDJSON
+# (Content-Type: application/x-ndjson) one rating per line for large imports.
+
+@app.post('/ratings/bulk', response_model=schema.BulkRatingResponse)
+async def bulk_rate_movies(request: Request, update_existing: bool = False, db: Session = Depends(get_db), current_user: schema.User = Depends(get_token_user)):
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        records = ingest.iter_ndjson(request.stream())
+    else:
+        try:
+            records = ingest.iter_json_list(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON list or NDJSON")
+    summary = await ingest.ingest_ratings(db, records, user_id=current_user.user_id, update_existing=update_existing)
+    logger.info("%s bulk rated %s new and %s updated movies", current_user.username, summary['created'], summary['updated'])
+    return summary
+
 # Get all ratings for a movie
 
-@app.get('/ratings/{movie_title}', response_model=schema.RatingResponse)
-async def get_movie_ratings(movie_title: str, db: Session = Depends(get_db)):
-    movie_rated = db.query(model.Movies).filter(model.Movies.title == movie_title).first()
-    if movie_rated is None:
-        logger.warning(f"Movie {movie_title} not found")
-        raise HTTPException(status_code=404, detail="Movie not found")
-    movie_ratings = crud.get_ratings_for_movie(db, movie_id = movie_rated.movie_id)
+def movie_ratings(movie: schema.MovieResponse, db: Session, use_cache: bool):
+    movie_ratings = crud.cached_ratings_for_movie(db, movie = movie, use_cache = use_cache)
     if not movie_ratings:
-        logger.warning(f"No ratings found for movie '{movie_title}'")
+        logger.warning("No ratings found for movie '%s'", movie.title)
         raise HTTPException(status_code=404, detail="No ratings found for this movie")
-    logger.info(f"All ratings for movie '{movie_title}' fetched successfully")
+    logger.info("All ratings for movie '%s' fetched successfully", movie.title)
     return movie_ratings
 
+@app.get('/ratings/{movie_title}', response_model=schema.RatingResponse)
+def get_movie_ratings(movie: schema.MovieResponse = Depends(cached_movie_by_title), db: Session = Depends(get_read_db), use_cache: bool = Depends(cache_enabled)):
+    return movie_ratings(movie, db, use_cache)
+
+@app.get('/movies/{movie_id:int}/ratings', response_model=schema.RatingResponse)
+def get_movie_ratings_by_id(movie: schema.MovieResponse = Depends(cached_movie_by_id), db: Session = Depends(get_read_db), use_cache: bool = Depends(cache_enabled)):
+    return movie_ratings(movie, db, use_cache)
+
 # Comment on a movie (authenticated access)
 
+def comment_on(movie: model.Movies, comment: schema.PostComment, db: Session, current_user: schema.User):
+    new_comment = crud.create_comment(db, comment = comment, movie=movie, user=current_user)
+    logger.info("%s commented on movie '%s'", current_user.user_id, movie.title)
+    return new_comment
+
 @app.post('/comment/{movie_title}', response_model = schema.ParentCommentResponse)
-async def comment_on_movie(movie_title: str, comment: schema.PostComment, db: Session = Depends(get_db), current_user: model.User = Depends(get_current_user)):
-    movie_commented = db.query(model.Movies).filter(model.Movies.title == movie_title).first()
-    if not movie_commented:
-        logger.warning("Movie %s not found in database")
-        raise HTTPException(status_code=404, detail="Movie not found")
+def comment_on_movie(comment: schema.PostComment, movie: model.Movies = Depends(movie_by_title), db: Session = Depends(get_db), current_user: schema.User = Depends(get_token_user)):
+    return comment_on(movie, comment, db, current_user)
 
-    new_comment = crud.create_comment(db, comment = comment, movie_id=movie_commented.movie_id, user_id=current_user.user_id)
-    logger.info(f"{current_user.user_id} commented on movie '{movie_title}'")
-    return new_comment
+@app.post('/movies/{movie_id:int}/comments', response_model = schema.ParentCommentResponse)
+def comment_on_movie_by_id(comment: schema.PostComment, movie: model.Movies = Depends(movie_by_id), db: Session = Depends(get_db), current_user: schema.User = Depends(get_token_user)):
+    return comment_on(movie, comment, db, current_user)
 
 # Get all comments for a movie
-@app.get("/comments/{movie_title}")
 
-async def get_movie_comments(movie_title: str, db: Session = Depends(get_db)):
-    movie_commented = db.query(model.Movies).filter(model.Movies.title == movie_title).first()
-    if not movie_commented:
-        logger.warning("Movie %s not found in database")
-        raise HTTPException(status_code=404, detail="Movie not found")
-    movie_comments = crud.get_comments_for_movie(db, movie_id=movie_commented.movie_id)
+def movie_comments(movie: schema.MovieResponse, db: Session, use_cache: bool):
+    movie_comments = crud.cached_comments_for_movie(db, movie_id=movie.movie_id, use_cache=use_cache)
     if not movie_comments:
-        logger.warning("No comments found for movie %s")
+        logger.warning("No comments found for movie %s", movie.title)
         raise HTTPException(status_code=404, detail="No comments found for this movie")
-    logger.info(f"comment for {movie_title} checked")
+    logger.info("comment for %s checked", movie.title)
     return movie_comments
 
+@app.get("/comments/{movie_title}")
+
+def get_movie_comments(movie: schema.MovieResponse = Depends(cached_movie_by_title), db: Session = Depends(get_read_db), use_cache: bool = Depends(cache_enabled)):
+    return movie_comments(movie, db, use_cache)
+
+@app.get("/movies/{movie_id:int}/comments")
+def get_movie_comments_by_id(movie: schema.MovieResponse = Depends(cached_movie_by_id), db: Session = Depends(get_read_db), use_cache: bool = Depends(cache_enabled)):
+    return movie_comments(movie, db, use_cache)
+
+async def comment_threads(movie: schema.MovieResponse, db: AsyncSession, cursor: Optional[str], limit: int, replies: int):
+    page = await async_crud.get_comment_threads(db, movie.movie_id, cursor=cursor, limit=limit, replies=replies)
+    logger.info("Comment threads for %s fetched", movie.title)
+    return page
+
+@app.get("/threads/{movie_title}", response_model=schema.CommentThreadPage)
+async def get_comment_threads(
+    movie_title: str,
+    cursor: Optional[str] = None,
+    limit: int = 10,
+    replies: int = 3,
+    db: AsyncSession = Depends(get_async_read_db),
+    ):
+    movie = await async_crud.get_movie_by_title(db, movie_title)
+    if not movie:
+        raise HTTPException(status_code=404, detail="Movie not found")
+    return await comment_threads(movie, db, cursor, limit, replies)
+
+@app.get("/movies/{movie_id:int}/threads", response_model=schema.CommentThreadPage)
+async def get_comment_threads_by_id(
+    movie_id: int,
+    cursor: Optional[str] = None,
+    limit: int = 10,
+    replies: int = 3,
+    db: AsyncSession = Depends(get_async_read_db),
+    ):
+    movie = await async_crud.get_movie_by_id(db, movie_id)
+    if not movie:
+        raise HTTPException(status_code=404, detail="Movie not found")
+    return await comment_threads(movie, db, cursor, limit, replies)
+
 # Reply to a comment on a movie
 
 @app.post("/reply/",  #response_model=schema.ChildCommentResponse
 )
-async def reply_to_comment(parent_comment_id: int, reply: schema.PostReply, db: Session = Depends(get_db), current_user: model.User = Depends(get_current_user)):
-    parent_comment = db.query(model.ParentComment).filter(model.ParentComment.parent_comment_id == parent_comment_id).first()
-    if not parent_comment:
-        return None
-    new_reply = crud.reply_to_comment(db, comment_id=parent_comment_id, reply=reply,user_id=current_user.user_id)
-    logger.info(f"{current_user.user_id} replied to comment {parent_comment_id}") 
+def reply_to_comment(parent_comment_id: int, reply: schema.PostReply, db: Session = Depends(get_db), current_user: schema.User = Depends(get_token_user)):
+    new_reply = crud.reply_to_comment(db, comment_id=parent_comment_id, reply=reply, user=current_user)
+    logger.info("%s replied to comment %s", current_user.user_id, parent_comment_id) 
     return new_reply
 
 @app.get("/replies/{parent_comment_id}")
-async def get_replies(parent_comment_id: int, db: Session = Depends(get_db)):
-    replies = crud.get_reply(db, parent_comment_id)
+async def get_replies(parent_comment_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    replies = await async_crud.get_reply(db, parent_comment_id)
     if not replies:
         raise HTTPException(status_code=404, detail="No replies found for the given comment")
-    logger.info(f"Replies for comment {parent_comment_id} fetched")
+    logger.info("Replies for comment %s fetched", parent_comment_id)
     return replies
\ No newline at end of file
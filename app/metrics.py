@@ -0,0 +1,198 @@
+import time
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+# Request metrics kept in process and exposed in the Prometheus text format.
+# Each worker process reports its own numbers; Prometheus adds them up.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name + _labels(self.label_names, labels), value) for labels, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts, plus one slot for +Inf, then the sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        lines = []
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], values):
+                cumulative += count
+                lines.append((self.name + "_bucket" + _labels((*self.label_names, "le"), (*labels, bound)), cumulative))
+            lines.append((self.name + "_sum" + _labels(self.label_names, labels), values[-1]))
+            lines.append((self.name + "_count" + _labels(self.label_names, labels), cumulative))
+        return lines
+
+
+requests_total = Counter("http_requests_total", "Requests handled, by route and status.", ("method", "route", "status"))
+request_seconds = Histogram("http_request_duration_seconds", "Time to the end of the response body.", ("method", "route"))
+requests_in_flight = Gauge("http_requests_in_flight", "Requests currently being handled.")
+request_queries = Histogram("http_request_db_queries", "SQL statements run per request.", ("method", "route"), QUERY_COUNT_BUCKETS)
+request_db_seconds = Histogram("http_request_db_seconds", "Time spent waiting on SQL per request.", ("method", "route"))
+
+REQUEST_METRICS = [requests_total, request_seconds, requests_in_flight, request_queries, request_db_seconds]
+
+
+def render(extra=()):
+    """Prometheus text exposition of the request metrics followed by extra,
+    an iterable of (name, kind, help, [(labels dict, value)])."""
+    lines = []
+    for metric in REQUEST_METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{sample} {value}" for sample, value in metric.samples())
+    for name, kind, help, samples in extra:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# DB time attribution: the middleware puts a RequestStats in a context
+# variable, and cursor events on every engine add to whichever one is
+# current. Worker threads and SQLAlchemy's async greenlets inherit the
+# variable, so sync and async routes are both counted.
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+request_stats = ContextVar("request_stats", default=None)
+
+
+def track_queries(engine):
+    """Attach the timing hooks to a sync Engine (or an AsyncEngine's sync_engine)."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def finished(conn, cursor, statement, parameters, context, executemany):
+        _record(conn)
+
+    @event.listens_for(engine, "handle_error")
+    def failed(context):
+        if context.connection is not None:
+            _record(context.connection)
+
+
+def _record(conn):
+    starts = conn.info.get("query_started")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    # Plans captured by slowlog.explain are not the request's own queries
+    if conn.info.get("explaining"):
+        return
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+
+class MetricsMiddleware:
+    """Times each request, counts its SQL, and adds a Server-Timing header
+    (total and DB time) that browser dev tools show per request. Routes are
+    labelled by their path template so ids do not explode the series count."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+        requests_in_flight.inc()
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timing = (
+                    f"app;dur={(time.perf_counter() - started) * 1000:.2f}, "
+                    f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.queries} queries"'
+                )
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", timing.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            requests_in_flight.dec()
+            request_stats.reset(token)
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else "unmatched")
+            requests_total.inc(*labels, str(status))
+            request_seconds.observe(time.perf_counter() - started, *labels)
+            request_queries.observe(stats.queries, *labels)
+            request_db_seconds.observe(stats.db_seconds, *labels)
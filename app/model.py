@@ -1,9 +1,17 @@
-from sqlalchemy import Column, Boolean, String,LargeBinary, Integer, ForeignKey, TIMESTAMP, Date, Text, CheckConstraint, func
+from sqlalchemy import Column, Boolean, String,LargeBinary, Integer, BigInteger, Float, ForeignKey, TIMESTAMP, Date, Text, CheckConstraint, Index, UniqueConstraint, func
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects import sqlite
 
 
 from database import Base
 
+# SQLite fills server_default=func.now() as 'YYYY-MM-DD HH:MM:SS'; bind cursor
+# values in the same shape so keyset comparisons line up with stored rows.
+KeysetTimestamp = TIMESTAMP().with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite",
+)
+
 class User(Base):
     __tablename__ = 'users'
     
@@ -13,6 +21,8 @@ class User(Base):
     hashed_password = Column(String(255), nullable=False)
     email = Column(String(255), unique=True, nullable=False)
     created_at = Column(TIMESTAMP, server_default=func.now())
+    # Bumped on password change; tokens carrying an older version are rejected
+    token_version = Column(Integer, nullable=False, server_default='0', default=0)
 
     movies = relationship('Movies', back_populates='posted_by')
     ratings = relationship('Rating', back_populates='user')
@@ -25,22 +35,38 @@ class Movies(Base):
 
     movie_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     title = Column(String(255), nullable=False)
+    slug = Column(String(255), nullable=False, unique=True, index=True)
     genre = Column(String(255), nullable=False)
     description = Column(Text, nullable=False)
-    # addition
-    video_data = Column(LargeBinary)
-    coverimage_data = Column(LargeBinary)
+    # Media lives in the blob store (see storage.py); rows only keep a reference
+    video_key = Column(String(255), index=True)
+    video_size = Column(BigInteger)
+    video_checksum = Column(String(64))
+    coverimage_key = Column(String(255), index=True)
+    coverimage_size = Column(BigInteger)
+    coverimage_checksum = Column(String(64))
     release_date = Column(String, nullable=False)
+    release_year = Column(Integer)
 
-    user_id = Column(Integer, ForeignKey('users.user_id'))
-    created_at = Column(TIMESTAMP, server_default=func.now())
+    user_id = Column(Integer, ForeignKey('users.user_id'), index=True)
+    created_at = Column(KeysetTimestamp, server_default=func.now())
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
 
     posted_by = relationship('User', back_populates='movies')
     ratings = relationship('Rating', back_populates='movie')
     parent_comments = relationship('ParentComment', back_populates='movie')
-    
-    
+
+    # Fetch updated_at from UPDATE ... RETURNING instead of on next access
+    __mapper_args__ = {"eager_defaults": True}
+
+    # Keyset pagination walks (created_at, movie_id), optionally inside a
+    # filter; genre filters walk the same keys on movie_genres instead
+    __table_args__ = (
+        Index('ix_movies_created_at_movie_id', 'created_at', 'movie_id'),
+        Index('ix_movies_release_year_created_at_movie_id', 'release_year', 'created_at', 'movie_id'),
+    )
+
+
 class Rating(Base):
     __tablename__ = "ratings"
     
@@ -48,11 +74,79 @@ class Rating(Base):
     user_id = Column(Integer, ForeignKey('users.user_id'), nullable=False)
     movie_id = Column(Integer, ForeignKey('movies.movie_id'), nullable=False)
     rating = Column(Integer, CheckConstraint('rating >= 1 AND rating <= 5'), nullable=False)
+    # Value replaced by the last upsert; lets rate_movie adjust the totals
+    # without reading the row first
+    previous_rating = Column(Integer)
     created_at = Column(TIMESTAMP, server_default=func.now())
 
     user = relationship('User', back_populates='ratings')
     movie = relationship('Movies', back_populates='ratings')
 
+    __table_args__ = (
+        UniqueConstraint('user_id', 'movie_id', name='uq_ratings_user_id_movie_id'),
+        Index('ix_ratings_movie_id_user_id', 'movie_id', 'user_id'),
+    )
+
+# Running totals per movie, kept in step with ratings by crud.rate_movie so
+# reads never have to aggregate the ratings table
+class MovieRatingStats(Base):
+    __tablename__ = "movie_rating_stats"
+
+    movie_id = Column(Integer, ForeignKey('movies.movie_id', ondelete='CASCADE'), primary_key=True)
+    rating_count = Column(Integer, nullable=False, default=0, server_default='0')
+    rating_sum = Column(Integer, nullable=False, default=0, server_default='0')
+    stars_1 = Column(Integer, nullable=False, default=0, server_default='0')
+    stars_2 = Column(Integer, nullable=False, default=0, server_default='0')
+    stars_3 = Column(Integer, nullable=False, default=0, server_default='0')
+    stars_4 = Column(Integer, nullable=False, default=0, server_default='0')
+    stars_5 = Column(Integer, nullable=False, default=0, server_default='0')
+
+# Materialized rankings, updated on write and by leaderboard.py's refresher.
+# Each list is read top-down through its own index.
+class MovieLeaderboard(Base):
+    __tablename__ = "movie_leaderboard"
+
+    movie_id = Column(Integer, ForeignKey('movies.movie_id', ondelete='CASCADE'), primary_key=True)
+    # Bayesian average rating; NULL until the movie has a rating
+    top_score = Column(Float)
+    # ln of the decayed activity scaled up by its growth since leaderboard.EPOCH;
+    # NULL until the movie sees some activity
+    trending_score = Column(Float)
+
+    __table_args__ = (
+        Index('ix_movie_leaderboard_top_score', 'top_score'),
+        Index('ix_movie_leaderboard_trending_score', 'trending_score'),
+    )
+
+class Genre(Base):
+    __tablename__ = "genres"
+
+    genre_id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(100), nullable=False)
+    # "Sci-Fi" and "sci fi" are the same genre
+    slug = Column(String(100), nullable=False, unique=True)
+
+class MovieGenre(Base):
+    __tablename__ = "movie_genres"
+
+    movie_id = Column(Integer, ForeignKey('movies.movie_id', ondelete='CASCADE'), primary_key=True)
+    genre_id = Column(Integer, ForeignKey('genres.genre_id', ondelete='CASCADE'), primary_key=True)
+    # Copy of the movie's created_at, which never changes once it is set
+    created_at = Column(KeysetTimestamp)
+
+    # Browsing a genre walks its movies in movie_id order; /movies/?genre=
+    # walks them in listing order
+    __table_args__ = (
+        Index('ix_movie_genres_genre_id_movie_id', 'genre_id', 'movie_id'),
+        Index('ix_movie_genres_genre_id_created_at_movie_id', 'genre_id', 'created_at', 'movie_id'),
+    )
+
+class GenreCount(Base):
+    __tablename__ = "genre_counts"
+
+    genre_id = Column(Integer, ForeignKey('genres.genre_id', ondelete='CASCADE'), primary_key=True)
+    movie_count = Column(Integer, nullable=False, default=0, server_default='0')
+
 class ParentComment(Base):
     __tablename__ = "parent_comments"
     
@@ -60,12 +154,17 @@ class ParentComment(Base):
     user_id = Column(Integer, ForeignKey('users.user_id'), nullable=False)
     movie_id = Column(Integer, ForeignKey('movies.movie_id'), nullable=False)
     content = Column(Text, nullable=False)
-    created_at = Column(TIMESTAMP, server_default=func.now())
+    created_at = Column(KeysetTimestamp, server_default=func.now())
 
     user = relationship('User', back_populates='parent_comments')
     movie = relationship('Movies', back_populates='parent_comments')
     comment_replies = relationship('CommentReply', back_populates='parent_comment')
 
+    __table_args__ = (
+        Index('ix_parent_comments_movie_id_created_at', 'movie_id', 'created_at'),
+        Index('ix_parent_comments_user_id', 'user_id'),
+    )
+
 class CommentReply(Base):
     __tablename__ = "comment_replies"
     
@@ -76,4 +175,20 @@ class CommentReply(Base):
     created_at = Column(TIMESTAMP, server_default=func.now())
 
     user = relationship('User', back_populates='comment_replies')
-    parent_comment = relationship('ParentComment', back_populates='comment_replies')
\ No newline at end of file
+    parent_comment = relationship('ParentComment', back_populates='comment_replies')
+
+    __table_args__ = (
+        Index('ix_comment_replies_parent_comment_id_created_at', 'parent_comment_id', 'created_at'),
+        Index('ix_comment_replies_user_id', 'user_id'),
+    )
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    upload_id = Column(String(36), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.user_id'), nullable=False)
+    movie_id = Column(Integer, ForeignKey('movies.movie_id', ondelete='CASCADE'), nullable=False, index=True)
+    kind = Column(String(20), nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+    movie = relationship('Movies')
\ No newline at end of file
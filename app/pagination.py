@@ -0,0 +1,32 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+
+MAX_PAGE_SIZE = 100
+
+
+def clamp_limit(limit: int):
+    # Never let a client ask for more than one page worth of rows
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def encode_cursor(*values):
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(payload, list) or len(payload) != len(types):
+            raise ValueError(cursor)
+        return tuple(
+            datetime.fromisoformat(value) if kind is datetime else kind(value)
+            for kind, value in zip(types, payload)
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -0,0 +1,74 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class RateLimiter:
+    """Token bucket per key: `limit` attempts, refilled evenly over `period`
+    seconds. Only the most recently used max_keys buckets are kept."""
+
+    def __init__(self, limit: int, period: float, max_keys: int = 100000):
+        self.limit = limit
+        self.period = period
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, now):
+        tokens, updated_at = self._buckets.get(key, (self.limit, now))
+        return min(self.limit, tokens + (now - updated_at) * self.limit / self.period)
+
+    def _wait(self, tokens):
+        return 0 if tokens >= 1 else math.ceil((1 - tokens) * self.period / self.limit)
+
+    def _take(self, key, tokens, now):
+        self._buckets[key] = (max(tokens - 1, 0), now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def retry_after(self, key):
+        """Seconds until key may try again, 0 if it may try now."""
+        with self._lock:
+            return self._wait(self._tokens(key, time.monotonic()))
+
+    def consume(self, key):
+        with self._lock:
+            now = time.monotonic()
+            self._take(key, self._tokens(key, now), now)
+
+    def hit(self, key):
+        """Take an attempt for key; return 0 if allowed, else seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            tokens = self._tokens(key, now)
+            wait = self._wait(tokens)
+            if not wait:
+                self._take(key, tokens, now)
+            return wait
+
+    def reset(self, key=None):
+        with self._lock:
+            if key is None:
+                self._buckets.clear()
+            else:
+                self._buckets.pop(key, None)
+
+
+# Every login attempt from an address costs a token; failed attempts also
+# cost one against the username, so guessing one account's password from
+# many addresses is slowed down too.
+login_attempts = RateLimiter(
+    limit=int(os.environ.get("LOGIN_RATE_LIMIT", 60)),
+    period=float(os.environ.get("LOGIN_RATE_PERIOD_SECONDS", 60)),
+)
+login_failures = RateLimiter(
+    limit=int(os.environ.get("LOGIN_FAILURE_LIMIT", 5)),
+    period=float(os.environ.get("LOGIN_FAILURE_PERIOD_SECONDS", 300)),
+)
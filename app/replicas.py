@@ -0,0 +1,198 @@
+import os
+import time
+import itertools
+
+from dotenv import load_dotenv
+from fastapi import Request
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+from database import SessionLocal, AsyncSessionLocal, async_url
+from dbpool import PoolStats, engine_options
+from metrics import track_queries
+from slowlog import DB_PROFILE, profile_queries
+from my_logging.logger import get_logger
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", 5))
+REPLICA_CHECK_INTERVAL = float(os.environ.get("REPLICA_CHECK_INTERVAL_SECONDS", 5))
+# After a write the client reads from the primary for this long, so it sees
+# its own change even if the replicas have not replayed it yet
+STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", 10))
+STICKY_COOKIE = "read_primary"
+
+# Replay lag per dialect. A Postgres standby that has replayed everything it
+# received is current even if the primary has been idle for a while.
+LAG_QUERIES = {
+    "postgresql": """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    """,
+}
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.pool_stats = PoolStats()
+        self.async_pool_stats = PoolStats()
+        self.engine = create_engine(url, **engine_options(url, QueuePool, self.pool_stats))
+        async_database_url = async_url(url)
+        self.async_engine = create_async_engine(
+            async_database_url, **engine_options(async_database_url, AsyncAdaptedQueuePool, self.async_pool_stats)
+        )
+        self.Session = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=self.engine)
+        self.AsyncSession = async_sessionmaker(self.async_engine, autoflush=False, expire_on_commit=False)
+        track_queries(self.engine)
+        track_queries(self.async_engine.sync_engine)
+        if DB_PROFILE:
+            profile_queries(self.engine)
+            profile_queries(self.async_engine.sync_engine)
+        self.lag_query = text(LAG_QUERIES.get(self.engine.dialect.name, "SELECT 0"))
+        self.healthy = True
+        self.lag = 0.0
+        self.error = None
+        self.checked_at = float("-inf")
+
+    @property
+    def usable(self):
+        return self.healthy and self.lag <= REPLICA_MAX_LAG_SECONDS
+
+    def _due(self):
+        # Claim the check before running it so concurrent requests do not all probe
+        now = time.monotonic()
+        if now - self.checked_at < REPLICA_CHECK_INTERVAL:
+            return False
+        self.checked_at = now
+        return True
+
+    def _record(self, lag=None, error=None):
+        was_usable = self.usable
+        self.healthy = error is None
+        self.error = None if error is None else type(error).__name__
+        if lag is not None:
+            self.lag = float(lag)
+        if was_usable and not self.usable:
+            logger.warning("Replica %s taken out of rotation (error=%s, lag=%.1fs)", self.name, self.error, self.lag)
+        elif self.usable and not was_usable:
+            logger.info("Replica %s back in rotation", self.name)
+
+    def check(self):
+        if not self._due():
+            return
+        try:
+            with self.engine.connect() as connection:
+                self._record(lag=connection.execute(self.lag_query).scalar() or 0)
+        except Exception as error:
+            self._record(error=error)
+
+    async def async_check(self):
+        if not self._due():
+            return
+        try:
+            async with self.async_engine.connect() as connection:
+                self._record(lag=(await connection.execute(self.lag_query)).scalar() or 0)
+        except Exception as error:
+            self._record(error=error)
+
+    def report(self):
+        return {
+            "replica": self.name,
+            "usable": self.usable,
+            "lag_seconds": round(self.lag, 3),
+            "error": self.error,
+            "pools": {
+                "sync": self.pool_stats.snapshot(self.engine.pool),
+                "async": self.async_pool_stats.snapshot(self.async_engine.sync_engine.pool),
+            },
+        }
+
+
+class ReplicaSet:
+    """Round-robins reads over the replicas that are up and caught up; with
+    none usable, reads go to the primary."""
+
+    def __init__(self, urls):
+        self.replicas = [Replica(url) for url in urls]
+        self._turn = itertools.count()
+
+    def _rotation(self):
+        start = next(self._turn)
+        return [self.replicas[(start + step) % len(self.replicas)] for step in range(len(self.replicas))]
+
+    def pick(self):
+        for replica in self._rotation():
+            replica.check()
+            if replica.usable:
+                return replica
+        return None
+
+    async def async_pick(self):
+        for replica in self._rotation():
+            await replica.async_check()
+            if replica.usable:
+                return replica
+        return None
+
+    def report(self):
+        return [replica.report() for replica in self.replicas]
+
+
+replica_set = ReplicaSet([url.strip() for url in os.environ.get("DB_REPLICA_URLS", "").split(",") if url.strip()])
+
+
+def wrote_recently(request: Request):
+    return STICKY_COOKIE in request.cookies
+
+
+def reads_from_primary(request: Request):
+    return not replica_set.replicas or wrote_recently(request)
+
+
+# Session dependencies for read-only routes. A session on a replica is tagged
+# in its info so crud can cap how long values it loads stay cached.
+
+def get_read_db(request: Request):
+    replica = None if reads_from_primary(request) else replica_set.pick()
+    db = replica.Session() if replica else SessionLocal()
+    if replica:
+        db.info["replica"] = replica.name
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db(request: Request):
+    replica = None if reads_from_primary(request) else await replica_set.async_pick()
+    async with (replica.AsyncSession if replica else AsyncSessionLocal)() as db:
+        yield db
+
+
+class StickyPrimaryMiddleware:
+    """Marks a client that has just written so its reads go to the primary.
+    Plain ASGI rather than BaseHTTPMiddleware, so streamed responses pass
+    through untouched."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS") or not replica_set.replicas:
+            return await self.app(scope, receive, send)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = f"{STICKY_COOKIE}=1; Max-Age={STICKY_SECONDS}; Path=/; HttpOnly; SameSite=lax"
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", cookie.encode())]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, ConfigDict, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
 from datetime import datetime, date
-from typing import Optional
+from typing import Annotated, Dict, List, Literal, Optional
 from decimal import Decimal, ROUND_HALF_UP
 
 class UserBase(BaseModel):
@@ -16,6 +16,18 @@ class User(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
     
+class CurrentUser(User):
+    email: str
+    token_version: int
+
+class Token(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
 class UserCreate(BaseModel):
     full_name: str
     username: str
@@ -63,7 +75,8 @@ class MovieUpload_files(MovieUpload):
     model_config = ConfigDict(from_attributes=True)
 
 class MovieResponse(BaseModel):
-    # movie_id: int
+    movie_id: int
+    slug: str
     title: str
     genre: str
     # coverimage_data: Optional [str] = None
@@ -73,6 +86,55 @@ class MovieResponse(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)
 
+class UploadSessionCreate(BaseModel):
+    movie_id: int
+    kind: Literal["video", "coverimage"]
+
+class UploadPart(BaseModel):
+    part_number: int
+    size: int
+
+class UploadSessionResponse(BaseModel):
+    upload_id: str
+    movie_id: int
+    kind: str
+    parts: List[UploadPart] = []
+
+    model_config = ConfigDict(from_attributes=True)
+
+class MoviePage(BaseModel):
+    movies: List[MovieResponse]
+    next_cursor: Optional[str] = None
+
+class TopRatedEntry(BaseModel):
+    movie: MovieResponse
+    score: float
+    rating_count: int
+    average_rating: float
+
+class TrendingEntry(BaseModel):
+    movie: MovieResponse
+    score: float
+
+class GenreFacet(BaseModel):
+    name: str
+    slug: str
+    movie_count: int
+
+class GenrePage(BaseModel):
+    movies: List[MovieResponse]
+    next_cursor: Optional[str] = None
+    facets: List[GenreFacet]
+
+class MovieSearchHit(BaseModel):
+    movie: MovieResponse
+    score: float
+    snippet: Optional[str] = None
+
+class MovieSearchPage(BaseModel):
+    results: List[MovieSearchHit]
+    next_cursor: Optional[str] = None
+
 class MovieUpdate(BaseModel):
     title: Optional[str] = None
     genre: Optional[str] = None
@@ -80,19 +142,48 @@ class MovieUpdate(BaseModel):
     updated_at: Optional[date] = None
 
 
+# A user's rating of a movie, in whole stars
+Stars = Annotated[int, Field(ge=1, le=5)]
+
 class RatingCreate(BaseModel):
     movie_title: str
-    rating: int
+    rating: Stars
     created_at: date
 
+class MovieRating(BaseModel):
+    rating: Stars
+
+class BulkRatingItem(BaseModel):
+    movie_title: Optional[str] = None
+    movie_id: Optional[int] = None
+    rating: Stars
+
+    @model_validator(mode='after')
+    def check_movie(self):
+        if self.movie_title is None and self.movie_id is None:
+            raise ValueError('Either movie_title or movie_id is required')
+        return self
+
+class BulkRatingResult(BaseModel):
+    index: int
+    status: str
+    movie_id: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkRatingResponse(BaseModel):
+    results: List[BulkRatingResult]
+    created: int
+    updated: int
+    failed: int
+
 class RatingResponse(BaseModel):
     title: str
-    rating: Decimal
+    rating: Annotated[Decimal, Field(ge=0, le=5)]
+    rating_count: int
+    histogram: Dict[int, int]
 
-    @field_validator('rating', mode='before')
-    def check_rating(cls, value):
-        if value < 0 or value > 5:
-            raise ValueError('Rating must be between 0 and 5')
+    @field_validator('rating')
+    def round_rating(cls, value):
         return round(value, 1)
 
 
@@ -120,6 +211,25 @@ class ParentCommentResponse(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)
 
+class ThreadReply(BaseModel):
+    reply_id: int
+    username: str
+    content: str
+    created_at: Optional[datetime] = None
+
+class CommentThread(BaseModel):
+    comment_id: int
+    username: str
+    content: str
+    created_at: Optional[datetime] = None
+    reply_count: int
+    replies: List[ThreadReply]
+
+class CommentThreadPage(BaseModel):
+    comments: List[CommentThread]
+    next_cursor: Optional[str] = None
+    truncated_comment_ids: List[int]
+
 class CommentReplyBase(BaseModel):
     parent_comment_id : int
     user_id: int
@@ -138,4 +248,72 @@ class CommentReplyResponse(BaseModel):
     content: str
     created_at: datetime
 
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+class SlowQuery(BaseModel):
+    sql: str
+    calls: int
+    total_ms: float
+    avg_ms: float
+    max_ms: float
+    callers: Dict[str, int]
+    param_shapes: List[str]
+    plan: Optional[str] = None
+    last_seen: Optional[float] = None
+
+class SlowQueryReport(BaseModel):
+    enabled: bool
+    threshold_ms: float
+    queries: List[SlowQuery]
+
+# Rows read by bulkimport.py. Users and movies are referenced by username and
+# title (or by id), so exports from another instance import as they are.
+
+class ImportUser(BaseModel):
+    full_name: str
+    username: str
+    email: str
+    hashed_password: Optional[str] = None
+    password: Optional[str] = None
+
+    @model_validator(mode='after')
+    def check_password(self):
+        if self.hashed_password is None and self.password is None:
+            raise ValueError('Either hashed_password or password is required')
+        return self
+
+class ImportMovie(BaseModel):
+    title: str
+    genre: str
+    description: str
+    release_date: date
+    username: Optional[str] = None
+    user_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+
+class ImportRating(BulkRatingItem):
+    username: Optional[str] = None
+    user_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+
+    @model_validator(mode='after')
+    def check_user(self):
+        if self.username is None and self.user_id is None:
+            raise ValueError('Either username or user_id is required')
+        return self
+
+class ImportComment(BaseModel):
+    movie_title: Optional[str] = None
+    movie_id: Optional[int] = None
+    username: Optional[str] = None
+    user_id: Optional[int] = None
+    content: str
+    created_at: Optional[datetime] = None
+
+    @model_validator(mode='after')
+    def check_references(self):
+        if self.movie_title is None and self.movie_id is None:
+            raise ValueError('Either movie_title or movie_id is required')
+        if self.username is None and self.user_id is None:
+            raise ValueError('Either username or user_id is required')
+        return self
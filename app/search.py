@@ -0,0 +1,139 @@
+import re
+from html import escape
+
+import sqlalchemy
+from sqlalchemy import DDL, event, func, literal_column, or_, select, text
+from sqlalchemy.orm import Session
+
+import model
+from genres import tagged_with
+from pagination import clamp_limit, encode_cursor, decode_cursor
+
+# Full-text search over title, genre and description.
+#
+# Postgres keeps a weighted tsvector in a generated column with a GIN index,
+# plus a trigram index on title so misspelt titles still match; the database
+# maintains both whenever a movie row changes. SQLite uses an FTS5 table
+# keyed by movie_id that crud updates alongside each write.
+
+# The database marks matches with private-use characters; search_page
+# escapes the user-written description and only then turns the markers into
+# <mark> tags, so a description cannot smuggle markup into the snippet
+SNIPPET_START, SNIPPET_END = "\ue000", "\ue001"
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """ALTER TABLE movies ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(genre, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED""",
+    "CREATE INDEX ix_movies_search_vector ON movies USING gin (search_vector)",
+    "CREATE INDEX ix_movies_title_trgm ON movies USING gin (title gin_trgm_ops)",
+]
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS movies_fts USING fts5(title, genre, description, tokenize='porter unicode61')",
+]
+
+for statement in POSTGRES_DDL:
+    event.listen(model.Movies.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+for statement in SQLITE_DDL:
+    event.listen(model.Movies.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(model.Movies.__table__, "before_drop", DDL("DROP TABLE IF EXISTS movies_fts").execute_if(dialect="sqlite"))
+
+
+# Index maintenance, called by crud inside the same transaction as the write
+
+def index_movie(db: Session, movie: model.Movies, new: bool = False):
+    if db.get_bind().dialect.name != "sqlite":
+        return
+    if not new:
+        db.execute(text("DELETE FROM movies_fts WHERE rowid = :movie_id"), {"movie_id": movie.movie_id})
+    db.execute(
+        text("INSERT INTO movies_fts (rowid, title, genre, description) VALUES (:movie_id, :title, :genre, :description)"),
+        {"movie_id": movie.movie_id, "title": movie.title, "genre": movie.genre, "description": movie.description},
+    )
+
+def remove_movie(db: Session, movie_id: int):
+    if db.get_bind().dialect.name != "sqlite":
+        return
+    db.execute(text("DELETE FROM movies_fts WHERE rowid = :movie_id"), {"movie_id": movie_id})
+
+
+def index_movies_after(db: Session, movie_id: int):
+    """Bulk version of index_movie for every movie with a higher movie_id."""
+    if db.get_bind().dialect.name != "sqlite":
+        return
+    db.execute(text("DELETE FROM movies_fts WHERE rowid > :movie_id"), {"movie_id": movie_id})
+    db.execute(
+        text("INSERT INTO movies_fts (rowid, title, genre, description) "
+             "SELECT movie_id, title, genre, description FROM movies WHERE movie_id > :movie_id"),
+        {"movie_id": movie_id},
+    )
+
+# Queries
+
+def fts5_query(q: str):
+    # Quote every word so user input cannot inject FTS5 syntax; the trailing *
+    # makes the last word a prefix match for search-as-you-type
+    words = re.findall(r"\w+", q.lower())
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+
+def _sqlite_statement(q: str):
+    match = fts5_query(q)
+    if match is None:
+        return None
+    fts = sqlalchemy.table("movies_fts", sqlalchemy.column("rowid"))
+    # bm25 is lower-is-better; weights favour title over genre over description
+    score = (-func.bm25(literal_column("movies_fts"), 10.0, 4.0, 1.0)).label("score")
+    snippet = func.snippet(literal_column("movies_fts"), 2, SNIPPET_START, SNIPPET_END, "…", 16).label("snippet")
+    return (
+        select(model.Movies, score, snippet)
+        .join(fts, fts.c.rowid == model.Movies.movie_id)
+        .where(literal_column("movies_fts").op("MATCH")(match))
+    ), score
+
+def _postgres_statement(q: str):
+    query = func.websearch_to_tsquery("english", q)
+    vector = literal_column("movies.search_vector")
+    score = (func.ts_rank_cd(vector, query) + func.similarity(model.Movies.title, q)).label("score")
+    statement = select(model.Movies, score).where(or_(vector.bool_op("@@")(query), model.Movies.title.bool_op("%")(q)))
+    return statement, score
+
+def search_statement(dialect: str, q: str, genres=None, cursor: str = None, limit: int = 10):
+    """Build the ranked search for one page. Returns (statement, limit,
+    offset), or None when q has nothing searchable in it. Ranking has to
+    score every match anyway, so the cursor carries a plain offset."""
+    limit = clamp_limit(limit)
+    offset = decode_cursor(cursor, int)[0] if cursor else 0
+    built = _postgres_statement(q) if dialect == "postgresql" else _sqlite_statement(q)
+    if built is None:
+        return None
+    statement, score = built
+    if genres:
+        statement = statement.where(tagged_with(genres))
+    statement = statement.order_by(score.desc(), model.Movies.movie_id).offset(offset).limit(limit + 1)
+
+    if dialect == "postgresql":
+        # ts_headline is expensive, so only run it over the page being returned
+        page = statement.subquery()
+        headline = func.ts_headline(
+            "english", page.c.description, func.websearch_to_tsquery("english", q),
+            f"StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, MaxFragments=1, MinWords=8, MaxWords=24",
+        ).label("snippet")
+        movie = sqlalchemy.orm.aliased(model.Movies, page)
+        statement = select(movie, page.c.score, headline).order_by(page.c.score.desc(), page.c.movie_id)
+    return statement, limit, offset
+
+def highlight(snippet):
+    if snippet is None:
+        return None
+    return escape(snippet).replace(SNIPPET_START, "<mark>").replace(SNIPPET_END, "</mark>")
+
+def search_page(rows, limit: int, offset: int):
+    next_cursor = encode_cursor(offset + limit) if len(rows) > limit else None
+    results = [{"movie": movie, "score": round(float(score), 6), "snippet": highlight(snippet)} for movie, score, snippet in rows[:limit]]
+    return {"results": results, "next_cursor": next_cursor}
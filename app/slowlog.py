@@ -0,0 +1,207 @@
+import os
+import re
+import sys
+import time
+import random
+import threading
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+from my_logging.logger import get_logger
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Opt-in slow query profiling. With DB_PROFILE on, every engine times its
+# statements; the ones over SLOW_QUERY_MS are logged with their normalised SQL,
+# parameter shapes and the crud function that issued them, a sample of those
+# get their plan captured, and all of them are folded into a top-N report.
+
+DB_PROFILE = os.environ.get("DB_PROFILE", "").lower() in ("1", "true", "yes", "on")
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get("SLOW_QUERY_EXPLAIN_RATE", 0.1))
+SLOW_QUERY_MAX_ENTRIES = int(os.environ.get("SLOW_QUERY_MAX_ENTRIES", 500))
+
+# Frames from these modules are reported as the caller of a statement
+CALLER_MODULES = {"crud", "async_crud", "search", "genres", "leaderboard", "ingest", "auth", "replicas"}
+
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|\$\d+|:\w+)"
+_PLACEHOLDER_LIST = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})+\s*\)")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.$])-?\d+(?:\.\d+)?\b")
+
+
+def normalize_sql(statement: str):
+    """Collapse a statement to one line with literals replaced and expanded
+    IN lists folded, so the same query with different values groups together."""
+    sql = _STRING.sub("?", statement)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("(?, ...)", sql)
+    return " ".join(sql.split())
+
+
+def _type_name(value):
+    return "null" if value is None else type(value).__name__
+
+
+def param_shape(parameters, executemany: bool = False):
+    """Types of the bound parameters, with runs of one type counted, e.g.
+    "(int, str, int x3)"; no values, so nothing sensitive reaches the log."""
+    if executemany:
+        rows = list(parameters or ())
+        return f"{len(rows)} rows of {param_shape(rows[0]) if rows else '()'}"
+    if isinstance(parameters, dict):
+        items = [f"{key}: {_type_name(value)}" for key, value in parameters.items()]
+        return "{" + ", ".join(items[:20]) + (", ..." if len(items) > 20 else "") + "}"
+    runs = []
+    for value in parameters or ():
+        name = _type_name(value)
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return "(" + ", ".join(name if count == 1 else f"{name} x{count}" for name, count in runs) + ")"
+
+
+def _frames():
+    frame = sys._getframe(1)
+    try:
+        from greenlet import getcurrent
+        current = getcurrent()
+    except ImportError:
+        current = None
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+        # Async engines run the driver call in a child greenlet; the
+        # coroutine that awaited it is on the parent greenlet's stack
+        if frame is None and current is not None and current.parent is not None:
+            current = current.parent
+            frame = current.gr_frame
+
+
+def find_caller():
+    for frame in _frames():
+        module = frame.f_globals.get("__name__", "")
+        if module in CALLER_MODULES:
+            return f"{module}.{frame.f_code.co_name}"
+    return None
+
+
+def explain(conn, statement: str, parameters):
+    """The plan for a statement, run on the connection that just executed it.
+    Only read queries are explained, and inside a savepoint that is always
+    rolled back: ANALYZE executes the statement again, and on Postgres a
+    failed EXPLAIN would otherwise abort the caller's transaction."""
+    head = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    if head not in ("SELECT", "WITH") or "FOR UPDATE" in statement.upper():
+        return None
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) "
+    elif dialect == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        return None
+    # Flags the savepoint and EXPLAIN statements so neither the profiler
+    # nor the request query counters in metrics pick them up
+    conn.info["explaining"] = True
+    try:
+        savepoint = conn.begin_nested()
+        try:
+            rows = conn.exec_driver_sql(prefix + statement, parameters or ()).all()
+        finally:
+            savepoint.rollback()
+    except Exception as error:
+        logger.debug("EXPLAIN failed: %r", error)
+        return None
+    finally:
+        conn.info["explaining"] = False
+    if dialect == "sqlite":
+        # (id, parent, notused, detail)
+        return "\n".join(row[-1] for row in rows)
+    return "\n".join(row[0] for row in rows)
+
+
+class SlowQueryLog:
+    """Slow statements grouped by normalised SQL, bounded to max_entries
+    groups; when full, the group with the least total time is dropped."""
+
+    def __init__(self, max_entries: int = SLOW_QUERY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def record(self, sql: str, elapsed_ms: float, caller, shape: str, plan=None):
+        with self._lock:
+            entry = self._entries.get(sql)
+            if entry is None:
+                if len(self._entries) >= self.max_entries:
+                    del self._entries[min(self._entries, key=lambda key: self._entries[key]["total_ms"])]
+                entry = self._entries[sql] = {
+                    "sql": sql, "calls": 0, "total_ms": 0.0, "max_ms": 0.0,
+                    "callers": {}, "param_shapes": [], "plan": None, "last_seen": None,
+                }
+            entry["calls"] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry["callers"][caller or "unknown"] = entry["callers"].get(caller or "unknown", 0) + 1
+            if shape not in entry["param_shapes"] and len(entry["param_shapes"]) < 5:
+                entry["param_shapes"].append(shape)
+            if plan is not None:
+                entry["plan"] = plan
+            entry["last_seen"] = time.time()
+
+    def top(self, limit: int = 20, order: str = "total_ms"):
+        with self._lock:
+            entries = [
+                {**entry, "callers": dict(entry["callers"]), "param_shapes": list(entry["param_shapes"])}
+                for entry in self._entries.values()
+            ]
+        for entry in entries:
+            entry["avg_ms"] = round(entry["total_ms"] / entry["calls"], 3)
+            entry["total_ms"] = round(entry["total_ms"], 3)
+            entry["max_ms"] = round(entry["max_ms"], 3)
+        return sorted(entries, key=lambda entry: entry[order], reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
+slow_queries = SlowQueryLog()
+
+
+def profile_queries(engine, threshold_ms: float = None, explain_rate: float = None, log: SlowQueryLog = None):
+    """Attach slow query profiling to a sync Engine (or an AsyncEngine's sync_engine)."""
+    threshold_ms = SLOW_QUERY_MS if threshold_ms is None else threshold_ms
+    explain_rate = SLOW_QUERY_EXPLAIN_RATE if explain_rate is None else explain_rate
+    log = slow_queries if log is None else log
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def finished(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["profile_started"].pop()) * 1000
+        if elapsed_ms < threshold_ms or conn.info.get("explaining"):
+            return
+        sql = normalize_sql(statement)
+        caller = find_caller()
+        shape = param_shape(parameters, executemany)
+        plan = None
+        if not executemany and random.random() < explain_rate:
+            plan = explain(conn, statement, parameters)
+        log.record(sql, elapsed_ms, caller, shape, plan)
+        logger.warning(
+            "Slow query %.1fms in %s: %s", elapsed_ms, caller, sql,
+            extra={"duration_ms": round(elapsed_ms, 3), "caller": caller, "sql": sql, "param_shape": shape, "plan": plan},
+        )
+
+    @event.listens_for(engine, "handle_error")
+    def failed(context):
+        if context.connection is not None and context.connection.info.get("profile_started"):
+            context.connection.info["profile_started"].pop()
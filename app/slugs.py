@@ -0,0 +1,21 @@
+import re
+import unicodedata
+
+
+def slugify(title: str):
+    # "Amélie (2001)" -> "amelie-2001"; the same title always maps to the same slug
+    ascii_title = unicodedata.normalize("NFKD", title).encode("ascii", "ignore").decode()
+    slug = re.sub(r"[^a-z0-9]+", "-", ascii_title.lower()).strip("-")
+    return slug[:200] or "movie"
+
+
+def next_free_slug(base: str, taken):
+    # taken holds every existing slug equal to base or of the form base--N.
+    # slugify never emits "--", so a suffixed slug cannot be some other
+    # title's slug: "Heat 2" stays heat-2 even after a second "Heat".
+    if base not in taken:
+        return base
+    suffix = 2
+    while f"{base}--{suffix}" in taken:
+        suffix += 1
+    return f"{base}--{suffix}"
@@ -0,0 +1,186 @@
+import os
+import mmap
+import hashlib
+import tempfile
+from abc import ABC, abstractmethod
+from typing import NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobInfo(NamedTuple):
+    key: str
+    size: int
+    checksum: str
+
+
+def _content_key(checksum: str):
+    # Fan out by digest prefix so no single directory grows too large
+    return f"sha256/{checksum[:2]}/{checksum[2:4]}/{checksum}"
+
+
+class BlobWriter:
+    """Spools an upload to a temp file while hashing it; commit() hands the
+    finished file to the store under its content address."""
+
+    def __init__(self, store, spool_dir: Optional[str] = None):
+        self.store = store
+        self.size = 0
+        self._hash = hashlib.sha256()
+        fd, self.spool_path = tempfile.mkstemp(dir=spool_dir, suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes):
+        self._hash.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    @property
+    def key(self) -> str:
+        """Where the blob will live, known before it is committed."""
+        return _content_key(self._hash.hexdigest())
+
+    def commit(self) -> BlobInfo:
+        self._file.close()
+        checksum = self._hash.hexdigest()
+        info = BlobInfo(key=_content_key(checksum), size=self.size, checksum=checksum)
+        try:
+            self.store._store_spooled(self.spool_path, info)
+        finally:
+            if os.path.exists(self.spool_path):
+                os.remove(self.spool_path)
+        return info
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.spool_path):
+            os.remove(self.spool_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+
+
+class BlobStore(ABC):
+    """Content-addressed storage for movie media. Backends implement
+    _store_spooled, iter_range, size and delete."""
+
+    spool_dir: Optional[str] = None
+
+    def open_writer(self) -> BlobWriter:
+        return BlobWriter(self, spool_dir=self.spool_dir)
+
+    def put_bytes(self, data: bytes) -> BlobInfo:
+        with self.open_writer() as writer:
+            writer.write(data)
+            return writer.commit()
+
+    @abstractmethod
+    def _store_spooled(self, spool_path: str, info: BlobInfo):
+        ...
+
+    @abstractmethod
+    def iter_range(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE):
+        """Yield bytes start..end (inclusive) of a blob without loading it whole."""
+
+    @abstractmethod
+    def size(self, key: str) -> int:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.spool_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def path(self, key: str):
+        return os.path.join(self.root, *key.split("/"))
+
+    def _store_spooled(self, spool_path: str, info: BlobInfo):
+        target = self.path(info.key)
+        if os.path.exists(target):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(spool_path, target)
+
+    def iter_range(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE):
+        # Serve straight out of the page cache through a memory map instead of
+        # a read() per chunk; many viewers of one video share the same pages
+        with open(self.path(key), "rb") as blob:
+            size = os.fstat(blob.fileno()).st_size
+            end = size - 1 if end is None else min(end, size - 1)
+            if start > end:
+                return
+            with mmap.mmap(blob.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for offset in range(start, end + 1, chunk_size):
+                    yield mapped[offset:min(offset + chunk_size, end + 1)]
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self.path(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3BlobStore(BlobStore):
+    def __init__(self, bucket: str, prefix: str = ""):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3")
+
+    def _object_key(self, key: str):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _store_spooled(self, spool_path: str, info: BlobInfo):
+        # upload_file switches to multipart uploads for large files on its own
+        self.client.upload_file(spool_path, self.bucket, self._object_key(info.key))
+
+    def iter_range(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE):
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+        response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key), Range=byte_range)
+        yield from response["Body"].iter_chunks(chunk_size)
+
+    def size(self, key: str) -> int:
+        return self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))["ContentLength"]
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+
+BACKENDS = {
+    "local": lambda: LocalBlobStore(os.environ.get("BLOB_STORE_PATH", "media")),
+    "s3": lambda: S3BlobStore(os.environ["BLOB_STORE_BUCKET"], os.environ.get("BLOB_STORE_PREFIX", "")),
+}
+
+_store = None
+
+
+def register_backend(name: str, factory):
+    BACKENDS[name] = factory
+
+
+def get_blob_store() -> BlobStore:
+    global _store
+    if _store is None:
+        backend = os.environ.get("BLOB_STORE", "local")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown BLOB_STORE backend '{backend}'")
+        _store = BACKENDS[backend]()
+    return _store
@@ -0,0 +1,112 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request
+from starlette.concurrency import iterate_in_threadpool
+from starlette.responses import Response, StreamingResponse
+
+from storage import get_blob_store
+
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+
+def parse_range(header: Optional[str], size: int):
+    """Return (start, end) for a single byte range, None to send the whole
+    blob, or raise ValueError when the range cannot be satisfied."""
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    # Multipart/byteranges responses are not worth it for video; send it all
+    if "," in spec:
+        return None
+    start, _, end = spec.partition("-")
+    if not start:
+        if not end.isdigit() or int(end) == 0:
+            raise ValueError(header)
+        return max(size - int(end), 0), size - 1
+    if not start.isdigit() or (end and not end.isdigit()):
+        return None
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+class BlobResponse(StreamingResponse):
+    """Streams a slice of a stored blob. Servers that implement the ASGI
+    zero-copy send extension get the file handed over for sendfile();
+    otherwise the bytes go out chunk by chunk from a memory map."""
+
+    def __init__(self, key: str, start: int, end: int, **kwargs):
+        self.store = get_blob_store()
+        self.key = key
+        self.start = start
+        self.end = end
+        super().__init__(iterate_in_threadpool(self.store.iter_range(key, start, end)), **kwargs)
+
+    async def __call__(self, scope, receive, send):
+        path = getattr(self.store, "path", None)
+        if path is None or ZEROCOPY_EXTENSION not in scope.get("extensions", {}):
+            return await super().__call__(scope, receive, send)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        with open(path(self.key), "rb") as blob:
+            await send({
+                "type": ZEROCOPY_EXTENSION,
+                "file": blob,
+                "offset": self.start,
+                "count": self.end - self.start + 1,
+                "more_body": False,
+            })
+
+
+def _not_modified(request: Request, etag: str, last_modified: Optional[datetime]):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _range_applies(request: Request, etag: str, last_modified_header: Optional[str]):
+    if_range = request.headers.get("if-range")
+    return if_range is None or if_range in (etag, last_modified_header)
+
+
+def blob_response(request: Request, key: str, size: int, checksum: str, updated_at: Optional[datetime], media_type: str):
+    etag = f'"{checksum}"'
+    last_modified = None
+    headers = {"Accept-Ranges": "bytes", "ETag": etag}
+    if updated_at:
+        # Timestamps are stored naive in UTC; HTTP dates have second precision
+        last_modified = updated_at.replace(tzinfo=timezone.utc, microsecond=0)
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+    if _not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if _range_applies(request, etag, headers.get("Last-Modified")):
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range:
+        status_code = 206
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    if request.method == "HEAD" or size == 0:
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return BlobResponse(key, start, end, status_code=status_code, headers=headers, media_type=media_type)
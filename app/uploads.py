@@ -0,0 +1,179 @@
+import os
+import shutil
+import tempfile
+from typing import AsyncIterator, Iterator
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+
+from storage import CHUNK_SIZE, BlobWriter, get_blob_store
+
+load_dotenv()
+
+MAX_BYTES = {
+    "video": int(os.environ.get("MAX_VIDEO_BYTES", 4 * 1024 ** 3)),
+    "coverimage": int(os.environ.get("MAX_COVER_BYTES", 10 * 1024 ** 2)),
+}
+MAX_PART_BYTES = int(os.environ.get("MAX_UPLOAD_PART_BYTES", 64 * 1024 ** 2))
+MAX_PARTS = int(os.environ.get("MAX_UPLOAD_PARTS", 10000))
+
+ALLOWED_TYPES = {
+    "video": {"video/mp4"},
+    "coverimage": {"image/jpeg", "image/png"},
+}
+
+# Enough leading bytes to recognise every type we accept
+SNIFF_BYTES = 12
+
+
+def sniff_content_type(head: bytes):
+    if len(head) >= 8 and head[4:8] == b"ftyp":
+        return "video/mp4"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    return None
+
+
+def _check_type(kind: str, head: bytes):
+    if sniff_content_type(head) not in ALLOWED_TYPES[kind]:
+        allowed = ", ".join(sorted(ALLOWED_TYPES[kind]))
+        raise HTTPException(status_code=415, detail=f"Invalid file type. Only {allowed} files are allowed.")
+
+
+async def iter_upload_file(upload: UploadFile, chunk_size: int = CHUNK_SIZE):
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def spool_stream(chunks: AsyncIterator[bytes], kind: str) -> BlobWriter:
+    """Hash and spool an upload chunk by chunk, checking its magic bytes up
+    front and its size as it arrives. Nothing reaches the store until the
+    caller commits the returned writer."""
+    limit = MAX_BYTES[kind]
+    writer = await run_in_threadpool(get_blob_store().open_writer)
+    head = b""
+    try:
+        async for chunk in chunks:
+            if len(head) < SNIFF_BYTES:
+                head += chunk[:SNIFF_BYTES - len(head)]
+                if len(head) == SNIFF_BYTES:
+                    _check_type(kind, head)
+            if writer.size + len(chunk) > limit:
+                raise HTTPException(status_code=413, detail=f"File exceeds the {limit} byte limit")
+            await run_in_threadpool(writer.write, chunk)
+        if len(head) < SNIFF_BYTES:
+            _check_type(kind, head)
+        return writer
+    except BaseException:
+        await run_in_threadpool(writer.abort)
+        raise
+
+
+async def spool_streams(streams: dict) -> dict:
+    """Spool every {kind: chunks} upload, so one rejected file means none of
+    them gets committed."""
+    writers = {}
+    try:
+        for kind, chunks in streams.items():
+            writers[kind] = await spool_stream(chunks, kind)
+    except BaseException:
+        for writer in writers.values():
+            await run_in_threadpool(writer.abort)
+        raise
+    return writers
+
+
+# Resumable uploads: each part is written to its own file under the spool
+# directory, so a client can re-send any part that failed and ask which parts
+# already arrived. Completing the session streams the parts into the store.
+
+def _session_dir(upload_id: str):
+    store = get_blob_store()
+    root = getattr(store, "spool_dir", None) or os.path.join(os.path.abspath("media"), "tmp")
+    return os.path.join(root, "uploads", upload_id)
+
+
+def _spooled_bytes(session_dir: str, skip=()):
+    # Finished parts and writes still in flight both take up disk
+    total = 0
+    for name in os.listdir(session_dir):
+        if name not in skip and name.endswith((".part", ".tmp")):
+            try:
+                total += os.path.getsize(os.path.join(session_dir, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def list_parts(upload_id: str):
+    session_dir = _session_dir(upload_id)
+    if not os.path.isdir(session_dir):
+        return []
+    parts = []
+    for name in os.listdir(session_dir):
+        if name.endswith(".part"):
+            parts.append({"part_number": int(name[:-5]), "size": os.path.getsize(os.path.join(session_dir, name))})
+    return sorted(parts, key=lambda part: part["part_number"])
+
+
+async def write_part(upload_id: str, kind: str, part_number: int, chunks: AsyncIterator[bytes]):
+    """Spool one part, refusing it before it reaches the disk once it would
+    take the session past MAX_PARTS parts or past the size limit for kind."""
+    if part_number > MAX_PARTS:
+        raise HTTPException(status_code=413, detail=f"Uploads are limited to {MAX_PARTS} parts")
+    limit = MAX_BYTES[kind]
+    session_dir = _session_dir(upload_id)
+    await run_in_threadpool(os.makedirs, session_dir, exist_ok=True)
+    final_path = os.path.join(session_dir, f"{part_number}.part")
+    # A retry can race the attempt it replaces, so each write gets its own
+    # temp file and the last one to finish wins
+    fd, temp_path = await run_in_threadpool(tempfile.mkstemp, dir=session_dir, prefix=f"{part_number}.", suffix=".tmp")
+    # The part being retried is replaced, so it does not count
+    spooled = await run_in_threadpool(_spooled_bytes, session_dir, (os.path.basename(final_path), os.path.basename(temp_path)))
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as part:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > MAX_PART_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Part exceeds the {MAX_PART_BYTES} byte limit")
+                if spooled + size > limit:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds the {limit} byte limit")
+                await run_in_threadpool(part.write, chunk)
+        os.replace(temp_path, final_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return {"part_number": part_number, "size": size}
+
+
+def _iter_parts(upload_id: str, part_numbers) -> Iterator[bytes]:
+    session_dir = _session_dir(upload_id)
+    for part_number in part_numbers:
+        with open(os.path.join(session_dir, f"{part_number}.part"), "rb") as part:
+            while True:
+                chunk = part.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+
+async def complete_upload(upload_id: str, kind: str) -> BlobWriter:
+    parts = [part["part_number"] for part in list_parts(upload_id)]
+    if not parts:
+        raise HTTPException(status_code=400, detail="No parts uploaded")
+    missing = sorted(set(range(1, parts[-1] + 1)) - set(parts))
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing upload parts: {missing}")
+    return await spool_stream(iterate_in_threadpool(_iter_parts(upload_id, parts)), kind)
+
+
+def discard_upload(upload_id: str):
+    shutil.rmtree(_session_dir(upload_id), ignore_errors=True)
@@ -0,0 +1,99 @@
+"""Helpers shared by the benchmark scripts."""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+APP_DIR = ROOT / "app"
+
+
+def use_database(db_url):
+    """Point the app modules at db_url. Must run before anything from app/ is
+    imported, since database.py builds its engines at import time."""
+    os.environ["DB_URL"] = db_url
+    os.environ.pop("ASYNC_DB_URL", None)
+    os.environ.pop("DB_REPLICA_URLS", None)
+    # Enough settings for auth.py to import when running in process
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+    os.environ.setdefault("LOG_FILE", str(ROOT / "benchmark.log"))
+    for path in (str(APP_DIR), str(ROOT)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    if len(samples) == 1:
+        samples = samples * 2
+    cut = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "count": len(samples),
+        "p50_ms": round(cut[49] * 1000, 3),
+        "p95_ms": round(cut[94] * 1000, 3),
+        "p99_ms": round(cut[98] * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def manifest_path(db_url):
+    """Where datagen.py leaves the description of a generated catalog."""
+    name = db_url.rsplit("/", 1)[-1].split("?")[0] or "catalog"
+    return ROOT / "benchmarks" / "results" / f"{name}.manifest.json"
+
+
+def load_manifest(db_url, path=None):
+    path = Path(path) if path else manifest_path(db_url)
+    if not path.exists():
+        raise SystemExit(f"No catalog manifest at {path}; run benchmarks/datagen.py --db-url {db_url} first")
+    return json.loads(path.read_text())
+
+
+def write_results(path, benchmark, results, **meta):
+    payload = {
+        "benchmark": benchmark,
+        "meta": {
+            "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            **meta,
+        },
+        "results": results,
+    }
+    text = json.dumps(payload, indent=2, sort_keys=True)
+    if path:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(text + "\n")
+    print(text)
+    return payload
+
+
+class Stopwatch:
+    def __init__(self):
+        self.samples = []
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.samples.append(time.perf_counter() - self._started)
@@ -0,0 +1,66 @@
+"""Compare two benchmark result files and flag latency regressions.
+
+    python benchmarks/compare.py benchmarks/results/baseline.json benchmarks/results/crud.json
+
+Works on the output of crud_bench.py and http_load.py. A case regresses when
+its p50 or p95 grew by more than --threshold (a fraction) and by more than
+--min-ms, so sub-millisecond jitter on fast cases is not reported. Exits 1
+if anything regressed, so it can gate CI.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ("p50_ms", "p95_ms")
+
+
+def compare(baseline, current, threshold, min_ms):
+    rows, regressions = [], []
+    for name in sorted(set(baseline["results"]) | set(current["results"])):
+        before, after = baseline["results"].get(name), current["results"].get(name)
+        if before is None or after is None:
+            rows.append((name, "only in " + ("current" if before is None else "baseline"), ""))
+            continue
+        changes = []
+        for metric in METRICS:
+            if metric not in before or metric not in after:
+                continue
+            delta = after[metric] - before[metric]
+            ratio = delta / before[metric] if before[metric] else 0.0
+            changes.append(f"{metric[:-3]} {before[metric]:.3f} -> {after[metric]:.3f} ({ratio:+.0%})")
+            if ratio > threshold and delta > min_ms:
+                regressions.append((name, metric, ratio))
+        flagged = any(regressed == name for regressed, _, _ in regressions)
+        rows.append((name, "; ".join(changes), "REGRESSED" if flagged else ""))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown (default 0.10)")
+    parser.add_argument("--min-ms", type=float, default=1.0, help="ignore slowdowns smaller than this many ms")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline.get("benchmark") != current.get("benchmark"):
+        raise SystemExit(f"Cannot compare a {baseline.get('benchmark')} run with a {current.get('benchmark')} run")
+    if baseline["meta"].get("catalog") != current["meta"].get("catalog"):
+        print("warning: the two runs used different catalogs", file=sys.stderr)
+
+    rows, regressions = compare(baseline, current, args.threshold, args.min_ms)
+    print(f"{baseline['meta'].get('commit')} -> {current['meta'].get('commit')} ({current['benchmark']})")
+    width = max((len(name) for name, _, _ in rows), default=0)
+    for name, changes, flag in rows:
+        print(f"{name:<{width}}  {changes}  {flag}".rstrip())
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%} and {args.min_ms}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Time each crud.py function against a generated catalog.
+
+    python benchmarks/datagen.py --db-url sqlite:///bench.db
+    python benchmarks/crud_bench.py --db-url sqlite:///bench.db --output benchmarks/results/crud.json
+
+Ids are drawn with the catalog's popularity skew, each call gets a fresh
+session (as a request would) and the cache layer is bypassed, so the numbers
+are the database work alone. Reads run first; the write cases then change
+the catalog, so regenerate it before a run you want to compare exactly.
+"""
+import argparse
+import random
+
+from common import Stopwatch, load_manifest, percentiles, use_database, write_results
+
+
+def cases(manifest, rng):
+    """Each case takes a session, does any lookups it needs untimed, and
+    returns the call to time."""
+    import sqlalchemy
+    import crud, model, schema
+    from datagen import Zipf
+    from pagination import encode_cursor
+
+    movies = Zipf(manifest["movie_ids"], manifest["zipf"], rng)
+    users = Zipf(manifest["user_ids"], manifest["zipf"], rng)
+    threads = Zipf(manifest["reply_thread_ids"] or [0], manifest["zipf"], rng)
+    titles = manifest["titles"]
+    names = dict(zip(manifest["user_ids"], manifest["usernames"]))
+    created = []
+
+    def token_user():
+        user_id = users.draw()[0]
+        return schema.User(user_id=user_id, username=names[user_id])
+
+    def deep_page(db):
+        # Resume a third of the way through the catalog
+        row = db.execute(
+            sqlalchemy.select(model.Movies.created_at, model.Movies.movie_id)
+            .order_by(model.Movies.created_at, model.Movies.movie_id)
+            .offset(len(manifest["movie_ids"]) // 3).limit(1)
+        ).first()
+        cursor = encode_cursor(row.created_at, row.movie_id)
+        return lambda: crud.view_all_movies(db, cursor=cursor, limit=20)
+
+    def upload(db):
+        movie = schema.MovieUpload(
+            title=f"Benchmark Upload {rng.randrange(10 ** 9)}",
+            genre=", ".join(rng.sample(manifest["genres"], 2)),
+            description="Written by the crud benchmark.",
+            release_date="2020-01-01",
+        )
+        user_id = users.draw()[0]
+        return lambda: created.append(crud.Upload_new_movie(db, movie, user_id=user_id).movie_id)
+
+    def update(db):
+        movie = db.get(model.Movies, created[rng.randrange(len(created))] if created else movies.draw()[0])
+        changes = schema.MovieUpdate(description=f"Edited {rng.random()}")
+        return lambda: crud.update_movie(db, movie, changes)
+
+    def delete(db):
+        movie = db.get(model.Movies, created.pop()) if created else None
+        return lambda: movie and crud.delete_movie(db, movie)
+
+    def bulk_rate(db):
+        drawn = dict.fromkeys(movies.draw(50))
+        items = [(index, schema.BulkRatingItem(movie_id=movie_id, rating=rng.randint(1, 5))) for index, movie_id in enumerate(drawn)]
+        user_id = users.draw()[0]
+        return lambda: crud.bulk_rate_movies(db, items, user_id=user_id, update_existing=True)
+
+    def with_movie(call):
+        def prepare(db):
+            movie = db.get(model.Movies, movies.draw()[0])
+            return lambda: call(db, movie)
+        return prepare
+
+    def simple(call):
+        return lambda db: (lambda: call(db))
+
+    return {
+        "get_user_by_username": simple(lambda db: crud.get_user_by_username(db, names[users.draw()[0]])),
+        "get_user_by_email": simple(lambda db: crud.get_user_by_email(db, f"{names[users.draw()[0]]}@example.com")),
+        "get_user_by_id": simple(lambda db: crud.get_user_by_id(db, users.draw()[0])),
+        "view_all_movies": simple(lambda db: crud.view_all_movies(db, limit=20)),
+        "view_all_movies_deep_cursor": deep_page,
+        "view_all_movies_by_genre": simple(lambda db: crud.view_all_movies(db, genre=rng.choice(manifest["genres"]), limit=20)),
+        "get_movie_by_id": simple(lambda db: crud.get_movie_by_id(db, movies.draw()[0])),
+        "get_movie_by_title": simple(lambda db: crud.get_movie_by_title(db, titles[str(movies.draw()[0])])),
+        "get_ratings_for_movie": with_movie(crud.get_ratings_for_movie),
+        "get_comments_for_movie": simple(lambda db: crud.get_comments_for_movie(db, movies.draw()[0])),
+        "get_reply": simple(lambda db: crud.get_reply(db, threads.draw()[0])),
+        "unique_slug": simple(lambda db: crud.unique_slug(db, titles[str(movies.draw()[0])])),
+        # Writes
+        "Upload_new_movie": upload,
+        "update_movie": update,
+        "rate_movie": with_movie(lambda db, movie: crud.rate_movie(db, movie.movie_id, rng.randint(1, 5), users.draw()[0], update_existing=True)),
+        "bulk_rate_movies_50": bulk_rate,
+        "create_comment": with_movie(lambda db, movie: crud.create_comment(db, schema.PostComment(content="Benchmark comment", created_at="2024-01-01"), movie, token_user())),
+        "reply_to_comment": simple(lambda db: crud.reply_to_comment(db, threads.draw()[0], schema.PostReply(content="Benchmark reply"), token_user())),
+        "delete_movie": delete,
+    }
+
+
+def run(args):
+    use_database(args.db_url)
+    import database
+
+    manifest = load_manifest(args.db_url, args.manifest)
+    rng = random.Random(args.seed)
+    selected = cases(manifest, rng)
+    if args.only:
+        selected = {name: case for name, case in selected.items() if name in args.only}
+
+    results = {}
+    for name, case in selected.items():
+        for _ in range(args.warmup):
+            with database.SessionLocal() as db:
+                case(db)()
+        watch = Stopwatch()
+        for _ in range(args.iterations):
+            with database.SessionLocal() as db:
+                call = case(db)
+                with watch:
+                    call()
+        busy = sum(watch.samples)
+        results[name] = {**percentiles(watch.samples), "ops_per_s": round(args.iterations / busy, 1) if busy else None}
+
+    return write_results(
+        args.output, "crud", results,
+        dialect=database.engine.dialect.name, iterations=args.iterations, seed=args.seed,
+        catalog={"seed": manifest["seed"], "counts": manifest["counts"]},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-url", default="sqlite:///bench.db")
+    parser.add_argument("--manifest", help="catalog manifest (default: the one datagen.py wrote for --db-url)")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--only", nargs="*", help="run just these cases")
+    parser.add_argument("--output", help="write the results JSON here as well as to stdout")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
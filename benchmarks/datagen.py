@@ -0,0 +1,210 @@
+"""Generate a synthetic, reproducible catalog to benchmark against.
+
+    python benchmarks/datagen.py --db-url sqlite:///bench.db --users 1000 --movies 5000 \\
+        --ratings 100000 --comments 20000 --replies 40000
+
+The same seed and counts always give the same data. Popularity follows a
+Zipf distribution: a few movies get most of the ratings and comments, and a
+few users do most of the rating, much as in real catalogs. Movies go through
+crud.Upload_new_movie and ratings through crud.bulk_rate_movies, so slugs,
+genres, the search index, rating totals and the leaderboards all match what
+the API would have built. Comments and replies are inserted in bulk with
+timestamps spread over the last --days, and trending is rebuilt from them.
+
+Every user's password is "benchpassword". A manifest describing the catalog,
+with movies in popularity order, is written to benchmarks/results/ for the
+other scripts.
+"""
+import argparse
+import itertools
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import manifest_path, use_database
+
+PASSWORD = "benchpassword"
+GENRES = [
+    "Drama", "Comedy", "Action", "Thriller", "Romance", "Horror", "Documentary", "Animation",
+    "Science Fiction", "Adventure", "Crime", "Fantasy", "Mystery", "Family", "War", "Western",
+]
+WORDS = [
+    "Midnight", "River", "Silent", "Iron", "Golden", "Last", "Broken", "Hidden", "Crimson", "Winter",
+    "Echo", "Shadow", "Northern", "Paper", "Glass", "Wild", "Distant", "Electric", "Lonely", "Burning",
+    "Garden", "City", "Storm", "Harbor", "Machine", "Letter", "Empire", "Voyage", "Promise", "Signal",
+]
+
+
+class Zipf:
+    """Draws items with probability proportional to 1 / rank ** exponent."""
+
+    def __init__(self, items, exponent, rng):
+        self.items = list(items)
+        self.cum_weights = list(itertools.accumulate(1 / rank ** exponent for rank in range(1, len(self.items) + 1)))
+        self.rng = rng
+
+    def draw(self, k=1):
+        return self.rng.choices(self.items, cum_weights=self.cum_weights, k=k)
+
+    def share(self, total):
+        """Split total between the items in proportion to their weights."""
+        weights = [b - a for a, b in zip([0, *self.cum_weights], self.cum_weights)]
+        scale = total / self.cum_weights[-1]
+        return [round(weight * scale) for weight in weights]
+
+
+def generate(args):
+    use_database(args.db_url)
+    import sqlalchemy
+    import crud, database, leaderboard, model, schema
+    from hashing import pwd_context
+
+    rng = random.Random(args.seed)
+    database.Base.metadata.create_all(bind=database.engine)
+    started = time.perf_counter()
+    timings = {}
+    now = datetime.utcnow().replace(microsecond=0)
+
+    with database.SessionLocal() as db:
+        if db.execute(sqlalchemy.select(model.Movies.movie_id).limit(1)).first():
+            raise SystemExit(f"{args.db_url} already has movies; generate into an empty database")
+
+        phase = time.perf_counter()
+        hashed = pwd_context.hash(PASSWORD)
+        db.execute(sqlalchemy.insert(model.User), [
+            {
+                "full_name": f"Bench User {number}",
+                "username": f"bench_user_{number}",
+                "email": f"bench_user_{number}@example.com",
+                "hashed_password": hashed,
+            }
+            for number in range(args.users)
+        ])
+        db.commit()
+        user_ids = db.execute(
+            sqlalchemy.select(model.User.user_id).where(model.User.username.like("bench_user_%")).order_by(model.User.user_id)
+        ).scalars().all()
+        timings["users_s"] = round(time.perf_counter() - phase, 3)
+
+        phase = time.perf_counter()
+        genre_draw = Zipf(GENRES, 0.8, rng)
+        movie_ids, titles, quality = [], [], {}
+        for number in range(args.movies):
+            title = " ".join(rng.sample(WORDS, rng.randint(1, 3)) + [str(number)])
+            genres = sorted(set(genre_draw.draw(rng.randint(1, 3))))
+            movie = crud.Upload_new_movie(db, schema.MovieUpload(
+                title=title,
+                genre=", ".join(genres),
+                description=" ".join(rng.choices(WORDS, k=rng.randint(8, 30))).capitalize() + ".",
+                release_date=f"{rng.randint(1950, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            ), user_id=rng.choice(user_ids))
+            movie_ids.append(movie.movie_id)
+            titles.append(title)
+            quality[movie.movie_id] = rng.uniform(2.0, 4.8)
+        timings["movies_s"] = round(time.perf_counter() - phase, 3)
+
+        # Popularity rank is independent of insertion order
+        by_popularity = movie_ids[:]
+        rng.shuffle(by_popularity)
+        movie_draw = Zipf(by_popularity, args.zipf, rng)
+        raters = user_ids[:]
+        rng.shuffle(raters)
+        user_draw = Zipf(raters, args.zipf, rng)
+
+        phase = time.perf_counter()
+        for user_id, count in zip(raters, user_draw.share(args.ratings)):
+            count = min(count, len(movie_ids))
+            if not count:
+                continue
+            rated = set()
+            # Skewed draws repeat the hits; after a few rounds fill up from the tail
+            for _ in range(5):
+                if len(rated) >= count:
+                    break
+                rated.update(movie_draw.draw(count - len(rated)))
+            if len(rated) < count:
+                rated.update(rng.sample(sorted(set(movie_ids) - rated), count - len(rated)))
+            items = [
+                (index, schema.BulkRatingItem(movie_id=movie_id, rating=min(5, max(1, round(rng.gauss(quality[movie_id], 1))))))
+                for index, movie_id in enumerate(sorted(rated))
+            ]
+            for batch in range(0, len(items), 500):
+                crud.bulk_rate_movies(db, items[batch:batch + 500], user_id=user_id)
+        timings["ratings_s"] = round(time.perf_counter() - phase, 3)
+
+        def spread():
+            return now - timedelta(seconds=rng.randint(0, args.days * 86400))
+
+        phase = time.perf_counter()
+        comment_rows = [
+            {"movie_id": movie_id, "user_id": user_id, "content": " ".join(rng.choices(WORDS, k=rng.randint(3, 20))), "created_at": spread()}
+            for movie_id, user_id in zip(movie_draw.draw(args.comments), user_draw.draw(args.comments))
+        ]
+        for batch in range(0, len(comment_rows), 5000):
+            db.execute(sqlalchemy.insert(model.ParentComment), comment_rows[batch:batch + 5000])
+        db.commit()
+        comments = db.execute(
+            sqlalchemy.select(model.ParentComment.parent_comment_id, model.ParentComment.created_at)
+            .order_by(model.ParentComment.parent_comment_id)
+        ).all()
+        # Replies pile up on a few busy threads, like the movies they are on
+        thread_draw = Zipf([row.parent_comment_id for row in comments], args.zipf, rng) if comments else None
+        created = dict(comments)
+        reply_rows = []
+        for parent_id, user_id in zip(thread_draw.draw(args.replies) if thread_draw else [], user_draw.draw(args.replies)):
+            reply_rows.append({
+                "parent_comment_id": parent_id,
+                "user_id": user_id,
+                "content": " ".join(rng.choices(WORDS, k=rng.randint(2, 12))),
+                "created_at": min(now, created[parent_id] + timedelta(seconds=rng.randint(60, 3 * 86400))),
+            })
+        for batch in range(0, len(reply_rows), 5000):
+            db.execute(sqlalchemy.insert(model.CommentReply), reply_rows[batch:batch + 5000])
+        leaderboard.rebuild_trending(db)
+        db.commit()
+        timings["comments_s"] = round(time.perf_counter() - phase, 3)
+
+        comment_ids = [row.parent_comment_id for row in comments]
+        threads = list(dict.fromkeys(row["parent_comment_id"] for row in reply_rows))
+
+    manifest = {
+        "db_url": args.db_url,
+        "seed": args.seed,
+        "zipf": args.zipf,
+        "counts": {"users": args.users, "movies": args.movies, "ratings": args.ratings, "comments": args.comments, "replies": args.replies},
+        "password": PASSWORD,
+        "usernames": [f"bench_user_{number}" for number in range(args.users)],
+        "user_ids": user_ids,
+        # Most popular first, so clients can draw ids with the same skew
+        "movie_ids": by_popularity,
+        "titles": dict(zip(map(str, movie_ids), titles)),
+        "genres": GENRES,
+        "words": WORDS,
+        "comment_ids": comment_ids,
+        "reply_thread_ids": threads,
+        "timings": {**timings, "total_s": round(time.perf_counter() - started, 3)},
+    }
+    path = manifest_path(args.db_url)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(manifest))
+    print(json.dumps({"manifest": str(path), "counts": manifest["counts"], "timings": manifest["timings"]}, indent=2))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-url", default="sqlite:///bench.db")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--ratings", type=int, default=100000)
+    parser.add_argument("--comments", type=int, default=20000)
+    parser.add_argument("--replies", type=int, default=40000)
+    parser.add_argument("--days", type=int, default=30, help="spread comment and reply timestamps over this many days")
+    parser.add_argument("--zipf", type=float, default=1.1, help="skew of movie popularity and user activity")
+    parser.add_argument("--seed", type=int, default=42)
+    generate(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""HTTP load test: a weighted mix of the API's routes, with latency percentiles
+and throughput for each route.
+
+    python benchmarks/datagen.py --db-url sqlite:///bench.db
+    python benchmarks/http_load.py --db-url sqlite:///bench.db --duration 30 --concurrency 20 \\
+        --output benchmarks/results/http.json
+
+Without --url the app runs in this process behind httpx's ASGI transport, so
+nothing needs to be started and the numbers leave out the network and server.
+With --url it drives a running server (uvicorn app.main:app --app-dir app)
+that is using the same database. Request ids and query strings are drawn with
+the catalog's popularity skew, so caches warm up as they would in production.
+Media uploads, streaming, signup and the admin routes are not part of the mix.
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+from common import load_manifest, percentiles, use_database, write_results
+
+
+def scenarios(manifest, rng, state):
+    """(route template, weight, request builder). A builder returns
+    (method, path, httpx request kwargs), or None to skip this turn."""
+    from datagen import Zipf
+
+    movies = Zipf(manifest["movie_ids"], manifest["zipf"], rng)
+    threads = Zipf(manifest["reply_thread_ids"] or [0], manifest["zipf"], rng)
+    comments = Zipf(manifest["comment_ids"] or [0], manifest["zipf"], rng)
+    genres = Zipf(manifest["genres"], 0.8, rng)
+    titles = manifest["titles"]
+
+    def movie_id():
+        return movies.draw()[0]
+
+    def title():
+        return titles[str(movie_id())]
+
+    def auth():
+        return {"headers": {"Authorization": f"Bearer {rng.choice(state['tokens'])['access_token']}"}}
+
+    def list_movie():
+        return "POST", "/List_a_Movie/", {**auth(), "json": {
+            "title": f"Load Test {rng.randrange(10 ** 9)}", "genre": genres.draw()[0],
+            "description": "Listed by the load test.", "release_date": "2021-06-01",
+        }}
+
+    def update_movie():
+        if not state["owned"]:
+            return None
+        owned_id, headers = rng.choice(state["owned"])
+        return "PUT", f"/movies/{owned_id}", {"headers": headers, "json": {"description": f"Edited {rng.random()}"}}
+
+    def delete_movie():
+        if len(state["owned"]) < 10:
+            return None
+        owned_id, headers = state["owned"].pop(0)
+        return "DELETE", f"/movies/{owned_id}", {"headers": headers}
+
+    def login():
+        return "POST", "/login/", {"data": {"username": rng.choice(manifest["usernames"][:20]), "password": manifest["password"]}}
+
+    def refresh():
+        return "POST", "/token/refresh", {"json": {"refresh_token": rng.choice(state["tokens"])["refresh_token"]}}
+
+    def bulk_rate():
+        ratings = [{"movie_id": drawn, "rating": rng.randint(1, 5)} for drawn in dict.fromkeys(movies.draw(20))]
+        return "POST", "/ratings/bulk", {**auth(), "params": {"update_existing": "true"}, "json": ratings}
+
+    return [
+        ("/", 1, lambda: ("GET", "/", {})),
+        ("/healthz", 1, lambda: ("GET", "/healthz", {})),
+        ("/metrics", 1, lambda: ("GET", "/metrics", {})),
+        ("/movies/", 10, lambda: ("GET", "/movies/", {"params": {"limit": 20}})),
+        ("/movies/?genre", 3, lambda: ("GET", "/movies/", {"params": {"limit": 20, "genre": genres.draw()[0]}})),
+        ("/movies/{movie_id:int}", 15, lambda: ("GET", f"/movies/{movie_id()}", {})),
+        ("/movie/{movie_title}", 5, lambda: ("GET", f"/movie/{title()}", {})),
+        ("/movies/search", 6, lambda: ("GET", "/movies/search", {"params": {"q": " ".join(rng.sample(manifest["words"], rng.randint(1, 2)))}})),
+        ("/genres/", 2, lambda: ("GET", "/genres/", {})),
+        ("/genres/movies", 3, lambda: ("GET", "/genres/movies", {"params": {"genre": list(dict.fromkeys(genres.draw(2))), "match": rng.choice(["all", "any"])}})),
+        ("/leaderboards/top-rated", 3, lambda: ("GET", "/leaderboards/top-rated", {})),
+        ("/leaderboards/trending", 3, lambda: ("GET", "/leaderboards/trending", {})),
+        ("/movies/{movie_id:int}/ratings", 8, lambda: ("GET", f"/movies/{movie_id()}/ratings", {})),
+        ("/ratings/{movie_title}", 2, lambda: ("GET", f"/ratings/{title()}", {})),
+        ("/movies/{movie_id:int}/comments", 5, lambda: ("GET", f"/movies/{movie_id()}/comments", {})),
+        ("/comments/{movie_title}", 2, lambda: ("GET", f"/comments/{title()}", {})),
+        ("/movies/{movie_id:int}/threads", 5, lambda: ("GET", f"/movies/{movie_id()}/threads", {})),
+        ("/threads/{movie_title}", 1, lambda: ("GET", f"/threads/{title()}", {})),
+        ("/replies/{parent_comment_id}", 4, lambda: ("GET", f"/replies/{threads.draw()[0]}", {})),
+        ("POST /movies/{movie_id:int}/ratings", 4, lambda: ("POST", f"/movies/{movie_id()}/ratings", {**auth(), "params": {"update_existing": "true"}, "json": {"rating": rng.randint(1, 5)}})),
+        ("POST /rating/", 1, lambda: ("POST", "/rating/", {**auth(), "params": {"update_existing": "true"}, "json": {"movie_title": title(), "rating": rng.randint(1, 5), "created_at": "2024-01-01"}})),
+        ("POST /ratings/bulk", 1, bulk_rate),
+        ("POST /movies/{movie_id:int}/comments", 3, lambda: ("POST", f"/movies/{movie_id()}/comments", {**auth(), "json": {"content": "Load test comment", "created_at": "2024-01-01"}})),
+        ("POST /comment/{movie_title}", 1, lambda: ("POST", f"/comment/{title()}", {**auth(), "json": {"content": "Load test comment", "created_at": "2024-01-01"}})),
+        ("POST /reply/", 2, lambda: ("POST", "/reply/", {**auth(), "params": {"parent_comment_id": comments.draw()[0]}, "json": {"content": "Load test reply"}})),
+        ("POST /List_a_Movie/", 1, list_movie),
+        ("PUT /movies/{movie_id:int}", 1, update_movie),
+        ("DELETE /movies/{movie_id:int}", 1, delete_movie),
+        ("POST /login/", 1, login),
+        ("POST /token/refresh", 1, refresh),
+    ]
+
+
+async def worker(client, mix, weights, rng, deadline, timings, statuses, state):
+    while time.perf_counter() < deadline:
+        route, _, build = rng.choices(mix, weights=weights)[0]
+        request = build()
+        if request is None:
+            continue
+        method, path, kwargs = request
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError as error:
+            status = type(error).__name__
+            response = None
+        timings[route].append(time.perf_counter() - started)
+        statuses[route][str(status)] += 1
+        if route == "POST /List_a_Movie/" and response is not None and response.status_code == 200:
+            state["owned"].append((response.json()["movie_id"], kwargs["headers"]))
+
+
+async def run(args):
+    manifest = load_manifest(args.db_url, args.manifest)
+    rng = random.Random(args.seed)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60, limits=httpx.Limits(max_connections=args.concurrency))
+    else:
+        use_database(args.db_url)
+        from main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+
+    async with client:
+        state = {"tokens": [], "owned": []}
+        for username in manifest["usernames"][:args.users]:
+            response = await client.post("/login/", data={"username": username, "password": manifest["password"]})
+            response.raise_for_status()
+            state["tokens"].append(response.json())
+
+        mix = scenarios(manifest, rng, state)
+        if args.only:
+            mix = [scenario for scenario in mix if scenario[0] in args.only]
+        weights = [weight for _, weight, _ in mix]
+        timings, statuses = defaultdict(list), defaultdict(Counter)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            worker(client, mix, weights, random.Random(args.seed * 1000 + number), deadline, timings, statuses, state)
+            for number in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+    results = {
+        route: {
+            **percentiles(timings[route]),
+            "rps": round(len(timings[route]) / elapsed, 2),
+            "statuses": dict(statuses[route]),
+            "errors": sum(count for status, count in statuses[route].items() if not status.isdigit() or int(status) >= 500),
+        }
+        for route in sorted(timings)
+    }
+    everything = [sample for samples in timings.values() for sample in samples]
+    results["_all"] = {**percentiles(everything), "rps": round(len(everything) / elapsed, 2)}
+    return write_results(
+        args.output, "http", results,
+        target=args.url or "in-process", concurrency=args.concurrency, duration_s=args.duration, seed=args.seed,
+        catalog={"seed": manifest["seed"], "counts": manifest["counts"]},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-url", default="sqlite:///bench.db", help="catalog database (used directly when running in process)")
+    parser.add_argument("--manifest", help="catalog manifest (default: the one datagen.py wrote for --db-url)")
+    parser.add_argument("--url", help="base URL of a running server; omit to run the app in process")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--users", type=int, default=5, help="distinct users to log in as for the write routes")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--only", nargs="*", help="run just these routes, by the names used in the results")
+    parser.add_argument("--output", help="write the results JSON here as well as to stdout")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
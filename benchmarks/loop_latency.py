@@ -0,0 +1,68 @@
+"""Tail latency of a cheap endpoint while database-backed routes are under load.
+
+Start the app (uvicorn app.main:app --app-dir app) and run:
+
+    python benchmarks/loop_latency.py --url http://127.0.0.1:8000 --concurrency 200
+
+A blocked event loop shows up as a long p99 on the probe route, because every
+request queued behind a synchronous query waits for it to finish. Run it once
+against a build that calls the database from `async def` routes and once
+against this one to compare.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from common import percentiles
+
+DB_ROUTES = ["/movies/?limit=50", "/replies/1"]
+
+
+async def hammer(client, route, deadline, timings):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await client.get(route)
+        timings.append(time.perf_counter() - started)
+
+
+async def probe(client, route, deadline, interval, timings):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await client.get(route)
+        timings.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+
+
+async def run(url, concurrency, duration, probe_route, interval):
+    limits = httpx.Limits(max_connections=concurrency + 1)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        deadline = time.perf_counter() + duration
+        load, probes = [], []
+        workers = [hammer(client, DB_ROUTES[i % len(DB_ROUTES)], deadline, load) for i in range(concurrency)]
+        await asyncio.gather(probe(client, probe_route, deadline, interval, probes), *workers)
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "duration_s": duration,
+        "probe": percentiles(probes),
+        "db_routes": percentiles(load),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--probe-route", default="/")
+    parser.add_argument("--probe-interval", type=float, default=0.05)
+    args = parser.parse_args()
+    result = asyncio.run(run(args.url, args.concurrency, args.duration, args.probe_route, args.probe_interval))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
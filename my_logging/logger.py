@@ -5,35 +5,176 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
 import logging
 import logging.handlers
+from contextvars import ContextVar
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Set up papertrail
+# Request handlers only put records on a bounded queue; a listener thread
+# formats them as JSON lines and does the console, file and Papertrail I/O.
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Logs go to stderr unless LOG_FILE names a file to append to
+LOG_FILE = os.getenv('LOG_FILE')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+# Share of INFO and DEBUG records kept; warnings and errors are never sampled
+LOG_INFO_SAMPLE_RATE = float(os.getenv('LOG_INFO_SAMPLE_RATE', 1.0))
 
 papertrail_host = os.getenv('PAPERTRAIL_HOST')
-papertrail_port = int(os.getenv('PAPERTRAIL_PORT'))
-
-
-if papertrail_host and papertrail_port:
-    # Set up logging
-    papertrail_handler = logging.handlers.SysLogHandler(address=(papertrail_host,papertrail_port))
-    console_handler = logging.StreamHandler()
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
-        handlers=[papertrail_handler, console_handler]
-    )
-
-else:
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
-        filename='applog.txt'       
-    )
+papertrail_port = os.getenv('PAPERTRAIL_PORT')
+papertrail_port = int(papertrail_port) if papertrail_port else None
+
+request_id_var = ContextVar('request_id', default=None)
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the id of the request being handled. Runs on the
+    calling thread, where the context variable is set."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: when the listener falls behind and the
+    queue is full, records are dropped and counted instead."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Resolve the message and traceback here, since args may not survive
+        # the trip to another thread, but leave the JSON formatting to the listener
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _output_handlers():
+    if papertrail_host and papertrail_port:
+        handlers = [logging.handlers.SysLogHandler(address=(papertrail_host, papertrail_port)), logging.StreamHandler()]
+    elif LOG_FILE:
+        handlers = [logging.FileHandler(LOG_FILE)]
+    else:
+        handlers = [logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(JsonFormatter())
+    return handlers
+
+
+queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+queue_handler.addFilter(SamplingFilter(LOG_INFO_SAMPLE_RATE))
+queue_handler.addFilter(RequestIdFilter())
+listener = logging.handlers.QueueListener(queue_handler.queue, *_output_handlers(), respect_handler_level=True)
+
+root = logging.getLogger()
+root.setLevel(LOG_LEVEL)
+root.addHandler(queue_handler)
+listener.start()
+# Flush whatever is still queued on shutdown
+atexit.register(listener.stop)
+
 
 def get_logger(name=None):
     logger = logging.getLogger(name)
     return logger
+
+
+def log_stats():
+    return {"queued": queue_handler.queue.qsize(), "dropped": queue_handler.dropped}
+
+
+access_logger = get_logger('access')
+
+
+class RequestLogMiddleware:
+    """Gives each request an id (the client's X-Request-ID if it sent one),
+    echoes it back, and logs the method, path, status and duration once the
+    response has been sent."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers", []))
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            access_logger.info(
+                "%s %s %s", scope["method"], scope["path"], status,
+                extra={
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                },
+            )
+            request_id_var.reset(token)
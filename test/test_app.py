@@ -1,13 +1,15 @@
 import sys
 from pathlib import Path
 import pytest
+from fastapi import Request
 from fastapi.testclient import TestClient
-from app.main import app
-from sqlalchemy import create_engine
+from app.main import app, database, metrics, replicas
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
-from app.database import Base, get_db
-from app.auth import pwd_context
+from app.hashing import pwd_context
 from datetime import datetime
+from contextlib import contextmanager
 import os
 from dotenv import load_dotenv
 
@@ -22,13 +24,22 @@ load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.environ.get('TEST_DB_URL')
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
+async_engine = create_async_engine(database.async_url(SQLALCHEMY_DATABASE_URL))
+metrics.track_queries(engine)
+metrics.track_queries(async_engine.sync_engine)
 # Create a test database session
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+# Code that opens its own sessions (auth, leaderboard refreshes, the primary
+# fallback of the read dependencies) uses the test database too
+database.SessionLocal.configure(bind=engine)
+database.AsyncSessionLocal.configure(bind=async_engine)
 
 # Create the test database tables
-Base.metadata.create_all(bind=engine)
+database.Base.metadata.create_all(bind=engine)
 
-# Override get_db dependency to use the test database
+# Override the session dependencies to use the test database. The read
+# dependencies still hand out replica sessions when a test sets up replicas.
 def override_get_db():
     try:
         db = TestingSessionLocal()
@@ -36,7 +47,28 @@ def override_get_db():
     finally:
         db.close()
 
-app.dependency_overrides[get_db] = override_get_db
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+def override_get_read_db(request: Request):
+    if replicas.reads_from_primary(request):
+        yield from override_get_db()
+    else:
+        yield from replicas.get_read_db(request)
+
+async def override_get_async_read_db(request: Request):
+    if replicas.reads_from_primary(request):
+        async for db in override_get_async_db():
+            yield db
+    else:
+        async for db in replicas.get_async_read_db(request):
+            yield db
+
+app.dependency_overrides[database.get_db] = override_get_db
+app.dependency_overrides[database.get_async_db] = override_get_async_db
+app.dependency_overrides[replicas.get_read_db] = override_get_read_db
+app.dependency_overrides[replicas.get_async_read_db] = override_get_async_read_db
 
 
 client = TestClient(app)
@@ -56,6 +88,22 @@ def test_db():
     session.close()
     transaction.rollback()
     connection.close()
+
+@contextmanager
+def count_queries():
+    """Collect every statement the app's engines send while the block runs,
+    so tests can pin the number of round trips an endpoint makes."""
+    from app.main import database
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    engines = [engine, async_engine.sync_engine]
+    for target in engines:
+        event.listen(target, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        for target in engines:
+            event.remove(target, "before_cursor_execute", record)
 # 1
 def test_root():
    response = client.get("/")
@@ -123,13 +171,54 @@ def test_get_all_movie (test_db):
     response = client.get("/movies/")
 
     assert response.status_code == 200
-    data = response.json()
+    data = response.json()["movies"]
     assert len(data) > 0
     assert data[0]["title"] == "Test Movie"
     assert data[0]["genre"] == "Sci - Fi"
     assert data[0]["description"] == "A test movie description"
     assert data[0]["release_date"] == "2024-07-27"
 
+# Paginate movies with a cursor 5b
+
+def test_get_movies_by_cursor(test_db):
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client.post("/List_a_Movie/", json={
+        "title": "Cursor Movie",
+        "genre": "Cursor Genre",
+        "description": "A movie to page through",
+        "release_date": "1999-01-01"
+    }, headers=headers)
+
+    titles = []
+    cursor = None
+    while True:
+        params = {"limit": 1}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/movies/", params=params)
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["movies"]) <= 1
+        titles.extend(movie["title"] for movie in data["movies"])
+        cursor = data["next_cursor"]
+        if not cursor:
+            break
+    assert len(titles) == len(set(titles))
+    assert "Cursor Movie" in titles
+
+    response = client.get("/movies/", params={"genre": "Cursor Genre", "release_year": 1999})
+    assert response.status_code == 200
+    assert [movie["title"] for movie in response.json()["movies"]] == ["Cursor Movie"]
+
+    response = client.get("/movies/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
 # 6
 def test_get_movie_by_title (test_db):
 
@@ -298,4 +387,1117 @@ def test_get_replies_to_comment(test_db):
     response = client.get("/replies/1")
     assert response.status_code == 200
     data = response.json()
-    print(f"Replies data: {data}")
\ No newline at end of file
+    print(f"Replies data: {data}")
+
+# Blob store keeps media out of movie rows 15
+def test_blob_store_round_trip(tmp_path):
+    from app.storage import LocalBlobStore
+
+    store = LocalBlobStore(str(tmp_path))
+    info = store.put_bytes(b"movie bytes")
+    assert info.size == len(b"movie bytes")
+    assert info.key.endswith(info.checksum)
+    assert store.put_bytes(b"movie bytes") == info
+
+    assert b"".join(store.iter_range(info.key)) == b"movie bytes"
+    assert b"".join(store.iter_range(info.key, 6, 10, chunk_size=2)) == b"bytes"
+
+    store.delete(info.key)
+    assert not list(tmp_path.rglob(info.checksum))
+
+    from app.storage import BlobStore
+    with pytest.raises(TypeError):
+        BlobStore()
+
+def test_release_waits_for_upload_of_same_blob(monkeypatch):
+    import threading
+    from app.main import crud, database, schema
+    from app.storage import get_blob_store
+
+    store = get_blob_store()
+    existing = store.put_bytes(b"shared media bytes")
+    writer = store.open_writer()
+    writer.write(b"shared media bytes")
+
+    # Hold the upload after its blob is committed but before the movie row is
+    indexing, resume = threading.Event(), threading.Event()
+    index_movie = crud.search.index_movie
+    def paused_index(db, movie, new=False):
+        indexing.set()
+        resume.wait(5)
+        index_movie(db, movie, new=new)
+    monkeypatch.setattr(crud.search, "index_movie", paused_index)
+
+    movie = schema.MovieUpload(title="Shared Blob", genre="Drama", description="Same bytes", release_date="2024-07-27")
+    def upload():
+        with database.SessionLocal() as db:
+            crud.Upload_new_movie(db, movie=movie, media={"video": writer})
+    def release():
+        with database.SessionLocal() as db:
+            crud.release_media(db, [existing.key])
+    uploader = threading.Thread(target=upload)
+    uploader.start()
+    assert indexing.wait(5)
+    releaser = threading.Thread(target=release)
+    releaser.start()
+    releaser.join(0.2)
+    assert releaser.is_alive()
+    resume.set()
+    uploader.join()
+    releaser.join()
+
+    assert store.size(existing.key) == existing.size
+    with database.SessionLocal() as db:
+        crud.delete_movie(db, crud.get_movie_by_title(db, "Shared Blob"))
+    assert not list(Path(store.root).rglob(existing.checksum))
+
+
+# Stream movie files into the blob store 16
+MP4_BYTES = b"\x00\x00\x00\x18ftypmp42" + b"\x00" * 4096
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+def test_list_a_movie_with_files(test_db):
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    form = {
+        "title": "Uploaded Movie",
+        "genre": "Drama",
+        "description": "A movie with files",
+        "release_date": "2024-07-27"
+    }
+    response = client.post("/List_a_Movie/files/", data=form, files={
+        "videofile": ("movie.mp4", MP4_BYTES, "video/mp4"),
+        "coverfile": ("cover.png", PNG_BYTES, "image/png")
+    }, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["title"] == "Uploaded Movie"
+
+    # The declared content type is ignored; the bytes have to match
+    response = client.post("/List_a_Movie/files/", data=form, files={
+        "videofile": ("movie.mp4", b"not really a video", "video/mp4"),
+        "coverfile": ("cover.png", PNG_BYTES, "image/png")
+    }, headers=headers)
+    assert response.status_code == 415
+
+def test_failed_listing_leaves_no_blobs(test_db, monkeypatch):
+    import hashlib
+    from app.main import crud
+    from app.storage import get_blob_store
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+    form = {
+        "title": "Orphaned Upload",
+        "genre": "Drama",
+        "description": "Never listed",
+        "release_date": "2024-07-27"
+    }
+    video = MP4_BYTES + b"orphan"
+    store_root = Path(get_blob_store().root)
+    def stored(data):
+        return list(store_root.rglob(hashlib.sha256(data).hexdigest()))
+
+    # A valid video is not kept when the cover is rejected
+    response = client.post("/List_a_Movie/files/", data=form, files={
+        "videofile": ("movie.mp4", video, "video/mp4"),
+        "coverfile": ("cover.png", b"not really an image", "image/png")
+    }, headers=headers)
+    assert response.status_code == 415
+    assert not stored(video)
+
+    # Nor are both files when the movie row cannot be saved
+    def broken_index(db, movie, new=False):
+        raise RuntimeError("index unavailable")
+    monkeypatch.setattr(crud.search, "index_movie", broken_index)
+    cover = PNG_BYTES + b"orphan"
+    with pytest.raises(RuntimeError):
+        client.post("/List_a_Movie/files/", data=form, files={
+            "videofile": ("movie.mp4", video, "video/mp4"),
+            "coverfile": ("cover.png", cover, "image/png")
+        }, headers=headers)
+    assert not stored(video) and not stored(cover)
+    assert not list((store_root / "tmp").glob("*.part"))
+    assert client.get("/movie/Orphaned%20Upload").status_code == 404
+
+# Resumable multi-part upload 17
+def test_resumable_upload(test_db):
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    movie = client.get("/movie/Test%20Movie").json()
+    response = client.post("/uploads/", json={"movie_id": movie["movie_id"], "kind": "video"}, headers=headers)
+    assert response.status_code == 200
+    upload_id = response.json()["upload_id"]
+
+    # Parts can arrive out of order and be retried
+    assert client.put(f"/uploads/{upload_id}/parts/2", content=MP4_BYTES[2000:], headers=headers).status_code == 200
+    response = client.post(f"/uploads/{upload_id}/complete", headers=headers)
+    assert response.status_code == 400
+    assert client.put(f"/uploads/{upload_id}/parts/1", content=MP4_BYTES[:2000], headers=headers).status_code == 200
+
+    response = client.get(f"/uploads/{upload_id}", headers=headers)
+    assert [part["size"] for part in response.json()["parts"]] == [2000, len(MP4_BYTES) - 2000]
+
+    response = client.post(f"/uploads/{upload_id}/complete", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["movie_id"] == movie["movie_id"]
+    assert client.get(f"/uploads/{upload_id}", headers=headers).status_code == 404
+
+
+def test_resumable_upload_limits(test_db, monkeypatch):
+    from app.main import uploads
+    monkeypatch.setitem(uploads.MAX_BYTES, "video", 3000)
+    monkeypatch.setattr(uploads, "MAX_PARTS", 3)
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    movie = client.get("/movie/Test%20Movie").json()
+    upload_id = client.post("/uploads/", json={"movie_id": movie["movie_id"], "kind": "video"}, headers=headers).json()["upload_id"]
+
+    assert client.put(f"/uploads/{upload_id}/parts/4", content=b"x", headers=headers).status_code == 413
+    assert client.put(f"/uploads/{upload_id}/parts/1", content=b"x" * 2000, headers=headers).status_code == 200
+    # The running total counts every part, not just the one being written
+    assert client.put(f"/uploads/{upload_id}/parts/2", content=b"x" * 1500, headers=headers).status_code == 413
+    # Retrying a part replaces it rather than adding to the total
+    assert client.put(f"/uploads/{upload_id}/parts/1", content=b"x" * 2500, headers=headers).status_code == 200
+    response = client.get(f"/uploads/{upload_id}", headers=headers)
+    assert [part["size"] for part in response.json()["parts"]] == [2500]
+
+
+# Stream a movie video with Range requests 18
+def test_stream_movie_video(test_db):
+    movie = client.get("/movie/Test%20Movie").json()
+    url = f"/movie/{movie['movie_id']}/video"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == MP4_BYTES
+    assert response.headers["accept-ranges"] == "bytes"
+    etag = response.headers["etag"]
+    assert "last-modified" in response.headers
+
+    response = client.get(url, headers={"Range": "bytes=4-11"})
+    assert response.status_code == 206
+    assert response.content == b"ftypmp42"
+    assert response.headers["content-range"] == f"bytes 4-11/{len(MP4_BYTES)}"
+
+    response = client.get(url, headers={"Range": "bytes=-10"})
+    assert response.status_code == 206
+    assert response.content == MP4_BYTES[-10:]
+
+    response = client.get(url, headers={"Range": f"bytes={len(MP4_BYTES)}-"})
+    assert response.status_code == 416
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+# Look movies up by slug and id 19
+def test_movie_slug_and_id_routes(test_db):
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    movie = client.get("/movie/Test%20Movie").json()
+    assert movie["slug"] == "test-movie"
+    # Titles are normalized, so any spelling of the same title resolves
+    assert client.get("/movie/test-movie").json()["movie_id"] == movie["movie_id"]
+
+    response = client.get(f"/movies/{movie['movie_id']}")
+    assert response.status_code == 200
+    assert response.json()["title"] == "Test Movie"
+    assert client.get("/movies/999999").status_code == 404
+
+    # A second movie with the same title gets its own slug
+    duplicate = client.post("/List_a_Movie/", json={
+        "title": "Test Movie",
+        "genre": "Duplicate",
+        "description": "Same title, different movie",
+        "release_date": "2024-07-27"
+    }, headers=headers).json()
+    assert duplicate["slug"] == "test-movie--2"
+    assert client.get("/movie/Test%20Movie").json()["movie_id"] == movie["movie_id"]
+
+    # The suffix cannot collide with a real title: "Heat", "Heat", "Heat 2"
+    heats = [client.post("/List_a_Movie/", json={
+        "title": title, "genre": "Slug", "description": "Slug collision", "release_date": "1995-12-15"
+    }, headers=headers).json() for title in ("Slug Heat", "Slug Heat", "Slug Heat 2")]
+    assert [heat["slug"] for heat in heats] == ["slug-heat", "slug-heat--2", "slug-heat-2"]
+    assert client.get("/movie/Slug%20Heat%202").json()["movie_id"] == heats[2]["movie_id"]
+    for heat in heats:
+        client.delete(f"/movies/{heat['movie_id']}", headers=headers)
+
+    response = client.put(f"/movies/{duplicate['movie_id']}", json={"title": "Renamed Duplicate"}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["slug"] == "renamed-duplicate"
+    assert response.json()["genre"] == "Duplicate"
+
+    response = client.delete(f"/movies/{duplicate['movie_id']}", headers=headers)
+    assert response.status_code == 200
+    assert client.get(f"/movies/{duplicate['movie_id']}").status_code == 404
+
+
+# Rating totals are kept up to date on write 20
+def test_rating_stats(test_db):
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    movie = client.post("/List_a_Movie/", json={
+        "title": "Rated Movie",
+        "genre": "Drama",
+        "description": "A movie to rate",
+        "release_date": "2024-07-27"
+    }, headers=headers).json()
+    assert client.get(f"/movies/{movie['movie_id']}/ratings").status_code == 404
+
+    response = client.post(f"/movies/{movie['movie_id']}/ratings", json={"rating": 6}, headers=headers)
+    assert response.status_code == 422
+    response = client.post(f"/movies/{movie['movie_id']}/ratings", json={"rating": 4}, headers=headers)
+    assert response.status_code == 200
+
+    response = client.get("/ratings/Rated%20Movie")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["title"] == "Rated Movie"
+    assert float(data["rating"]) == 4.0
+    assert data["rating_count"] == 1
+    assert data["histogram"] == {"1": 0, "2": 0, "3": 0, "4": 1, "5": 0}
+
+
+# Re-rating is rejected unless the client asks to update 21
+def test_rating_upsert(test_db):
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    movie = client.get("/movie/Rated%20Movie").json()
+    url = f"/movies/{movie['movie_id']}/ratings"
+
+    response = client.post(url, json={"rating": 2}, headers=headers)
+    assert response.status_code == 400
+
+    response = client.post(url, params={"update_existing": True}, json={"rating": 2}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["detail"] == "Rating updated successfully"
+
+    data = client.get(url).json()
+    assert data["rating_count"] == 1
+    assert float(data["rating"]) == 2.0
+    assert data["histogram"] == {"1": 0, "2": 1, "3": 0, "4": 0, "5": 0}
+
+
+# Bulk rating from a JSON list or an NDJSON stream 22
+def test_bulk_rate_movies(test_db):
+    client.post("/signup", json={
+        "full_name": "Bulk Rater",
+        "username": "bulkrater",
+        "password": "bulkpassword",
+        "email": "bulkrater@example.com"
+    })
+    login_response = client.post("/login/", data={
+        "username": "bulkrater",
+        "password": "bulkpassword"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    rated = client.get("/movie/Rated%20Movie").json()
+    response = client.post("/ratings/bulk", json=[
+        {"movie_title": "Test Movie", "rating": 5},
+        {"movie_id": rated["movie_id"], "rating": 4},
+        {"movie_title": "Rated Movie", "rating": 1},
+        {"movie_title": "No Such Movie", "rating": 3},
+        {"movie_title": "Test Movie", "rating": 9},
+    ], headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert [result["status"] for result in data["results"]] == ["created", "created", "duplicate", "movie_not_found", "invalid"]
+    assert (data["created"], data["updated"], data["failed"]) == (2, 0, 3)
+
+    lines = b'{"movie_title": "Test Movie", "rating": 3}\n{"movie_title": "Rated Movie", "rating": 4}\nnot json\n'
+    response = client.post("/ratings/bulk", params={"update_existing": True}, content=lines,
+                           headers={**headers, "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200, response.text
+    assert [result["status"] for result in response.json()["results"]] == ["updated", "updated", "invalid"]
+
+    data = client.get(f"/movies/{rated['movie_id']}/ratings").json()
+    assert data["rating_count"] == 2
+    assert data["histogram"] == {"1": 0, "2": 1, "3": 0, "4": 1, "5": 0}
+
+
+# Read-through cache 23
+class FakeRedis:
+    """Just enough of the Redis client for the shared cache tier."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+def test_read_through_cache():
+    import threading
+    import time
+    from app.cache import LRUCache, SharedCache, ReadThroughCache
+
+    local = LRUCache(max_entries=2, ttl=60)
+    local.set("a", 1)
+    local.set("b", 2)
+    local.get("a")
+    local.set("c", 3)
+    assert (local.get("a"), local.get("b"), local.get("c")) == (1, None, 3)
+
+    shared = SharedCache(FakeRedis())
+    cache = ReadThroughCache(LRUCache(), shared)
+    assert cache.get_or_load("movie", lambda: {"title": "Cached"}) == {"title": "Cached"}
+    # A fresh process still finds the value in the shared tier
+    assert ReadThroughCache(LRUCache(), shared).get_or_load("movie", lambda: None) == {"title": "Cached"}
+    cache.invalidate("movie")
+    assert shared.get("movie")[0] is None
+
+    calls = []
+    def slow_loader():
+        calls.append(1)
+        time.sleep(0.2)
+        return "loaded"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("hot", slow_loader))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["loaded"] * 8
+    assert len(calls) == 1
+
+    # A load that read the old row before a write invalidated the key must not
+    # keep it, here or in the shared tier other workers read from
+    other_worker = ReadThroughCache(LRUCache(), shared)
+    def racing_loader():
+        other_worker.invalidate("raced")
+        return "old"
+    assert cache.get_or_load("raced", racing_loader) == "old"
+    assert shared.get("raced")[0] is None
+    assert other_worker.get_or_load("raced", lambda: "new") == "new"
+    assert ReadThroughCache(LRUCache(), shared).get_or_load("raced", lambda: "unused") == "new"
+
+    def locally_racing_loader():
+        cache.invalidate("raced here")
+        return "old"
+    assert cache.get_or_load("raced here", locally_racing_loader) == "old"
+    assert cache.get_or_load("raced here", lambda: "new") == "new"
+
+def test_cached_comments_are_invalidated(test_db):
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    before = client.get("/comments/Test%20Movie").json()
+    client.post("/comment/Test%20Movie", json={
+        "content": "Cache busting comment",
+        "created_at": "2024-07-23"
+    }, headers=headers)
+    after = client.get("/comments/Test%20Movie").json()
+    assert len(after) == len(before) + 1
+
+# Async engine 24
+def test_async_database_url():
+    from app.database import async_url
+    assert async_url("postgresql://u:p@db/movies") == "postgresql+asyncpg://u:p@db/movies"
+    assert async_url("sqlite:////tmp/test.db") == "sqlite+aiosqlite:////tmp/test.db"
+    assert async_url("postgresql+asyncpg://u:p@db/movies") == "postgresql+asyncpg://u:p@db/movies"
+
+def test_async_and_sync_movie_pages_match(test_db):
+    import asyncio
+    from app.main import crud, async_crud, database
+
+    async def async_page():
+        async with database.AsyncSessionLocal() as db:
+            return await async_crud.view_all_movies(db, limit=5)
+
+    with database.SessionLocal() as db:
+        sync_page = crud.view_all_movies(db, limit=5)
+    page = asyncio.run(async_page())
+    assert [movie.movie_id for movie in page["movies"]] == [movie.movie_id for movie in sync_page["movies"]]
+    assert page["next_cursor"] == sync_page["next_cursor"]
+
+# Password hashing off the event loop and login rate limiting 25
+def test_reset_password_hashes_once(test_db):
+    from app.main import hashing
+    client.post("/signup/", json={
+        "full_name": "Reset User",
+        "username": "resetuser",
+        "email": "resetuser@example.com",
+        "password": "oldpassword"
+    })
+    token = client.post("/login/", data={"username": "resetuser", "password": "oldpassword"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    same = client.put("/reset_password/resetuser@example.com", json={"password": "oldpassword"}, headers=headers)
+    assert same.status_code == 400
+
+    before = hashing.hash_pool.stats()["completed"]
+    response = client.put("/reset_password/resetuser@example.com", json={"password": "newpassword"}, headers=headers)
+    assert response.status_code == 200
+    # One verify against the old hash, one hash of the new password
+    assert hashing.hash_pool.stats()["completed"] - before == 2
+    assert client.post("/login/", data={"username": "resetuser", "password": "newpassword"}).status_code == 200
+
+def test_login_rate_limit(test_db):
+    from app.main import ratelimit
+    for _ in range(ratelimit.login_failures.limit):
+        response = client.post("/login/", data={"username": "testuser", "password": "wrong"})
+        assert response.status_code == 401
+    response = client.post("/login/", data={"username": "testuser", "password": "testpassword"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+    ratelimit.login_failures.reset("testuser")
+    assert client.post("/login/", data={"username": "testuser", "password": "testpassword"}).status_code == 200
+
+def test_rate_limiter_refills():
+    import time
+    from app.ratelimit import RateLimiter
+    limiter = RateLimiter(limit=2, period=0.2)
+    assert limiter.hit("a") == 0
+    assert limiter.hit("a") == 0
+    assert limiter.hit("a") > 0
+    assert limiter.hit("b") == 0
+    time.sleep(0.15)
+    assert limiter.hit("a") == 0
+
+# JWT claims, cached current user and refresh tokens 26
+def test_refresh_token_and_revocation(test_db):
+    client.post("/signup/", json={
+        "full_name": "Token User",
+        "username": "tokenuser",
+        "email": "tokenuser@example.com",
+        "password": "firstpassword"
+    })
+    tokens = client.post("/login/", data={"username": "tokenuser", "password": "firstpassword"}).json()
+    assert tokens["token_type"] == "bearer"
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    # A refresh token is not accepted as an access token, nor the reverse
+    assert client.put("/reset_password/tokenuser@example.com", json={"password": "x"},
+                      headers={"Authorization": f"Bearer {tokens['refresh_token']}"}).status_code == 401
+    assert client.post("/token/refresh", json={"refresh_token": tokens["access_token"]}).status_code == 401
+
+    refreshed = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert refreshed.status_code == 200
+    new_headers = {"Authorization": f"Bearer {refreshed.json()['access_token']}"}
+
+    assert client.put("/reset_password/tokenuser@example.com", json={"password": "secondpassword"}, headers=headers).status_code == 200
+    # The password change bumps the token version, revoking both kinds of token
+    assert client.put("/reset_password/tokenuser@example.com", json={"password": "thirdpassword"}, headers=new_headers).status_code == 401
+    assert client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+
+# Pool configuration and health check 27
+def test_healthz_reports_pools():
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    report = response.json()
+    assert report["status"] == "ok"
+    assert report["database"]["sync"]["ok"] and report["database"]["async"]["ok"]
+    for pool in ("sync", "async"):
+        stats = report["pools"][pool]
+        assert stats["checkouts"] >= 1
+        assert 0 <= stats["utilization"] <= 1
+        assert stats["timeouts"] == 0
+
+def test_pool_checkout_timeout_is_counted(tmp_path):
+    from sqlalchemy import create_engine, exc
+    from sqlalchemy.pool import QueuePool
+    from app.dbpool import PoolStats, timed_pool
+    stats = PoolStats()
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=timed_pool(QueuePool, stats),
+                           pool_size=1, max_overflow=0, pool_timeout=0.05)
+    held = engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    held.close()
+    snapshot = stats.snapshot(engine.pool)
+    assert snapshot["timeouts"] == 1
+    assert snapshot["checkouts"] == 1
+    engine.dispose()
+
+# Read replicas with read-your-writes stickiness 28
+def test_reads_route_to_replica(tmp_path):
+    import time
+    from app.main import replicas, database, crud
+    replica_set = replicas.ReplicaSet([f"sqlite:///{tmp_path / 'replica.db'}"])
+    replica = replica_set.replicas[0]
+    # The replica is an empty copy of the schema, so its answers are easy to tell apart
+    schema_engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    database.Base.metadata.create_all(bind=schema_engine)
+    schema_engine.dispose()
+    primary_set = replicas.replica_set
+    replicas.replica_set = replica_set
+    try:
+        reader = TestClient(app)
+        with database.SessionLocal() as db:
+            assert crud.view_all_movies(db)["movies"]
+            movie = crud.get_movie_by_title(db, "Test Movie")
+            crud.cache.invalidate(*crud.movie_keys(movie.movie_id, movie.slug))
+        assert reader.get("/movies/").json()["movies"] == []
+        # Cache misses load through the replica too
+        assert reader.get(f"/movies/{movie.movie_id}").status_code == 404
+
+        # A write makes this client read from the primary for a while
+        assert reader.post("/login/", data={"username": "testuser", "password": "testpassword"}).status_code == 200
+        assert replicas.STICKY_COOKIE in reader.cookies
+        assert reader.get("/movies/").json()["movies"]
+        assert reader.get(f"/movies/{movie.movie_id}").status_code == 200
+
+        # A lagging replica is skipped until it catches up
+        other = TestClient(app)
+        replica.lag = replicas.REPLICA_MAX_LAG_SECONDS + 1
+        replica.checked_at = time.monotonic()
+        assert other.get("/movies/").json()["movies"]
+        assert client.get("/healthz").json()["replicas"][0]["usable"] is False
+    finally:
+        replicas.replica_set = primary_set
+
+def test_cached_reads_with_lagging_replica(tmp_path, monkeypatch):
+    import time
+    import sqlite3
+    from app.main import replicas, database, crud
+    # A snapshot of the primary that never replays anything newer, yet reports
+    # no lag: the worst replica that still gets reads
+    with sqlite3.connect(engine.url.database) as primary, sqlite3.connect(tmp_path / "replica.db") as snapshot:
+        primary.backup(snapshot)
+    replica_set = replicas.ReplicaSet([f"sqlite:///{tmp_path / 'replica.db'}"])
+    primary_set = replicas.replica_set
+    replicas.replica_set = replica_set
+    try:
+        writer = TestClient(app)
+        reader = TestClient(app)
+        token = writer.post("/login/", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        before = reader.get("/comments/Test%20Movie").json()
+        assert writer.post("/comment/Test%20Movie", json={
+            "content": "Written while the replica lags",
+            "created_at": "2024-07-23"
+        }, headers=headers).status_code == 200
+        # The writer reads its own comment from the primary; the reader's miss
+        # after the invalidation loads the replica's older copy, which is only
+        # kept as long as a usable replica may lag
+        assert len(writer.get("/comments/Test%20Movie").json()) == len(before) + 1
+        monkeypatch.setattr(crud, "REPLICA_MAX_LAG_SECONDS", 0.5)
+        assert len(reader.get("/comments/Test%20Movie").json()) == len(before)
+        movie_id = reader.get("/movie/Test%20Movie").json()["movie_id"]
+        expires_at, _ = crud.cache.local._entries[f"comments:{movie_id}"]
+        assert expires_at - time.monotonic() <= 0.5
+        crud.cache.invalidate(f"comments:{movie_id}")
+
+        # A client that has just written reads around the cache
+        movie = reader.get("/movie/Test%20Movie").json()
+        crud.cache.local.set(f"movie:id:{movie['movie_id']}", {**movie, "description": "Stale"})
+        assert reader.get(f"/movies/{movie['movie_id']}").json()["description"] == "Stale"
+        assert writer.get(f"/movies/{movie['movie_id']}").json() == movie
+        crud.cache.invalidate(f"movie:id:{movie['movie_id']}")
+    finally:
+        replicas.replica_set = primary_set
+
+# Full-text search 29
+def test_search_movies(test_db):
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    submarine = client.post("/List_a_Movie/", json={
+        "title": "Deep Blue Submarine",
+        "genre": "Thriller",
+        "description": "A stranded submarine crew races the tide beneath arctic ice",
+        "release_date": "2001-05-01"
+    }, headers=headers).json()
+    client.post("/List_a_Movie/", json={
+        "title": "Arctic Summer",
+        "genre": "Drama",
+        "description": "Two sisters spend a quiet summer on the arctic coast",
+        "release_date": "2003-06-01"
+    }, headers=headers)
+
+    response = client.get("/movies/search", params={"q": "arctic"})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    # A title match outranks a description match
+    assert [hit["movie"]["title"] for hit in results[:2]] == ["Arctic Summer", "Deep Blue Submarine"]
+    assert "<mark>arctic</mark>" in results[1]["snippet"]
+
+    # Markup in a description comes back escaped; only the highlights are tags
+    client.post("/List_a_Movie/", json={
+        "title": "Markup Movie",
+        "genre": "Drama",
+        "description": "A glacier <img src=x onerror=alert(1)> & <b>friends</b>",
+        "release_date": "2004-06-01"
+    }, headers=headers)
+    snippet = client.get("/movies/search", params={"q": "glacier"}).json()["results"][0]["snippet"]
+    assert snippet == "A <mark>glacier</mark> &lt;img src=x onerror=alert(1)&gt; &amp; &lt;b&gt;friends&lt;/b&gt;"
+
+    # Prefix matching on the last word, and genre filters
+    assert [hit["movie"]["title"] for hit in client.get("/movies/search", params={"q": "submar"}).json()["results"]] == ["Deep Blue Submarine"]
+    filtered = client.get("/movies/search", params={"q": "arctic", "genre": "Drama"}).json()["results"]
+    assert [hit["movie"]["title"] for hit in filtered] == ["Arctic Summer"]
+
+    first = client.get("/movies/search", params={"q": "arctic", "limit": 1}).json()
+    second = client.get("/movies/search", params={"q": "arctic", "limit": 1, "cursor": first["next_cursor"]}).json()
+    assert first["results"][0]["movie"]["title"] == "Arctic Summer"
+    assert second["results"][0]["movie"]["title"] == "Deep Blue Submarine"
+
+    # The index follows updates and deletes
+    client.put(f"/movies/{submarine['movie_id']}", json={"description": "A lighthouse keeper waits out a storm"}, headers=headers)
+    assert [hit["movie"]["title"] for hit in client.get("/movies/search", params={"q": "lighthouse"}).json()["results"]] == ["Deep Blue Submarine"]
+    client.delete(f"/movies/{submarine['movie_id']}", headers=headers)
+    assert client.get("/movies/search", params={"q": "lighthouse"}).json()["results"] == []
+    assert client.get("/movies/search", params={"q": "!!!"}).json()["results"] == []
+
+# Normalized genres with facet counts 30
+def test_browse_genres(test_db):
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    def list_movie(title, genre):
+        return client.post("/List_a_Movie/", json={
+            "title": title, "genre": genre, "description": "Genre test", "release_date": "2010-01-01"
+        }, headers=headers).json()
+
+    heist = list_movie("Genre Heist", "Crimewave, Noirish")
+    caper = list_movie("Genre Caper", "crimewave / Comedic")
+    list_movie("Genre Laughs", "Comedic")
+
+    facets = {facet["slug"]: facet["movie_count"] for facet in client.get("/genres/").json()}
+    assert facets["crimewave"] == 2 and facets["comedic"] == 2 and facets["noirish"] == 1
+
+    both = client.get("/genres/movies", params={"genre": ["Crimewave", "comedic"]}).json()
+    assert [movie["title"] for movie in both["movies"]] == ["Genre Caper"]
+    assert {facet["slug"] for facet in both["facets"]} >= {"crimewave", "comedic", "noirish"}
+
+    either = client.get("/genres/movies", params={"genre": ["noirish", "comedic"], "match": "any", "limit": 2}).json()
+    assert [movie["title"] for movie in either["movies"]] == ["Genre Heist", "Genre Caper"]
+    rest = client.get("/genres/movies", params={"genre": ["noirish", "comedic"], "match": "any", "limit": 2, "cursor": either["next_cursor"]}).json()
+    assert [movie["title"] for movie in rest["movies"]] == ["Genre Laughs"]
+    assert rest["next_cursor"] is None
+
+    assert client.get("/genres/movies", params={"genre": ["crimewave", "unknown"]}).json()["movies"] == []
+
+    # The movie list filters on any one of a movie's genres, not the whole string
+    listed = client.get("/movies/", params={"genre": "Noirish", "limit": 100}).json()["movies"]
+    assert [movie["title"] for movie in listed] == ["Genre Heist"]
+    listed = client.get("/movies/", params={"genre": "crimewave", "limit": 100}).json()["movies"]
+    assert [movie["title"] for movie in listed] == ["Genre Heist", "Genre Caper"]
+    first = client.get("/movies/", params={"genre": "crimewave", "limit": 1}).json()
+    second = client.get("/movies/", params={"genre": "crimewave", "limit": 1, "cursor": first["next_cursor"]}).json()
+    assert [movie["title"] for movie in first["movies"] + second["movies"]] == ["Genre Heist", "Genre Caper"]
+    # The genre page seeks on movie_genres' (genre_id, created_at, movie_id) index
+    from app.main import crud, database
+    statement, _ = crud.movies_page_statement(first["next_cursor"], 10, "crimewave")
+    compiled = statement.compile(engine)
+    with engine.connect() as connection:
+        plan = " ".join(str(row[-1]) for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), tuple(compiled.params[name] for name in compiled.positiontup)))
+    assert "ix_movie_genres_genre_id_created_at_movie_id" in plan and "TEMP B-TREE" not in plan
+    found = client.get("/movies/search", params={"q": "genre test", "genre": ["noirish"]}).json()["results"]
+    assert [hit["movie"]["title"] for hit in found] == ["Genre Heist"]
+    found = client.get("/movies/search", params={"q": "genre test", "genre": ["Noirish", "comedic"]}).json()["results"]
+    assert {hit["movie"]["title"] for hit in found} == {"Genre Heist", "Genre Caper", "Genre Laughs"}
+
+    # Counts follow edits and deletes
+    client.put(f"/movies/{heist['movie_id']}", json={"genre": "Comedic"}, headers=headers)
+    client.delete(f"/movies/{caper['movie_id']}", headers=headers)
+    facets = {facet["slug"]: facet["movie_count"] for facet in client.get("/genres/").json()}
+    assert "crimewave" not in facets and "noirish" not in facets
+    assert facets["comedic"] == 2
+
+# Leaderboards 31
+def test_leaderboards(test_db):
+    from app.main import leaderboard, database
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    def list_movie(title):
+        return client.post("/List_a_Movie/", json={
+            "title": title, "genre": "Board", "description": "Leaderboard test", "release_date": "2012-01-01"
+        }, headers=headers).json()
+
+    quiet = list_movie("Quiet Board Movie")
+    busy = list_movie("Busy Board Movie")
+    client.post(f"/movies/{quiet['movie_id']}/ratings", json={"rating": 5}, headers=headers)
+    client.post(f"/movies/{busy['movie_id']}/ratings", json={"rating": 1}, headers=headers)
+    for text in ("first", "second"):
+        client.post(f"/movies/{busy['movie_id']}/comments", json={"content": text, "created_at": "2024-07-23"}, headers=headers)
+
+    top = {entry["movie"]["movie_id"]: entry for entry in client.get("/leaderboards/top-rated", params={"limit": 100}).json()}
+    mean = leaderboard._prior["mean"]
+    # One 5-star vote is pulled towards the catalog mean, not ranked as a perfect 5
+    assert top[quiet["movie_id"]]["score"] == pytest.approx((leaderboard.PRIOR_VOTES * mean + 5) / (leaderboard.PRIOR_VOTES + 1), abs=1e-3)
+    assert top[quiet["movie_id"]]["score"] > top[busy["movie_id"]]["score"]
+
+    trending = [entry["movie"]["movie_id"] for entry in client.get("/leaderboards/trending", params={"limit": 100}).json()]
+    assert trending.index(busy["movie_id"]) < trending.index(quiet["movie_id"])
+
+    # Rebuilding from the activity tables gives the same ordering
+    with database.SessionLocal() as db:
+        leaderboard.rebuild_trending(db)
+        db.commit()
+    rebuilt = [entry["movie"]["movie_id"] for entry in client.get("/leaderboards/trending", params={"limit": 100}).json()]
+    assert rebuilt.index(busy["movie_id"]) < rebuilt.index(quiet["movie_id"])
+
+    # A restarted worker recovers the mean the scores use and rewrites nothing
+    with database.SessionLocal() as db:
+        assert leaderboard.scored_mean(db) == pytest.approx(mean)
+        leaderboard.refresh(db)
+        current = leaderboard._prior["mean"]
+        leaderboard._prior["mean"] = None
+        with count_queries() as statements:
+            leaderboard.refresh(db)
+    assert [statement.split()[0] for statement in statements] == ["SELECT"] * len(statements)
+    assert leaderboard._prior["mean"] == pytest.approx(current)
+
+def test_trending_decay():
+    from datetime import datetime, timezone
+    from app.leaderboard import HALF_LIFE, decayed, growth
+    now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    assert decayed(growth(now - HALF_LIFE), now) == pytest.approx(0.5)
+    assert decayed(growth(now), now) == pytest.approx(1.0)
+    # Far past the point where 2 ** half-lives overflows a double
+    later = datetime(2400, 1, 1, tzinfo=timezone.utc)
+    assert decayed(growth(later - HALF_LIFE), later) == pytest.approx(0.5)
+    with pytest.raises(OverflowError):
+        2.0 ** ((later - datetime(2024, 1, 1, tzinfo=timezone.utc)) / HALF_LIFE)
+
+def test_trending_scores_after_overflow_point():
+    import math
+    from datetime import datetime, timezone
+    from sqlalchemy.orm import sessionmaker as make_sessions
+    from app.main import database, leaderboard, model
+    scratch = create_engine("sqlite://")
+    database.Base.metadata.create_all(bind=scratch)
+    later = datetime(2400, 1, 1, tzinfo=timezone.utc)
+    with make_sessions(bind=scratch)() as db:
+        db.add_all([model.User(user_id=1, full_name="x", username="x", email="x", hashed_password="x")])
+        db.add_all([model.Movies(movie_id=movie_id, title=str(movie_id), slug=str(movie_id), genre="g", description="d", release_date="2000-01-01") for movie_id in (1, 2)])
+        db.flush()
+        leaderboard.bump_trending(db, {1: 1.0, 2: 1.0}, at=later - leaderboard.HALF_LIFE)
+        leaderboard.bump_trending(db, {1: 1.0}, at=later)
+        db.commit()
+        scores = dict(db.query(model.MovieLeaderboard.movie_id, model.MovieLeaderboard.trending_score))
+    assert leaderboard.decayed(scores[1], later) == pytest.approx(1.5)
+    assert leaderboard.decayed(scores[2], later) == pytest.approx(0.5)
+    assert leaderboard.log_add(None, 1.0) == 1.0 and leaderboard.log_add(0.0, 0.0) == pytest.approx(math.log(2))
+
+# Threaded comments 32
+def test_comment_threads(test_db):
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+    movie = client.post("/List_a_Movie/", json={
+        "title": "Threaded Movie", "genre": "Drama", "description": "Thread test", "release_date": "2015-01-01"
+    }, headers=headers).json()
+    for _ in range(3):
+        client.post(f"/movies/{movie['movie_id']}/comments", json={"content": "Same words", "created_at": "2024-07-23"}, headers=headers)
+
+    # Identical comments are no longer collapsed into one
+    assert len(client.get(f"/movies/{movie['movie_id']}/comments").json()) == 3
+
+    first = client.get(f"/movies/{movie['movie_id']}/threads").json()["comments"][0]
+    for number in range(4):
+        client.post(f"/reply/?parent_comment_id={first['comment_id']}", json={"content": f"reply {number}"}, headers=headers)
+
+    with count_queries() as statements:
+        page = client.get(f"/movies/{movie['movie_id']}/threads", params={"limit": 2, "replies": 2}).json()
+    # Movie lookup, comment page and replies, however many comments are shown
+    assert len(statements) == 3
+
+    assert [comment["content"] for comment in page["comments"]] == ["Same words", "Same words"]
+    thread = page["comments"][0]
+    assert thread["reply_count"] == 4
+    assert [reply["content"] for reply in thread["replies"]] == ["reply 0", "reply 1"]
+    assert page["truncated_comment_ids"] == [first["comment_id"]]
+
+    rest = client.get("/threads/Threaded Movie", params={"limit": 2, "cursor": page["next_cursor"]}).json()
+    assert len(rest["comments"]) == 1 and rest["next_cursor"] is None
+    assert rest["comments"][0]["comment_id"] not in [comment["comment_id"] for comment in page["comments"]]
+
+# Round trips per write 33
+def test_write_round_trips(test_db):
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    from app.main import auth, crud, database, leaderboard
+    # User lookup on a cold cache, slug check, the movie INSERT, genre upsert
+    # and lookup, genre links, genre counts, the search index and rating
+    # totals; nothing is read back and a new movie has no old links or index
+    # row to look for
+    crud.cache.invalidate(crud.user_key(auth.decode_token(token)["uid"]))
+    with count_queries() as statements:
+        movie = client.post("/List_a_Movie/", json={
+            "title": "Round Trip Movie", "genre": "Drama", "description": "Query count test", "release_date": "2016-01-01"
+        }, headers=headers).json()
+    assert len(statements) == 9
+    assert not any("movie_genres.genre_id" in statement or "DELETE FROM movies_fts" in statement for statement in statements)
+
+    # Movie lookup, INSERT ... RETURNING and the trending bump
+    with count_queries() as statements:
+        response = client.post(f"/movies/{movie['movie_id']}/comments", json={"content": "Counted", "created_at": "2024-07-23"}, headers=headers)
+    assert response.json() == {"username": "testuser", "movie_title": "Round Trip Movie", "content": "Counted"}
+    assert len(statements) == 3
+
+    comment_id = client.get(f"/movies/{movie['movie_id']}/threads").json()["comments"][0]["comment_id"]
+    # Parent lookup, INSERT and the trending bump
+    with count_queries() as statements:
+        response = client.post(f"/reply/?parent_comment_id={comment_id}", json={"content": "Counted reply"}, headers=headers)
+    assert response.json()["reply"] == "Counted reply"
+    assert len(statements) == 3
+
+    # Movie lookup, the search index row replaced and the UPDATE; nothing is
+    # read back once it has been written
+    with count_queries() as statements:
+        response = client.put(f"/movies/{movie['movie_id']}", json={"description": "Recounted"}, headers=headers)
+    assert response.json()["description"] == "Recounted"
+    assert len(statements) == 4
+
+    # Movie lookup, the rating upsert, rating totals, top-rated score and the
+    # trending bump; an update leaves the trending score alone
+    with database.SessionLocal() as db:
+        leaderboard.prior_mean(db)
+    with count_queries() as statements:
+        response = client.post("/rating/", json={"movie_title": "Round Trip Movie", "rating": 4, "created_at": "2024-07-23"}, headers=headers)
+    assert response.json() == {"detail": "Rating added successfully"}
+    assert len(statements) == 5
+    with count_queries() as statements:
+        response = client.post("/rating/?update_existing=true", json={"movie_title": "Round Trip Movie", "rating": 2, "created_at": "2024-07-23"}, headers=headers)
+    assert response.json() == {"detail": "Rating updated successfully"}
+    assert len(statements) == 4
+
+    assert client.post("/reply/?parent_comment_id=999999", json={"content": "orphan"}, headers=headers).status_code == 404
+
+# Structured logging 34
+def test_structured_logging():
+    import json
+    import logging
+    import queue
+    from my_logging.logger import DroppingQueueHandler, JsonFormatter, RequestIdFilter, SamplingFilter, request_id_var
+
+    response = client.get("/", headers={"X-Request-ID": "req-123"})
+    assert response.headers["x-request-id"] == "req-123"
+    assert len(client.get("/").headers["x-request-id"]) == 32
+
+    handler = DroppingQueueHandler(queue.Queue(1))
+    handler.addFilter(RequestIdFilter())
+    token = request_id_var.set("req-456")
+    try:
+        for attempt in range(3):
+            handler.handle(logging.makeLogRecord({"msg": "rated %s", "args": (attempt,), "levelno": logging.INFO, "levelname": "INFO", "duration_ms": 1.5}))
+    finally:
+        request_id_var.reset(token)
+    # The queue holds one record; the rest are counted, never waited on
+    assert handler.dropped == 2
+    entry = json.loads(JsonFormatter().format(handler.queue.get_nowait()))
+    assert entry["message"] == "rated 0"
+    assert entry["request_id"] == "req-456"
+    assert entry["duration_ms"] == 1.5
+
+    never = SamplingFilter(0)
+    assert not never.filter(logging.makeLogRecord({"levelno": logging.INFO}))
+    assert never.filter(logging.makeLogRecord({"levelno": logging.WARNING}))
+
+# Metrics 35
+def test_metrics():
+    response = client.get("/movies/", params={"limit": 2})
+    assert response.status_code == 200
+    timing = response.headers["server-timing"]
+    assert timing.startswith("app;dur=") and 'db;dur=' in timing and "queries" in timing
+    # The async read path runs its page query through the instrumented engine
+    assert int(timing.split('desc="')[1].split(" ")[0]) >= 1
+    client.get("/movies/1")
+
+    body = client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/movies/",status="200"}' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/movies/",le="+Inf"}' in body
+    # Ids are folded into the route template
+    assert 'route="/movies/{movie_id:int}"' in body and 'route="/movies/1"' not in body
+    assert 'http_request_db_queries_count{method="GET",route="/movies/"}' in body
+    assert 'db_pool_checked_out{pool="sync"}' in body
+    assert "log_records_dropped_total" in body
+
+# Slow query log 36
+def test_slow_query_log(test_db):
+    from sqlalchemy.orm import sessionmaker as make_sessions
+    from app.main import auth, crud, database, slowlog
+
+    assert slowlog.normalize_sql("SELECT * FROM movies WHERE movie_id IN (?, ?, ?) AND title = 'x'  LIMIT 10") == \
+        "SELECT * FROM movies WHERE movie_id IN (?, ...) AND title = ? LIMIT ?"
+    assert slowlog.param_shape((1, 2, 3, "a", None)) == "(int x3, str, null)"
+
+    # Profile every statement on a scratch engine and explain all of them
+    scratch = create_engine("sqlite://")
+    database.Base.metadata.create_all(bind=scratch)
+    report = slowlog.SlowQueryLog()
+    slowlog.profile_queries(scratch, threshold_ms=0, explain_rate=1, log=report)
+    with make_sessions(bind=scratch)() as db:
+        crud.get_user_by_username(db, "nobody")
+    entry = next(entry for entry in report.top() if "FROM users" in entry["sql"])
+    assert entry["callers"] == {"crud.get_user_by_username": 1}
+    assert entry["param_shapes"] == ["(str, int x2)"]
+    assert "users" in entry["plan"]
+
+    # Plans are taken in a savepoint that leaves the caller's transaction
+    # alone, DML is never explained, and none of it counts as a request query
+    from app.main import metrics, model
+    metrics.track_queries(scratch)
+    stats = metrics.RequestStats()
+    token = metrics.request_stats.set(stats)
+    try:
+        with make_sessions(bind=scratch)() as db:
+            db.add(model.User(full_name="Explained", username="explained", hashed_password="x", email="explained@test"))
+            db.flush()
+            assert crud.get_user_by_username(db, "explained") is not None
+            db.commit()
+            assert crud.get_user_by_username(db, "explained") is not None
+    finally:
+        metrics.request_stats.reset(token)
+    assert stats.queries == 3
+    assert not any(entry["sql"].startswith("INSERT") and entry["plan"] for entry in report.top())
+
+    login_response = client.post("/login/", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+    assert client.get("/admin/slow-queries", headers=headers).status_code == 403
+    auth.ADMIN_USERNAMES.add("testuser")
+    try:
+        response = client.get("/admin/slow-queries", params={"order": "max_ms"}, headers=headers)
+    finally:
+        auth.ADMIN_USERNAMES.discard("testuser")
+    assert response.status_code == 200
+    assert response.json()["enabled"] is False
+
+# Bulk import 37
+def test_bulk_import(tmp_path):
+    import sqlalchemy
+    from sqlalchemy.orm import sessionmaker as make_sessions
+    from app.main import database, model
+    import bulkimport, search
+
+    (tmp_path / "users.csv").write_text(
+        "full_name,username,email,hashed_password,password\n"
+        "Alice Import,alice_import,alice@import.test,$2b$12$notarealhashnotarealhashnotarealhashnotarealhas,\n"
+        "Bob Import,bob_import,bob@import.test,,bobpassword\n"
+        "No Email,no_email,,,secret\n"
+    )
+    (tmp_path / "movies.ndjson").write_text("\n".join([
+        '{"title": "Import Heist", "genre": "Crimewave, Noirish", "description": "A bank job", "release_date": "2001-05-04", "username": "alice_import"}',
+        '{"title": "Import Heist", "genre": "Comedic", "description": "The remake", "release_date": "2021-05-04"}',
+        '{"title": "Orphan Import", "genre": "Drama", "description": "Nobody posted it", "release_date": "2000-01-01", "username": "ghost"}',
+        '{"title": "Broken',
+    ]) + "\n")
+    (tmp_path / "ratings.csv").write_text(
+        "movie_title,movie_id,username,rating,created_at\n"
+        "Import Heist,,alice_import,5,2024-01-01T10:00:00Z\n"
+        "Import Heist,,bob_import,3,\n"
+        "Import Heist,,alice_import,1,\n"
+        "Missing Movie,,bob_import,4,\n"
+        "Import Heist,,bob_import,7,\n"
+    )
+    (tmp_path / "comments.csv").write_text(
+        "movie_title,username,content\n"
+        "Import Heist,bob_import,Great heist\n"
+    )
+
+    scratch = create_engine(f"sqlite:///{tmp_path / 'catalog.db'}")
+    database.Base.metadata.create_all(bind=scratch)
+    with make_sessions(bind=scratch)() as db:
+        report = bulkimport.import_catalog(db, {
+            phase: tmp_path / name
+            for phase, name in [("users", "users.csv"), ("movies", "movies.ndjson"), ("ratings", "ratings.csv"), ("comments", "comments.csv")]
+        }, batch_size=2)
+    phases = {entry["phase"]: entry for entry in report}
+    assert {key: phases["users"][key] for key in ("read", "invalid", "imported", "skipped")} == {"read": 3, "invalid": 1, "imported": 2, "skipped": 0}
+    assert {key: phases["movies"][key] for key in ("read", "invalid", "imported", "skipped")} == {"read": 4, "invalid": 1, "imported": 2, "skipped": 1}
+    assert {key: phases["ratings"][key] for key in ("read", "invalid", "imported", "skipped")} == {"read": 5, "invalid": 1, "imported": 2, "skipped": 2}
+    assert phases["comments"]["imported"] == 1
+    assert phases["indexes"]["rebuilt"] > 0
+
+    with make_sessions(bind=scratch)() as db:
+        movies = {movie.slug: movie for movie in db.query(model.Movies)}
+        assert set(movies) == {"import-heist", "import-heist--2"}
+        heist = movies["import-heist"]
+        assert heist.posted_by.username == "alice_import" and heist.release_year == 2001
+        assert movies["import-heist--2"].user_id is None
+
+        bob = db.query(model.User).filter(model.User.username == "bob_import").one()
+        assert pwd_context.verify("bobpassword", bob.hashed_password)
+        rating = db.query(model.Rating).filter(model.Rating.user_id == heist.user_id).one()
+        assert rating.rating == 5 and rating.created_at == datetime(2024, 1, 1, 10, 0)
+
+        stats = db.get(model.MovieRatingStats, heist.movie_id)
+        assert (stats.rating_count, stats.rating_sum, stats.stars_3, stats.stars_5) == (2, 8, 1, 1)
+        assert db.get(model.MovieRatingStats, movies["import-heist--2"].movie_id).rating_count == 0
+        counts = dict(db.execute(
+            sqlalchemy.select(model.Genre.slug, model.GenreCount.movie_count).join(model.GenreCount, model.GenreCount.genre_id == model.Genre.genre_id)
+        ).all())
+        assert counts == {"crimewave": 1, "noirish": 1, "comedic": 1}
+        assert db.query(model.MovieGenre).filter(model.MovieGenre.movie_id == heist.movie_id).first().created_at == heist.created_at
+
+        board = db.get(model.MovieLeaderboard, heist.movie_id)
+        assert board.top_score is not None and board.trending_score is not None
+
+        statement, limit, offset = search.search_statement("sqlite", "heist")
+        assert {row[0].movie_id for row in db.execute(statement)} == {movie.movie_id for movie in movies.values()}
+
+    indexes = {index["name"] for index in sqlalchemy.inspect(scratch).get_indexes("ratings")}
+    assert "ix_ratings_movie_id_user_id" in indexes